@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+#
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""Microbenchmarks for the pure-Python code that runs once per file or once
+per row.
+
+Every benchmark runs on synthetic input of N rows (or files, or lines), for
+every N in --sizes (default: 1000, 100000, 1000000).  For every benchmark and
+size, records
+- the best wall time of --repeat runs, and
+- the peak memory allocated during one more run, traced with tracemalloc
+  (which is slow, so it is measured separately from the time).
+
+No FFmpeg or media files are needed.  Run from the distribution's root
+directory:
+
+    python benchmarks/hotpaths.py [--sizes N,...] [--only NAME,...] [--save FILE]
+
+--save appends the results as one JSON line to FILE, so that they can be
+compared across commits (the current git revision is recorded).
+
+Before timing, check() makes sure that the code under test still gives the
+expected results; if not, nothing is timed and the exit status is 1.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "src"))
+
+from czavsuite import clp, config, convert, probing, records # noqa: E402
+
+
+SIZES = [ 1000, 100000, 1000000 ]
+
+_VIDEO_STREAM = [ "[STREAM]", "index=0", "codec_name=h264", "codec_type=video",
+                  "width=1920", "height=1080", "display_aspect_ratio=16:9",
+                  "avg_frame_rate=30000/1001", "bit_rate=4987654", "nb_frames=53947",
+                  "TAG:handler_name=VideoHandler", "[/STREAM]" ]
+
+
+# 'ffprobe -show_streams -show_format' output of a typical camera file, with
+# all the properties that ffprobe prints
+_PROBE_OUTPUT = "\n".join(
+    [ "[STREAM]", "index=0", "codec_name=h264", "codec_long_name=H.264 / AVC / MPEG-4 AVC",
+      "profile=High", "codec_type=video", "codec_tag_string=avc1", "codec_tag=0x31637661",
+      "width=1920", "height=1080", "coded_width=1920", "coded_height=1080",
+      "closed_captions=0", "film_grain=0", "has_b_frames=1", "sample_aspect_ratio=1:1",
+      "display_aspect_ratio=16:9", "pix_fmt=yuv420p", "level=40", "color_range=tv",
+      "color_space=bt709", "color_transfer=bt709", "color_primaries=bt709",
+      "chroma_location=left", "field_order=progressive", "refs=1", "is_avc=true",
+      "nal_length_size=4", "id=0x1", "r_frame_rate=30000/1001",
+      "avg_frame_rate=30000/1001", "time_base=1/30000", "start_pts=0",
+      "start_time=0.000000", "duration_ts=53947000", "duration=1798.233333",
+      "bit_rate=4987654", "bits_per_raw_sample=8", "nb_frames=53947",
+      "extradata_size=42", "DISPOSITION:default=1", "TAG:language=und",
+      "TAG:handler_name=VideoHandler", "TAG:vendor_id=[0][0][0][0]", "[/STREAM]",
+      "[STREAM]", "index=1", "codec_name=aac", "codec_long_name=AAC (Advanced Audio Coding)",
+      "profile=LC", "codec_type=audio", "codec_tag_string=mp4a", "codec_tag=0x6134706d",
+      "sample_fmt=fltp", "sample_rate=48000", "channels=2", "channel_layout=stereo",
+      "bits_per_sample=0", "initial_padding=0", "id=0x2", "r_frame_rate=0/0",
+      "avg_frame_rate=0/0", "time_base=1/48000", "start_pts=0", "start_time=0.000000",
+      "duration_ts=86315000", "duration=1798.229167", "bit_rate=128000",
+      "nb_frames=84292", "extradata_size=2", "DISPOSITION:default=1",
+      "TAG:language=und", "TAG:handler_name=SoundHandler", "TAG:vendor_id=[0][0][0][0]",
+      "[/STREAM]", "[FORMAT]", "nb_streams=2", "format_name=mov,mp4,m4a,3gp,3g2,mj2",
+      "duration=1798.233333", "size=1149921280", "bit_rate=5115802", "[/FORMAT]" ])
+
+
+def _files(n: int) -> list:
+    return [ "videos/2023/holidays/clip-%07d.mov" % i for i in range(n) ]
+#_files
+
+
+def _videoProbe(i: int) -> records.VideoStream:
+    return records.VideoStream.fromProbe({ "codec_name": "h264", "width": "1920", "height": "1080",
+             "display_aspect_ratio": "16:9", "avg_frame_rate": "%d/1001" % (30000 + i % 7),
+             "bit_rate": str(4000000 + i) })
+#_videoProbe
+
+
+def _audioProbe(i: int) -> records.AudioStream:
+    return records.AudioStream.fromProbe({ "codec_name": "aac", "sample_rate": "48000",
+                                           "channel_layout": "stereo",
+                                           "bit_rate": str(128000 + i) })
+#_audioProbe
+
+
+# Every setup function returns the function to time; its argument is built
+# beforehand, so only the code under test is measured.
+
+def setupFFprobeDict(n: int):
+    """_ffprobeDict on n lines of ffprobe -show_streams output"""
+    lines = (_VIDEO_STREAM * (n // len(_VIDEO_STREAM) + 1))[:n]
+    return lambda: probing._ffprobeDict(lines)
+#setupFFprobeDict
+
+
+def setupTable2String(n: int):
+    """_table2String on a table of n rows"""
+    tm = probing.TableMaker()
+    tm.addHeader(config.Probing.VIDEO)
+    for i, file in enumerate(_files(n - 2)):
+        tm.addVideo(file, _videoProbe(i))
+    #for
+    table = tm.get()
+    return lambda: probing._table2String(table)
+#setupTable2String
+
+
+def setupAddVideo(n: int):
+    """TableMaker.addVideo for n files"""
+    files = _files(n)
+    probes = [ _videoProbe(i) for i in range(n) ]
+
+    def run():
+        tm = probing.TableMaker()
+        for file, probe in zip(files, probes):
+            tm.addVideo(file, probe)
+        #for
+    #run
+
+    return run
+#setupAddVideo
+
+
+def setupAddAudio(n: int):
+    """TableMaker.addAudio for n files"""
+    files = _files(n)
+    probes = [ _audioProbe(i) for i in range(n) ]
+
+    def run():
+        tm = probing.TableMaker()
+        for file, probe in zip(files, probes):
+            tm.addAudio(file, probe)
+        #for
+    #run
+
+    return run
+#setupAddAudio
+
+
+def setupProbeDicts(n: int):
+    """the probe results of n files kept as dicts (one per stream, as
+    _ffprobeDict returns them)"""
+    blocks = [ block.split(sep='\n') for block in _PROBE_OUTPUT.split("[/STREAM]")[:2] ]
+    return lambda: [ [ probing._ffprobeDict(block) for block in blocks ] for _ in range(n) ]
+#setupProbeDicts
+
+
+def setupProbeRecords(n: int):
+    """the probe results of n files kept as records.ProbeRecord"""
+    return lambda: [ records.parse(_PROBE_OUTPUT) for _ in range(n) ]
+#setupProbeRecords
+
+
+def setupProbeColumns(n: int):
+    """the probe results of n files kept in a records.ProbeColumns"""
+    files = _files(n)
+
+    def run():
+        columns = records.ProbeColumns()
+        for file in files:
+            columns.append(file, records.parse(_PROBE_OUTPUT))
+        #for
+        return columns
+    #run
+
+    return run
+#setupProbeColumns
+
+
+def setupOutputFilename(n: int):
+    """_outputFilename for n files"""
+    files = _files(n)
+    return lambda: [ convert._outputFilename(file, "h265", "aac") for file in files ]
+#setupOutputFilename
+
+
+def setupBuilders(n: int):
+    """_toFFmpegVideo/Audio/Cropping/Cuttting for n files (_toFFmpegScaling
+    is left out: it runs ffprobe)"""
+    confVideo = config.Video()
+    confAudio = config.Audio()
+    confAudio.codec = "mp3"
+    confAudio.quality = None
+    confCropping = config.Cropping()
+    confCropping.valid = True
+    confCropping.left = confCropping.right = 8
+    confCutting = config.Cutting()
+    confCutting.valid = True
+    confCutting.start = 12.5
+    confCutting.end = 60.0
+
+    def run():
+        for _ in range(n):
+            (convert._toFFmpegCropping(confCropping) + convert._toFFmpegVideo(confVideo) +
+             convert._toFFmpegAudio(confAudio) + convert._toFFmpegCuttting(confCutting))
+        #for
+    #run
+
+    return run
+#setupBuilders
+
+
+def setupCommandLineParser(n: int):
+    """CommandLineParser for an av-convert command line with n files"""
+    argv = [ "-j", "4", "-avc", "-vq", "24", "-ab", "192k", "-c", "8:8" ] + _files(n)
+    return lambda: clp.CommandLineParser("benchmark", config.CONVERT_CONFIG_TYPES, True, argv)
+#setupCommandLineParser
+
+
+BENCHMARKS = { "ffprobeDict": setupFFprobeDict,
+               "table2String": setupTable2String,
+               "addVideo": setupAddVideo,
+               "addAudio": setupAddAudio,
+               "probeDicts": setupProbeDicts,
+               "probeRecords": setupProbeRecords,
+               "probeColumns": setupProbeColumns,
+               "outputFilename": setupOutputFilename,
+               "builders": setupBuilders,
+               "commandLineParser": setupCommandLineParser }
+
+
+# largest size per benchmark, where the default sizes would need gigabytes
+MAX_SIZES = { "probeDicts": 100000 }
+
+
+# av-probe -v and -a rows of _PROBE_OUTPUT, of the same with an audio bitrate
+# of N/A, and of a file without streams (trailing spaces stripped)
+_EXPECTED_TABLES = {
+    config.Probing.VIDEO: [
+        "codec  resolution  aspect ratio  fps    bitrate    file",
+        "-----  ----------  ------------  ---    -------    ----",
+        "h264   1920x1080   16:9          29.97  4987 kb/s  clip.mov",
+        "h264   1920x1080   16:9          29.97  4987 kb/s  clip-2.mov",
+        "null   --          --            --     --         image.png" ],
+    config.Probing.AUDIO: [
+        "codec  sample rate  layout  bitrate   file",
+        "-----  -----------  ------  -------   ----",
+        "aac    48000 Hz     stereo  128 kb/s  clip.mov",
+        "aac    48000 Hz     stereo  N/A       clip-2.mov",
+        "null   --           --      --        image.png" ] }
+
+
+def check() -> list:
+    """
+    Checks that records.parse, ProbeColumns, TableMaker and _table2String
+    still turn _PROBE_OUTPUT into the expected values and av-probe rows, so that a
+    faster version cannot change the output unnoticed.  Returns the list of
+    differences found.
+    """
+    ans = []
+    record = records.parse(_PROBE_OUTPUT)
+    video = record.firstVideo()
+    audio = record.firstAudio()
+    values = [ ("duration", record.duration, 1798.233333),
+               ("video streams", len(record.video), 1),
+               ("audio streams", len(record.audio), 1),
+               ("video", (video.codec, video.width, video.height, video.aspectRatio,
+                          round(video.fps, 3), video.bitRate, video.picture),
+                ("h264", 1920, 1080, "16:9", 29.97, 4987654, False)),
+               ("audio", (audio.codec, audio.sampleRate, audio.channels,
+                          audio.channelLayout, audio.bitRate),
+                ("aac", 48000, 2, "stereo", 128000)),
+               ("complete", record.complete(), True) ]
+    for name, value, expected in values:
+        if value != expected:
+            ans.append("%s: %r instead of %r" % (name, value, expected))
+        #if
+    #for
+
+    # through a column store, as av-probe does
+    columns = records.ProbeColumns()
+    columns.append("clip.mov", record)
+    columns.append("clip-2.mov", records.parse(_PROBE_OUTPUT.replace("bit_rate=128000",
+                                                                     "bit_rate=N/A")))
+    columns.append("image.png", records.ProbeRecord(None, (), ()))
+    for mode, expected in _EXPECTED_TABLES.items():
+        tm = probing.TableMaker()
+        tm.addHeader(mode)
+        for i, file in enumerate(columns.files):
+            fileRecord = columns.record(i)
+            if mode == config.Probing.VIDEO:
+                tm.addVideo(file, fileRecord.firstVideo())
+            else:
+                tm.addAudio(file, fileRecord.firstAudio())
+            #else
+        #for
+        lines = [ line.rstrip() for line in probing._table2String(tm.get()).split(sep="\n") ]
+        for line, expectedLine in zip(lines, expected):
+            if line != expectedLine:
+                ans.append("table row %r instead of %r" % (line, expectedLine))
+            #if
+        #for
+        if len(lines) != len(expected):
+            ans.append("%d table rows instead of %d" % (len(lines), len(expected)))
+        #if
+    #for
+    return ans
+#check
+
+
+def measure(setup, n: int, repeat: int) -> dict:
+    """
+    Returns the best wall time of repeat runs of the function returned by
+    setup(n), and the peak memory it allocates.
+    """
+    function = setup(n)
+    function() # warm-up (and first-call caches, e.g. the parser cache)
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    #for
+    gc.collect()
+    tracemalloc.start()
+    function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return { "seconds": min(times), "peak_bytes": peak }
+#measure
+
+
+def _gitRevision() -> str:
+    import subprocess
+    try:
+        return subprocess.run([ "git", "rev-parse", "--short", "HEAD" ],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    #except
+#_gitRevision
+
+
+def main():
+    parser = argparse.ArgumentParser(description="czavsuite hot path microbenchmarks")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in SIZES),
+                        help="comma-separated input sizes (default: %(default)s)")
+    parser.add_argument("--only", metavar="NAME,...",
+                        help="run only these benchmarks (%s)" % ", ".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size (default: 3)")
+    parser.add_argument("--save", metavar="FILE", help="append results as a JSON line to FILE")
+    args = parser.parse_args()
+
+    sizes = [ int(n) for n in args.sizes.split(",") ]
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+        #if
+    #for
+
+    differences = check()
+    if len(differences) > 0:
+        for difference in differences:
+            print("FAILED: %s" % difference, file=sys.stderr)
+        #for
+        return 1
+    #if
+
+    results = {}
+    for name in names:
+        results[name] = {}
+        for n in sizes:
+            if n > MAX_SIZES.get(name, n):
+                print("%-18s %8d  skipped (more than %d)" % (name, n, MAX_SIZES[name]), flush=True)
+                continue
+            #if
+            result = measure(BENCHMARKS[name], n, args.repeat)
+            results[name][str(n)] = result
+            print("%-18s %8d  %10.2f ms  %8.2f us/row  peak %10.1f KiB" %
+                  (name, n, result["seconds"] * 1000, result["seconds"] * 1e6 / n,
+                   result["peak_bytes"] / 1024), flush=True)
+        #for
+    #for
+
+    if args.save is not None:
+        with open(args.save, "a") as buf:
+            buf.write(json.dumps({ "revision": _gitRevision(),
+                                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                   "python": sys.version.split()[0],
+                                   "results": results }) + "\n")
+        #with
+    #if
+    return 0
+#main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+#if
+
+### aczutro ###################################################################
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""Start-up benchmark for the av-* entry points.
+
+For every entry point, measures
+- the wall time of a run that does no media work (median of several runs):
+  'av-convert -dry FILE' for av-convert, which parses the command line and
+  builds the FFmpeg command like a script line does, 'av-script -wilma
+  /dev/null FILE' for av-script, and '--version' for the others,
+- the same minus the wall time of a bare 'python -c pass', which is what the
+  suite itself adds to every start, and
+- the import time of the package as reported by 'python -X importtime', in
+  total and for czavsuite's own modules (with what they import), together
+  with the slowest imports.
+
+Run from the distribution's root directory:
+
+    python benchmarks/startup.py [--runs N] [--save FILE]
+
+--save appends the results as one JSON line to FILE, so that start-up times
+can be tracked across commits (the current git revision is recorded).  An
+entry point that exits with a non-zero status is reported as FAILED instead
+of being timed, and the benchmark then exits with status 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ENTRY_POINTS = [ "mainProbe", "mainConvert", "mainPlay",
+                 "mainScript", "mainClassify", "mainRename" ]
+
+ARGUMENTS = { "mainConvert": [ "-dry", "-noadmission", "startup-benchmark.mov" ],
+              "mainScript": [ "-wilma", os.devnull, "startup-benchmark.mov" ] }
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def _environment() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ SRC ] + [ p for p in [ env.get("PYTHONPATH") ] if p ])
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+#_environment
+
+
+def _run(argv: list) -> subprocess.CompletedProcess:
+    return subprocess.run(argv, env=_environment(), stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True, check=False)
+#_run
+
+
+def _code(entryPoint: str) -> str:
+    return "import sys, czavsuite; sys.argv[0] = 'bench'; czavsuite.%s()" % entryPoint
+#_code
+
+
+def _arguments(entryPoint: str) -> list:
+    return ARGUMENTS.get(entryPoint, [ "--version" ])
+#_arguments
+
+
+class EntryPointError(Exception):
+    pass
+#EntryPointError
+
+
+def _wall(argv: list) -> tuple:
+    start = time.perf_counter()
+    proc = _run(argv)
+    return time.perf_counter() - start, proc
+#_wall
+
+
+def wallTime(entryPoint: str, runs: int) -> tuple:
+    """
+    Returns the median wall time in seconds of one run of an entry point, and
+    the median of what it takes longer than a bare 'python -c pass' (the
+    floor below which no entry point can start).  Every run is paired with a
+    bare interpreter run right before it, so that changes in the load of the
+    machine cancel out.
+
+    :raises EntryPointError: if a run exits with a non-zero status (a broken
+                             entry point would otherwise look fast)
+    """
+    times = []
+    overheads = []
+    for _ in range(runs):
+        bare, proc = _wall([ sys.executable, "-c", "pass" ])
+        wall, proc = _wall([ sys.executable, "-c", _code(entryPoint) ] + _arguments(entryPoint))
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            raise EntryPointError("exit status %d%s" %
+                                  (proc.returncode, ": %s" % lines[-1] if lines else ""))
+        #if
+        times.append(wall)
+        overheads.append(wall - bare)
+    #for
+    return statistics.median(times), statistics.median(overheads)
+#wallTime
+
+
+def _ownImportTime(imports: list) -> int:
+    # czavsuite's own modules, with everything they import
+    return sum(us for us, module, depth in imports
+               if depth == 0 and module.startswith("czavsuite"))
+#_ownImportTime
+
+
+def importTime(entryPoint: str, runs: int) -> list:
+    """
+    Runs an entry point under 'python -X importtime' and returns
+    (cumulative microseconds, module, nesting depth) for every import, slowest
+    first.  Of several runs, the one in which czavsuite's imports took least
+    is returned, as the one least disturbed by the rest of the machine.
+    """
+    ans = None
+    for _ in range(runs):
+        proc = _run([ sys.executable, "-X", "importtime", "-c", _code(entryPoint) ] +
+                    _arguments(entryPoint))
+        imports = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            #if
+            tokens = line[len("import time:"):].split("|")
+            try:
+                depth = (len(tokens[2]) - len(tokens[2].lstrip()) - 1) // 2
+                imports.append((int(tokens[1]), tokens[2].strip(), depth))
+            except (IndexError, ValueError):
+                continue # header line
+            #except
+        #for
+        if ans is None or _ownImportTime(imports) < _ownImportTime(ans):
+            ans = imports
+        #if
+    #for
+    ans.sort(reverse=True)
+    return ans
+#importTime
+
+
+def _gitRevision() -> str:
+    try:
+        return subprocess.run([ "git", "rev-parse", "--short", "HEAD" ],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    #except
+#_gitRevision
+
+
+def main():
+    parser = argparse.ArgumentParser(description="av-* start-up benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="runs per entry point (default: 20)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to show (default: 10)")
+    parser.add_argument("--save", metavar="FILE", help="append results as a JSON line to FILE")
+    args = parser.parse_args()
+
+    # warm up bytecode caches, so the first entry point is not penalised
+    wallTime(ENTRY_POINTS[0], 1)
+
+    results = {}
+    failed = False
+    for entryPoint in ENTRY_POINTS:
+        try:
+            wall, overhead = wallTime(entryPoint, args.runs)
+        except EntryPointError as e:
+            print("%-13s  FAILED (%s)" % (entryPoint, e))
+            results[entryPoint] = { "error": str(e) }
+            failed = True
+            continue
+        #except
+        imports = importTime(entryPoint, max(1, args.runs // 4))
+        total = sum(us for us, module, depth in imports if depth == 0)
+        own = _ownImportTime(imports)
+        results[entryPoint] = { "wall_ms": round(wall * 1000, 2),
+                                "overhead_ms": round(overhead * 1000, 2),
+                                "import_ms": round(total / 1000, 2),
+                                "czavsuite_import_ms": round(own / 1000, 2),
+                                "czavsuite_modules": sorted(module for us, module, depth in imports
+                                                            if module.startswith("czavsuite")) }
+        print("%-13s  wall %8.2f ms  overhead %8.2f ms  imports %8.2f ms  czavsuite %8.2f ms" %
+              (entryPoint, wall * 1000, overhead * 1000, total / 1000, own / 1000))
+        for us, module, depth in imports[:args.top]:
+            print("    %8.2f ms  %s" % (us / 1000, module))
+        #for
+    #for
+
+    if args.save is not None:
+        with open(args.save, "a") as buf:
+            buf.write(json.dumps({ "revision": _gitRevision(),
+                                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                   "python": sys.version.split()[0],
+                                   "results": results }) + "\n")
+        #with
+    #if
+    return 1 if failed else 0
+#main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+#if
+
+### aczutro ###################################################################
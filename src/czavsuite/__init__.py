@@ -23,12 +23,14 @@ __author__ = "Alexander Czutro <github@czutro.ch>"
 __version__ = "2.0.5"
 
 
-from . import application
+# application is imported by the entry points, not here, so that importing the
+# package (e.g. for __version__) stays cheap
 
 
 def mainProbe():
     """entry point for av-probe
     """
+    from . import application
     application.ApplicationProbe()
 #mainCut
 
@@ -36,6 +38,7 @@ def mainProbe():
 def mainConvert():
     """entry point for av-convert
     """
+    from . import application
     application.ApplicationConvert()
 #mainToMp4
 
@@ -43,6 +46,7 @@ def mainConvert():
 def mainPlay():
     """entry point for av-play
     """
+    from . import application
     application.ApplicationPlay()
 #mainPlay
 
@@ -50,6 +54,7 @@ def mainPlay():
 def mainScript():
     """entry point for av-script
     """
+    from . import application
     application.ApplicationScript()
 #mainScript
 
@@ -57,6 +62,7 @@ def mainScript():
 def mainClassify():
     """entry point for av-classify
     """
+    from . import application
     application.ApplicationClassify()
 #mainClassify
 
@@ -64,6 +70,7 @@ def mainClassify():
 def mainRename():
     """entry point for av-rename
     """
+    from . import application
     application.ApplicationRename()
 #mainRename
 
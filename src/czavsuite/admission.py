@@ -0,0 +1,410 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""disk and memory admission control for conversion jobs"""
+
+from . import cache, config, probing
+from czutils.utils import czlogging, czsystem
+import os
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.admission",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.admission", level, colour=colour)
+#setLoggingOptions
+
+
+def _waiting(*args):
+    print("%s: waiting:" % czsystem.appName(), " ".join(args), flush=True)
+#_waiting
+
+
+class AdmissionError(Exception):
+    pass
+#AdmissionError
+
+
+_MiB = 1 << 20
+
+# video bits per output pixel and second at CRF 23, used until the CRF history
+# has data for a codec/CRF pair
+_DEFAULT_BITS_PER_PIXEL_SECOND = { "h265": 1.2, "h264": 2.4 }
+
+# approximate libmp3lame VBR bitrates for -q:a 0 ... 9, in bits per second
+_MP3_QUALITY_BITRATE = [ 245000, 225000, 190000, 175000, 165000,
+                         130000, 115000, 100000, 85000, 65000 ]
+
+# encoder working memory per output pixel, plus a fixed base per ffmpeg process
+_MEMORY_PER_PIXEL = { "h265": 280, "h264": 120 }
+_MEMORY_BASE = 64 * _MiB
+
+# outputs are estimated generously; a job that runs out of disk halfway is
+# more expensive than one that waits a little longer
+_SAFETY_FACTOR = 1.25
+
+# encoder CPU time per output pixel and second, relative to x264 at its
+# default preset; stream copies and audio cost next to nothing by comparison
+_CPU_PER_PIXEL_SECOND = { "h265": 4.0, "h264": 1.0 }
+_CPU_PER_SECOND = 20000.0 # decoding, audio and muxing, in the same units
+
+# memory of a freshly started job does not show up in MemAvailable until the
+# encoder has allocated its buffers; reservations count for this long
+_RAMP_UP_SECONDS = 30.0
+
+
+def _parseBitrate(bitrate: str):
+    """
+    Turns an ffmpeg bitrate string such as '256k' or '2M' into bits per
+    second.  Returns None if the string cannot be parsed.
+    """
+    try:
+        factor = { 'k': 1000, 'K': 1000, 'm': 1000000, 'M': 1000000 }.get(bitrate[-1])
+        if factor is None:
+            return float(bitrate)
+        else:
+            return float(bitrate[:-1]) * factor
+        #else
+    except (ValueError, IndexError, TypeError):
+        return None
+    #except
+#_parseBitrate
+
+
+def freeMemory() -> int:
+    """
+    Returns the memory available to new processes, in bytes.
+    """
+    try:
+        with open("/proc/meminfo", "r") as buf:
+            for line in buf:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+                #if
+            #for
+        #with
+    except (OSError, ValueError, IndexError):
+        pass
+    #except
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+#freeMemory
+
+
+def freeDisk(path: str) -> int:
+    """
+    Returns the free disk space available to unprivileged users on the file
+    system that holds path, in bytes.
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+#freeDisk
+
+
+def _outputDir(outputFile: str) -> str:
+    return os.path.dirname(os.path.abspath(outputFile))
+#_outputDir
+
+
+class Estimate:
+    """Resource estimate for one conversion job.
+    """
+    def __init__(self, outputFile: str, outputBytes: int, memoryBytes: int,
+                 duration, videoKey, pixels: int, audioBitrate: float):
+        self.outputFile = outputFile
+        self.outputBytes = outputBytes
+        self.memoryBytes = memoryBytes
+        self.duration = duration
+        self.videoKey = videoKey # codec:crf, or None if not encoding video
+        self.pixels = pixels
+        self.audioBitrate = audioBitrate
+        self.started = None
+    #__init__
+
+
+    def pendingBytes(self) -> int:
+        """
+        Returns how much of the estimated output has not been written yet.
+        """
+        try:
+            written = os.path.getsize(self.outputFile)
+        except OSError:
+            written = 0
+        #except
+        return max(0, self.outputBytes - written)
+    #pendingBytes
+
+    def savedBytes(self, file: str) -> float:
+        """
+        Returns how many bytes converting file is expected to save.
+        """
+        if self.duration is None:
+            return 0.0 # the estimate is the input size; nothing is known
+        #if
+        return os.path.getsize(file) - self.outputBytes / _SAFETY_FACTOR
+    #savedBytes
+
+
+    def cost(self) -> float:
+        """
+        Returns the expected encoder CPU time of the job, in arbitrary units,
+        or None if the duration is unknown.
+        """
+        if self.duration is None:
+            return None
+        #if
+        codec = self.videoKey.split(":")[0] if self.videoKey is not None else None
+        return self.duration * (_CPU_PER_PIXEL_SECOND.get(codec, 0.0) * self.pixels
+                                + _CPU_PER_SECOND)
+    #cost
+
+#Estimate
+
+
+class AdmissionControl:
+    """Decides when a conversion job may start.
+
+    A job is admitted when the file system of its output file has room for the
+    estimated output plus diskReserve, and when the estimated peak memory of the
+    encoder fits into available memory minus memReserve.  Jobs admitted by
+    this object count against the free resources until they are released, so
+    several threads may share one instance.
+
+    Output size estimates use the target bitrate where there is one, and
+    otherwise the bitrates previously achieved with the same codec and CRF
+    (the CRF history, kept in the cache directory).
+
+    Constructor params:
+
+    :param diskReserve:   bytes to keep free on the output file system
+    :param memReserve:    bytes of memory to keep free
+    :param pollInterval:  seconds between resource checks while waiting
+    """
+    def __init__(self, diskReserve: int, memReserve: int, pollInterval=5.0):
+        self.diskReserve = diskReserve
+        self.memReserve = memReserve
+        self.pollInterval = pollInterval
+        self._running = []
+        self._condition = threading.Condition()
+        self._historyFile = os.path.join(cache.cacheDir(), "crf-history.json")
+        self._history = cache.loadJSON(self._historyFile, {})
+    #__init__
+
+
+    def estimate(self, file: str, outputFile: str,
+                 confVideo: config.Video,
+                 confAudio: config.Audio,
+                 confCropping: config.Cropping,
+                 confScaling: config.Scaling,
+                 confCutting: config.Cutting) -> Estimate:
+        """
+        Estimates output size and peak encoder memory of a job.
+        """
+        record = probing.probe(file)
+        duration = record.duration
+        if duration is not None and confCutting.valid:
+            start = confCutting.start or 0.0
+            end = confCutting.end if confCutting.end is not None else duration
+            duration = max(0.0, min(end, duration) - start)
+        #if
+
+        pixels = 0
+        videoStream = record.firstVideo()
+        if confVideo.codec != "null" and videoStream is not None \
+           and videoStream.width is not None and videoStream.height is not None:
+            width = videoStream.width
+            height = videoStream.height
+            if confCropping.valid:
+                width -= confCropping.left + confCropping.right
+                height -= confCropping.up + confCropping.down
+            #if
+            if confScaling.valid:
+                width *= confScaling.factor
+                height *= confScaling.factor
+            #if
+            pixels = max(0, int(width * height))
+        #if
+
+        videoKey = None
+        videoBitrate = 0.0
+        if confVideo.codec in _DEFAULT_BITS_PER_PIXEL_SECOND:
+            videoKey = "%s:%s" % (confVideo.codec, confVideo.crf)
+            videoBitrate = self._bitsPerPixelSecond(confVideo.codec, confVideo.crf) * pixels
+        elif confVideo.codec == "copy":
+            videoBitrate = float(videoStream.bitRate or 0) if videoStream is not None else 0.0
+        #elif
+
+        audioBitrate = 0.0
+        if confAudio.codec in [ "aac", "mp3" ]:
+            if confAudio.bitrate is not None:
+                audioBitrate = _parseBitrate(confAudio.bitrate) or 0.0
+            elif confAudio.codec == "mp3" and confAudio.quality is not None:
+                audioBitrate = _MP3_QUALITY_BITRATE[int(confAudio.quality)]
+            else:
+                audioBitrate = 128000.0
+            #else
+        elif confAudio.codec == "copy":
+            audioStream = record.firstAudio()
+            audioBitrate = float(audioStream.bitRate or 0) if audioStream is not None else 0.0
+        #elif
+
+        if duration is None:
+            # unknown duration: fall back to the input size, which is an upper
+            # bound for most conversions this suite is used for
+            outputBytes = os.path.getsize(file)
+        else:
+            outputBytes = int((videoBitrate + audioBitrate) * duration / 8 * _SAFETY_FACTOR)
+        #else
+
+        memoryBytes = _MEMORY_BASE + _MEMORY_PER_PIXEL.get(confVideo.codec, 0) * pixels
+
+        ans = Estimate(outputFile, outputBytes, memoryBytes, duration, videoKey, pixels,
+                       audioBitrate)
+        _logger.info("estimate for %s: output %d MiB, memory %d MiB" %
+                     (file, outputBytes // _MiB, memoryBytes // _MiB))
+        return ans
+    #estimate
+
+
+    def _bitsPerPixelSecond(self, codec: str, crf: str) -> float:
+        entry = self._history.get("%s:%s" % (codec, crf))
+        if entry is not None and entry[1] > 0:
+            return entry[0] / entry[1]
+        #if
+        # x264/x265 roughly halve the bitrate for every 6 CRF steps
+        return _DEFAULT_BITS_PER_PIXEL_SECOND[codec] * 2 ** ((23 - int(crf)) / 6)
+    #_bitsPerPixelSecond
+
+
+    def _blockers(self, estimate: Estimate) -> list:
+        """
+        Returns the reasons why a job cannot start now (empty if it can).
+        """
+        ans = []
+
+        outputDir = _outputDir(estimate.outputFile)
+        outputDev = os.stat(outputDir).st_dev
+        pendingDisk = sum(job.pendingBytes() for job in self._running
+                          if os.stat(_outputDir(job.outputFile)).st_dev == outputDev)
+        needDisk = estimate.outputBytes + self.diskReserve
+        haveDisk = freeDisk(outputDir) - pendingDisk
+        if haveDisk < needDisk:
+            ans.append("need %d MiB of disk space in %s, %d MiB available" %
+                       (needDisk // _MiB, outputDir, max(0, haveDisk) // _MiB))
+        #if
+
+        now = time.monotonic()
+        pendingMemory = sum(job.memoryBytes for job in self._running
+                            if now - job.started < _RAMP_UP_SECONDS)
+        needMemory = estimate.memoryBytes + self.memReserve
+        haveMemory = freeMemory() - pendingMemory
+        if haveMemory < needMemory:
+            ans.append("need %d MiB of memory, %d MiB available" %
+                       (needMemory // _MiB, max(0, haveMemory) // _MiB))
+        #if
+
+        return ans
+    #_blockers
+
+
+    def acquire(self, estimate: Estimate) -> None:
+        """
+        Blocks until the job described by estimate can start, and reserves its
+        resources.  The reason for every wait is reported.
+
+        :raises AdmissionError: if the output can never fit on its file system
+        """
+        outputDir = _outputDir(estimate.outputFile)
+        st = os.statvfs(outputDir)
+        if estimate.outputBytes + self.diskReserve > st.f_blocks * st.f_frsize:
+            raise AdmissionError("%s: estimated output size (%d MiB) exceeds the capacity of %s" %
+                                 (estimate.outputFile, estimate.outputBytes // _MiB, outputDir))
+        #if
+
+        with self._condition:
+            lastReason = None
+            while True:
+                blockers = self._blockers(estimate)
+                if len(blockers) == 0:
+                    break
+                #if
+                reason = "; ".join(blockers)
+                if reason != lastReason:
+                    _waiting("%s: %s" % (estimate.outputFile, reason))
+                    lastReason = reason
+                #if
+                _logger.info("admission blocked:", reason)
+                self._condition.wait(self.pollInterval)
+            #while
+            estimate.started = time.monotonic()
+            self._running.append(estimate)
+        #with
+    #acquire
+
+
+    def release(self, estimate: Estimate, success: bool) -> None:
+        """
+        Releases the resources of a finished job.  If the job succeeded and
+        encoded video with a CRF, its output updates the CRF history.
+        """
+        with self._condition:
+            self._running.remove(estimate)
+            self._condition.notify_all()
+        #with
+
+        if not success or estimate.videoKey is None or not estimate.duration or not estimate.pixels:
+            return
+        #if
+        try:
+            outputBits = os.path.getsize(estimate.outputFile) * 8
+        except OSError:
+            return
+        #except
+        videoBits = max(0.0, outputBits - estimate.audioBitrate * estimate.duration)
+        bitsPerPixelSecond = videoBits / estimate.duration / estimate.pixels
+
+        with self._condition:
+            self._history = cache.loadJSON(self._historyFile, self._history)
+            total, count = self._history.get(estimate.videoKey, [ 0.0, 0 ])
+            self._history[estimate.videoKey] = [ total + bitsPerPixelSecond, count + 1 ]
+            cache.saveJSON(self._historyFile, self._history)
+        #with
+    #release
+
+#AdmissionControl
+
+
+### aczutro ###################################################################
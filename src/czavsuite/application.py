@@ -19,17 +19,39 @@
 
 """main application classes"""
 
-from . import clp, config, probing, convert, scripts
+from . import clp, config, profiling
 from czutils.utils import czlogging, czsystem
 import sys
 
 
+# Only the command line parser is imported up front.  Every application
+# imports the modules it needs in _execute(), so that start-up (which is paid
+# once per file when av-convert is called from scripts) does not include
+# modules that are never used.  Modules that those import in turn keep their
+# default level, SILENT, which for them is the same as ERROR: they log no
+# errors.
+
 _logger = czlogging.LoggingChannel(czsystem.appName(),
                                    czlogging.LoggingLevel.ERROR,
                                    colour=True)
 clp.setLoggingOptions(czlogging.LoggingLevel.ERROR)
-convert.setLoggingOptions(czlogging.LoggingLevel.ERROR)
-probing.setLoggingOptions(czlogging.LoggingLevel.ERROR)
+
+
+def _setLoggingOptions(*modules) -> None:
+    for module in modules:
+        module.setLoggingOptions(czlogging.LoggingLevel.ERROR)
+    #for
+#_setLoggingOptions
+
+
+def _fatalErrors() -> tuple:
+    """
+    Exceptions that end an application with exit status 1.  Used in an except
+    clause, so convert is only imported once an exception is actually raised.
+    """
+    from . import convert
+    return convert.ConvertError, OSError
+#_fatalErrors
 
 
 def _stderr(err: str):
@@ -52,17 +74,20 @@ class Application:
         self.configTypes = configTypes
         self.requireFiles = requireFiles
 
+        begin = profiling.now()
         self._parseCommandLine()
+        profiling.record("parse command line", begin, profiling.now())
 
         try:
-            self._execute()
-        except convert.ConvertError as e:
-            _stderr(e)
-            sys.exit(1)
-        except OSError as e:
+            with profiling.span(czsystem.appName(), files=len(self.inputFiles)):
+                self._execute()
+            #with
+        except _fatalErrors() as e:
             _stderr(e)
             sys.exit(1)
-        #except
+        finally:
+            profiling.finish()
+        #finally
     #__init__
 
 
@@ -75,6 +100,14 @@ class Application:
             _stderr(e)
             sys.exit(2)
         #except
+        if CLP.profile is not None:
+            try:
+                profiling.start(CLP.profile)
+            except OSError as e:
+                _stderr("cannot write trace: %s" % e)
+                sys.exit(2)
+            #except
+        #if
 
         _logger.info("files:", self.inputFiles)
         _logger.info("config:", "\n".join([ str(self.config[key]) for key in self.config ]))
@@ -99,10 +132,23 @@ class ApplicationProbe(Application):
 
 
     def _execute(self):
+        from . import probing
+        _setLoggingOptions(probing)
+
         try:
-            probing.avProbe(self.inputFiles,
-                            self.config[config.ConfigType.PROBING].mode,
-                            self.config[config.ConfigType.PROBING].headers)
+            confProbing = self.config[config.ConfigType.PROBING]
+            if confProbing.dupes:
+                from . import dupes
+                _setLoggingOptions(dupes)
+                try:
+                    dupes.avDupes(self.inputFiles, confProbing.threshold)
+                except dupes.DupesError as e:
+                    _stderr(e)
+                    sys.exit(1)
+                #except
+            else:
+                probing.avProbe(self.inputFiles, confProbing.mode, confProbing.headers)
+            #else
         except KeyError as e:
             _logger.error("invalid config")
             raise e
@@ -119,25 +165,62 @@ class ApplicationConvert(Application):
     """
     def __init__(self):
         appDescription = "Converts media files to mp4, m4a or mp3."
-        configTypes = [ config.ConfigType.GENERAL,
-                        config.ConfigType.VIDEO,
-                        config.ConfigType.AUDIO,
-                        config.ConfigType.CROPPING,
-                        config.ConfigType.SCALING,
-                        config.ConfigType.CUTTING ]
-        super().__init__(appDescription, configTypes)
+        super().__init__(appDescription, config.CONVERT_CONFIG_TYPES)
     #__init__
 
 
     def _execute(self):
+        from . import convert
+        _setLoggingOptions(convert)
+
         try:
-            convert.avConvert(self.inputFiles,
+            confQueue = self.config[config.ConfigType.QUEUE]
+            confWatch = self.config[config.ConfigType.WATCH]
+            if confWatch.dir is not None:
+                from . import watch
+                _setLoggingOptions(watch)
+                watch.avWatch(confWatch,
                               self.config[config.ConfigType.GENERAL],
                               self.config[config.ConfigType.VIDEO],
                               self.config[config.ConfigType.AUDIO],
                               self.config[config.ConfigType.CROPPING],
                               self.config[config.ConfigType.SCALING],
                               self.config[config.ConfigType.CUTTING])
+            elif confQueue.worker is not None:
+                from . import workqueue
+                _setLoggingOptions(workqueue)
+                sys.exit(workqueue.avWorker(confQueue.worker,
+                                            self.config[config.ConfigType.GENERAL],
+                                            confQueue.lease))
+            elif confQueue.enqueue is not None:
+                from . import workqueue
+                _setLoggingOptions(workqueue)
+                workqueue.avEnqueue(self.inputFiles,
+                                    confQueue.enqueue,
+                                    self.config[config.ConfigType.GENERAL],
+                                    self.config[config.ConfigType.VIDEO],
+                                    self.config[config.ConfigType.AUDIO],
+                                    self.config[config.ConfigType.CROPPING],
+                                    self.config[config.ConfigType.SCALING],
+                                    self.config[config.ConfigType.CUTTING],
+                                    confQueue.lease)
+            elif self.config[config.ConfigType.GENERAL].concat is not None:
+                if convert.avConcat(self.inputFiles,
+                                    self.config[config.ConfigType.GENERAL].concat,
+                                    self.config[config.ConfigType.GENERAL],
+                                    self.config[config.ConfigType.VIDEO],
+                                    self.config[config.ConfigType.AUDIO]) != 0:
+                    sys.exit(1)
+                #if
+            elif convert.avConvert(self.inputFiles,
+                                   self.config[config.ConfigType.GENERAL],
+                                   self.config[config.ConfigType.VIDEO],
+                                   self.config[config.ConfigType.AUDIO],
+                                   self.config[config.ConfigType.CROPPING],
+                                   self.config[config.ConfigType.SCALING],
+                                   self.config[config.ConfigType.CUTTING]) != 0:
+                sys.exit(1)
+            #elif
         except KeyError as e:
             _logger.error("invalid config")
             raise e
@@ -155,17 +238,24 @@ class ApplicationPlay(Application):
                          "cropping and scaling parameters."
         configTypes = [ config.ConfigType.CROPPING,
                         config.ConfigType.SCALING,
-                        config.ConfigType.CUTTING ]
+                        config.ConfigType.CUTTING,
+                        config.ConfigType.PLAY,
+                        config.ConfigType.PROXY ]
         super().__init__(appDescription, configTypes)
     #__init__
 
 
     def _execute(self):
+        from . import convert
+        _setLoggingOptions(convert)
+
         try:
             convert.avPlay(self.inputFiles,
                            self.config[config.ConfigType.CROPPING],
                            self.config[config.ConfigType.SCALING],
-                           self.config[config.ConfigType.CUTTING])
+                           self.config[config.ConfigType.CUTTING],
+                           self.config[config.ConfigType.PLAY],
+                           self.config[config.ConfigType.PROXY])
         except KeyError as e:
             _logger.error("invalid config")
             raise e
@@ -186,8 +276,17 @@ class ApplicationScript(Application):
 
 
     def _execute(self):
+        from . import scripts
+
         try:
-            scripts.avScript(self.inputFiles, self.config[config.ConfigType.SCRIPT])
+            confScript = self.config[config.ConfigType.SCRIPT]
+            if confScript.run is not None:
+                from . import convert
+                _setLoggingOptions(convert)
+                sys.exit(scripts.avRun(confScript))
+            else:
+                scripts.avScript(self.inputFiles, confScript)
+            #else
         except KeyError as e:
             _logger.error("invalid config")
             raise e
@@ -204,14 +303,21 @@ class ApplicationClassify(Application):
         appDescription = ("Video and image classification helper.  In order to replace the default "
                           "media player command, set the environment variable AV_CLASS_PLAYER. "
                           "To replace the default image viewer, set AV_CLASS_VIEWER.")
-        configTypes = [ config.ConfigType.CLASSIFY ]
+        configTypes = [ config.ConfigType.CLASSIFY, config.ConfigType.PROXY ]
         super().__init__(appDescription, configTypes)
     #__init__
 
 
     def _execute(self):
+        from . import scripts
+
         try:
-            scripts.avClassify(self.inputFiles, self.config[config.ConfigType.CLASSIFY])
+            confClassify = self.config[config.ConfigType.CLASSIFY]
+            if confClassify.undo is not None:
+                sys.exit(scripts.avUndoClassify(confClassify))
+            #if
+            sys.exit(scripts.avClassify(self.inputFiles, confClassify,
+                                        self.config[config.ConfigType.PROXY]))
         except KeyError as e:
             _logger.error("invalid config")
             raise e
@@ -235,8 +341,10 @@ class ApplicationRename(Application):
 
 
     def _execute(self):
+        from . import scripts
+
         try:
-            scripts.avRename(self.config[config.ConfigType.RENAME])
+            sys.exit(scripts.avRename(self.config[config.ConfigType.RENAME]))
         except KeyError as e:
             _logger.error("invalid config")
             raise e
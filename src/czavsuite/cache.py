@@ -0,0 +1,197 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""per-user cache directory and file identity keys"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+
+def cacheDir(*subdirs: str) -> str:
+    """
+    Returns (and creates) the czavsuite cache directory, or a subdirectory of
+    it.  The base directory is $AV_CACHE_DIR if set, else
+    $XDG_CACHE_HOME/czavsuite, else ~/.cache/czavsuite.
+    """
+    base = os.environ.get("AV_CACHE_DIR")
+    if base is None:
+        base = os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                           os.path.join(os.path.expanduser("~"), ".cache")),
+                            "czavsuite")
+    #if
+    ans = os.path.join(base, *subdirs)
+    os.makedirs(ans, exist_ok=True)
+    return ans
+#cacheDir
+
+
+def fileKey(file: str) -> str:
+    """
+    Returns a string that identifies the current contents of a file without
+    reading it: device, inode, size and modification time.  The key changes
+    whenever the file is replaced or modified.
+    """
+    st = os.stat(file)
+    return "%x-%x-%x-%x" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+#fileKey
+
+
+def loadJSON(path: str, default):
+    """
+    Loads a JSON cache file.  Returns default if the file does not exist or
+    cannot be parsed.
+    """
+    try:
+        with open(path, "r") as buf:
+            return json.load(buf)
+        #with
+    except (OSError, ValueError):
+        return default
+    #except
+#loadJSON
+
+
+def saveJSON(path: str, data) -> None:
+    """
+    Writes a JSON cache file atomically, so that concurrent readers never see a
+    partially written file.
+    """
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp, "w") as buf:
+        json.dump(data, buf)
+    #with
+    os.replace(tmp, path)
+#saveJSON
+
+
+# pending entries of a JSONCache are written when there are this many of them,
+# or when the last write is this old
+_FLUSH_ENTRIES = 64
+_FLUSH_SECONDS = 30.0
+
+
+class JSONCache:
+    """A JSON cache file holding a dict, which is read once and then kept in
+    memory, so that lookups do no I/O.  New entries are written back in
+    batches (see _FLUSH_ENTRIES and _FLUSH_SECONDS, and at exit); every write
+    merges them with what other processes have written in the meantime.
+    Thread-safe.  Get the instance for a path with jsonCache().
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None # loaded on first use
+        self._pending = {}
+        self._lastFlush = time.monotonic()
+    #__init__
+
+
+    def _loaded(self) -> dict:
+        # called with _lock held
+        if self._data is None:
+            self._data = loadJSON(self.path, {})
+        #if
+        return self._data
+    #_loaded
+
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._loaded()
+        #with
+    #__contains__
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._loaded().get(key, default)
+        #with
+    #get
+
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._loaded()[key] = value
+            self._pending[key] = value
+            due = len(self._pending) >= _FLUSH_ENTRIES \
+                or time.monotonic() - self._lastFlush >= _FLUSH_SECONDS
+        #with
+        if due:
+            self.flush()
+        #if
+    #put
+
+
+    def flush(self) -> None:
+        """
+        Writes the pending entries.
+        """
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            #if
+            data = loadJSON(self.path, {})
+            data.update(self._pending)
+            saveJSON(self.path, data)
+            self._data = data # also picks up the entries of other processes
+            self._pending = {}
+            self._lastFlush = time.monotonic()
+        #with
+    #flush
+
+#JSONCache
+
+
+_caches = {} # path -> JSONCache
+_cachesLock = threading.Lock()
+
+
+def jsonCache(path: str) -> JSONCache:
+    """
+    Returns the JSONCache of path, which is shared by all its users in this
+    process.
+    """
+    with _cachesLock:
+        ans = _caches.get(path)
+        if ans is None:
+            if len(_caches) == 0:
+                atexit.register(_flushAll)
+            #if
+            ans = _caches[path] = JSONCache(path)
+        #if
+        return ans
+    #with
+#jsonCache
+
+
+def _flushAll() -> None:
+    for jc in list(_caches.values()):
+        try:
+            jc.flush()
+        except OSError:
+            pass # a cache that cannot be written is only slower next time
+        #except
+    #for
+#_flushAll
+
+
+### aczutro ###################################################################
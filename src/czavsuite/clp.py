@@ -22,6 +22,8 @@
 from . import config, __version__
 from czutils.utils import czlogging, czsystem
 import argparse
+import os.path
+import threading
 
 
 _logger = czlogging.LoggingChannel("czavsuite.clp",
@@ -57,6 +59,71 @@ class CommandLineError(Exception):
 #CommandLineError
 
 
+def _parseSize(size: str) -> int:
+    """
+    Turns a size such as '512M' or '2G' into a number of bytes.
+    """
+    units = { 'k': 1 << 10, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40 }
+    try:
+        if size[-1] in units:
+            ans = int(float(size[:-1]) * units[size[-1]])
+        else:
+            ans = int(size)
+        #else
+    except (ValueError, IndexError):
+        raise CommandLineError("invalid size: '%s'" % size)
+    #except
+    if ans < 0:
+        raise CommandLineError("a negative size doesn't make sense")
+    #if
+    return ans
+#_parseSize
+
+
+def _threshold(value, default: int) -> int:
+    """
+    Checks a --threshold value; returns default if it is None.
+    """
+    if value is None:
+        return default
+    #if
+    if not 0 <= value <= 64:
+        raise CommandLineError("BITS must be between 0 and 64")
+    #if
+    return value
+#_threshold
+
+
+class _InProcessArgumentParser(argparse.ArgumentParser):
+    """Argument parser that raises CommandLineError instead of exiting, for
+    command lines that are parsed inside a running application.
+    """
+    def error(self, message):
+        raise CommandLineError(message)
+    #error
+
+
+    def exit(self, status=0, message=None):
+        raise CommandLineError(message or "option exits the application (status %d)" % status)
+    #exit
+
+#_InProcessArgumentParser
+
+
+# options that make the positional FILE argument optional
+_FILELESS_OPTIONS = [ "worker", "watch", "run", "undo" ]
+
+# values of --order
+_ORDERS = { "savings": config.General.Order.SAVINGS,
+            "shortest-first": config.General.Order.SHORTEST,
+            "longest-first": config.General.Order.LONGEST }
+
+# parsers are built once per process and configuration: av-script --run parses
+# one command line per script line
+_parsers = {}
+_parsersLock = threading.Lock()
+
+
 class CommandLineParser:
     """Common command line parser.
 
@@ -64,18 +131,96 @@ class CommandLineParser:
 
     :param appDescription:  app description for help text
     :param configTypes:     list of OptionIDs to include
+    :param argv:            arguments to parse; if None, parse sys.argv and
+                            exit on errors like argparse does, else raise
+                            CommandLineError
     """
-    def __init__(self, appDescription: str, configTypes: list, requireFiles):
+    def __init__(self, appDescription: str, configTypes: list, requireFiles, argv=None):
         self.args = []
         self.config = {}
+        self.profile = None
+
+        key = (appDescription, tuple(configTypes), requireFiles, argv is not None)
+        with _parsersLock:
+            parser = _parsers.get(key)
+            if parser is None:
+                parser = self._buildParser(appDescription, configTypes, requireFiles,
+                                           argv is not None)
+                _parsers[key] = parser
+            #if
+            try:
+                container = parser.parse_args(argv)
+            except CommandLineError:
+                raise
+            except Exception as e:
+                raise CommandLineError(e)
+            #except
+        #with
 
-        parser = argparse.ArgumentParser(description=appDescription,
-                                         add_help=False)
+        self.profile = container.profile
+        if requireFiles:
+            self.args = container.FILE
+            if len(self.args) == 0 and all(getattr(container, option, None) is None
+                                           for option in _FILELESS_OPTIONS):
+                raise CommandLineError("the following arguments are required: FILE")
+            #if
+        #if
+        self._cropAndScale = 0
+        self._noOutput = 0
+
+        for t in configTypes:
+            if t == config.ConfigType.GENERAL:
+                self._getGeneralSettings(container)
+            elif t == config.ConfigType.VIDEO:
+                self._getVideoSettings(container)
+            elif t == config.ConfigType.AUDIO:
+                self._getAudioSettings(container)
+            elif t == config.ConfigType.CROPPING:
+                self._getCroppingSettings(container)
+            elif t == config.ConfigType.SCALING:
+                self._getScalingSettings(container)
+            elif t == config.ConfigType.CUTTING:
+                self._getCuttingSettings(container)
+            elif t == config.ConfigType.PROBING:
+                self._getProbingSettings(container)
+            elif t == config.ConfigType.SCRIPT:
+                self._getScriptSettings(container)
+            elif t == config.ConfigType.CLASSIFY:
+                self._getClassifySettings(container)
+            elif t == config.ConfigType.RENAME:
+                self._getRenameSettings(container)
+            elif t == config.ConfigType.QUEUE:
+                self._getQueueSettings(container)
+            elif t == config.ConfigType.WATCH:
+                self._getWatchSettings(container)
+            elif t == config.ConfigType.PLAY:
+                self._getPlaySettings(container)
+            elif t == config.ConfigType.PROXY:
+                self._getProxySettings(container)
+            else:
+                _logger.error("invalid config type", t)
+            #else
+        #for
+
+        if self._cropAndScale == 3:
+            raise CommandLineError("-c and -s cannot be used at the same time")
+        #if
+        if self._noOutput == 3:
+            raise CommandLineError("cowardly refusing to create media files with no video and no "
+                                   "audio")
+        #if
+    #__init__
+
+
+    @staticmethod
+    def _buildParser(appDescription: str, configTypes: list, requireFiles, inProcess: bool):
+        parserClass = _InProcessArgumentParser if inProcess else argparse.ArgumentParser
+        parser = parserClass(description=appDescription, add_help=False)
 
         if requireFiles:
             parser.add_argument("FILE",
                                 type=str,
-                                nargs="+",
+                                nargs="*",
                                 help="audio or video file"
                                 )
         #if
@@ -87,6 +232,10 @@ class CommandLineParser:
                             action="version",
                             version=__version__,
                             help="show version number and exit")
+        parser.add_argument("--profile",
+                            metavar="FILE",
+                            help="write timed spans of every phase and file to FILE, as a"
+                                 " Chrome trace (open it in Perfetto)")
 
         if config.ConfigType.GENERAL in configTypes:
             generalGroup = parser.add_argument_group()
@@ -94,6 +243,113 @@ class CommandLineParser:
                                       action="store_true",
                                       help="only print FFmpeg command line; don't execute it"
                                       )
+            generalGroup.add_argument("-j",
+                                      metavar="N",
+                                      dest="jobs",
+                                      type=int,
+                                      help="run up to N conversion jobs in parallel (default: %s)" %
+                                           config.General().jobs
+                                      )
+            generalGroup.add_argument("--batch",
+                                      metavar="N",
+                                      type=int,
+                                      help="convert up to N files with a single FFmpeg process; "
+                                           "saves FFmpeg's start-up time with many short files "
+                                           "(default: %s)" % config.General().batch
+                                      )
+            generalGroup.add_argument("-incremental",
+                                      action="store_true",
+                                      help="skip files whose output was built from the same input "
+                                           "with the same settings; rebuild outdated outputs "
+                                           "without asking"
+                                      )
+            generalGroup.add_argument("-noadmission",
+                                      dest="admission",
+                                      action="store_false",
+                                      help="start each job right away instead of waiting until "
+                                           "there is enough free disk space and memory"
+                                      )
+            generalGroup.add_argument("-diskreserve",
+                                      metavar="SIZE",
+                                      type=str,
+                                      help="disk space to keep free on the output file system, "
+                                           "e.g. 500M or 2G (default: 1G)"
+                                      )
+            generalGroup.add_argument("-memreserve",
+                                      metavar="SIZE",
+                                      type=str,
+                                      help="memory to keep free, e.g. 512M or 1G (default: 512M)"
+                                      )
+            generalGroup.add_argument("-logdir",
+                                      metavar="DIR",
+                                      type=str,
+                                      help="write FFmpeg's output to a compressed log file per "
+                                           "job in DIR (default: the 'logs' directory in "
+                                           "~/.cache/czavsuite)"
+                                      )
+            generalGroup.add_argument("-stall",
+                                      metavar="SECONDS",
+                                      type=float,
+                                      help="kill a job when FFmpeg has made no progress for "
+                                           "SECONDS; 0 means never (default: %s)"
+                                           % config.General().stall
+                                      )
+            generalGroup.add_argument("-retries",
+                                      metavar="N",
+                                      type=int,
+                                      help="try a failed job up to N more times, waiting longer "
+                                           "each time (default: %s)" % config.General().retries
+                                      )
+            generalGroup.add_argument("--summary",
+                                      metavar="FILE",
+                                      type=str,
+                                      help="write a JSON summary of all jobs to FILE"
+                                      )
+            generalGroup.add_argument("--metrics",
+                                      metavar="FILE",
+                                      type=str,
+                                      help="keep Prometheus metrics of the run up to date in "
+                                           "FILE (for node-exporter's textfile collector; "
+                                           "name it *.prom)"
+                                      )
+            generalGroup.add_argument("--order",
+                                      choices=list(_ORDERS),
+                                      help="convert files in this order: largest expected saving "
+                                           "per CPU time first, or by duration (default: as "
+                                           "given)"
+                                      )
+            generalGroup.add_argument("--concat",
+                                      metavar="OUT",
+                                      type=str,
+                                      help="join all FILEs, in the given order, into OUT; with "
+                                           "stream copy if their streams are compatible, else "
+                                           "with one re-encode"
+                                      )
+            generalGroup.add_argument("--skip-dupes",
+                                      dest="skipDupes",
+                                      action="store_true",
+                                      help="of every cluster of near-duplicate videos (see "
+                                           "av-probe --dupes), convert only the largest file; "
+                                           "needs NumPy"
+                                      )
+            generalGroup.add_argument("--threshold",
+                                      metavar="BITS",
+                                      type=int,
+                                      help="with --skip-dupes: number of differing perceptual "
+                                           "hash bits per frame (of 64) up to which videos count "
+                                           "as similar (default: %s)" % config.General().threshold
+                                      )
+            generalGroup.add_argument("--dedupe",
+                                      action="store_true",
+                                      help="of several byte-for-byte identical input files, "
+                                           "convert only the first"
+                                      )
+            generalGroup.add_argument("--link-dupes",
+                                      dest="linkDupes",
+                                      action="store_true",
+                                      help="like --dedupe, but give the other files their output "
+                                           "too, as a hard link to the converted file"
+                                      )
         #if
         if config.ConfigType.VIDEO in configTypes:
             videoGroup = parser.add_argument_group()
@@ -169,6 +425,14 @@ class CommandLineParser:
                                     help="mp3 only: 0 is best, 9 is worst (mp3 default: %s)" %
                                          config.Audio().quality
                                     )
+            audioGroup.add_argument("--loudnorm",
+                                    metavar="TARGET",
+                                    type=float,
+                                    help="normalise loudness to TARGET LUFS (e.g. -16) in two "
+                                         "passes; measurements are cached, so changing TARGET "
+                                         "later needs no new measurement pass (-dry still "
+                                         "measures)"
+                                    )
         #if
         transGroup = parser.add_argument_group()
         if config.ConfigType.CROPPING in configTypes:
@@ -199,6 +463,89 @@ class CommandLineParser:
                                          "empty END means END = end of input stream"
                                     )
         #if
+        if config.ConfigType.QUEUE in configTypes:
+            queueGroup = parser.add_argument_group()
+            queueGroup.add_argument("--enqueue",
+                                    metavar="QUEUE",
+                                    type=str,
+                                    help="don't convert; add one job per file to the work queue "
+                                         "in directory QUEUE"
+                                    )
+            queueGroup.add_argument("--worker",
+                                    metavar="QUEUE",
+                                    type=str,
+                                    help="take jobs from the work queue in directory QUEUE and "
+                                         "run them until the queue is empty (no FILE needed)"
+                                    )
+            queueGroup.add_argument("--lease",
+                                    metavar="SECONDS",
+                                    type=float,
+                                    help="a job whose worker has not shown signs of life for "
+                                         "this long is given to another worker (default: %s)" %
+                                         config.Queue().lease
+                                    )
+        #if
+        if config.ConfigType.WATCH in configTypes:
+            watchGroup = parser.add_argument_group()
+            watchGroup.add_argument("--watch",
+                                    metavar="DIR",
+                                    type=str,
+                                    help="keep running and convert every media file that appears "
+                                         "in directory DIR (no FILE needed)"
+                                    )
+            watchGroup.add_argument("--watch-out",
+                                    metavar="DIR",
+                                    dest="watchOut",
+                                    type=str,
+                                    help="watch mode: put converted files into this directory "
+                                         "(default: WATCHED_DIR/converted)"
+                                    )
+            watchGroup.add_argument("--watch-done",
+                                    metavar="DIR",
+                                    dest="watchDone",
+                                    type=str,
+                                    help="watch mode: move converted input files into this "
+                                         "directory (default: hide them by prefixing a dot)"
+                                    )
+            watchGroup.add_argument("--settle",
+                                    metavar="SECONDS",
+                                    type=float,
+                                    help="watch mode: convert a file once it has not grown for "
+                                         "this long (default: %s)" % config.Watch().settle
+                                    )
+        #if
+        if config.ConfigType.PLAY in configTypes:
+            playGroup = parser.add_argument_group()
+            playGroup.add_argument("--grid",
+                                   metavar="N",
+                                   type=int,
+                                   help="instead of playing, show a contact sheet of N frames "
+                                        "spread over the file, cropped and scaled like the "
+                                        "video would be"
+                                   )
+        #if
+        if config.ConfigType.PROXY in configTypes:
+            proxyGroup = parser.add_argument_group()
+            proxyGroup.add_argument("--proxies",
+                                    action="store_true",
+                                    help="create low-resolution proxies of larger videos in the "
+                                         "background (used from then on instead of the "
+                                         "originals)"
+                                    )
+            proxyGroup.add_argument("--no-proxy",
+                                    dest="useProxy",
+                                    action="store_false",
+                                    help="play the originals even if there are proxies"
+                                    )
+            proxyGroup.add_argument("--proxy-limit",
+                                    metavar="SIZE",
+                                    dest="proxyLimit",
+                                    type=str,
+                                    help="size of the proxy cache; the least recently used "
+                                         "proxies are removed (default: %dG)" %
+                                         (config.Proxy().limit >> 30)
+                                    )
+        #if
         if config.ConfigType.PROBING in configTypes:
             probeGroup = parser.add_argument_group()
             probeGroup.add_argument("-f",
@@ -234,6 +581,18 @@ class CommandLineParser:
                                     action="store_true",
                                     help="print table headers"
                                     )
+            probeGroup.add_argument("--dupes",
+                                    action="store_true",
+                                    help="print clusters of near-duplicate videos (re-uploads, "
+                                         "re-encodes), separated by empty lines; needs NumPy"
+                                    )
+            probeGroup.add_argument("--threshold",
+                                    metavar="BITS",
+                                    type=int,
+                                    help="with --dupes: number of differing perceptual hash bits "
+                                         "per frame (of 64) up to which videos count as similar "
+                                         "(default: %s)" % config.Probing().threshold
+                                    )
         #if
         if config.ConfigType.SCRIPT in configTypes:
             scriptGroup = parser.add_argument_group()
@@ -265,6 +624,30 @@ class CommandLineParser:
                                      action="store_true",
                                      help="add empty -t option to script"
                                      )
+            scriptGroup.add_argument("-incremental",
+                                     action="store_true",
+                                     help="add -incremental flag to av-convert commands in the "
+                                          "script; this means that running the script again only "
+                                          "converts files whose input or settings have changed"
+                                     )
+            scriptGroup.add_argument("--dedupe",
+                                     action="store_true",
+                                     help="comment out the lines of input files that are "
+                                          "byte-for-byte identical to an earlier one"
+                                     )
+            scriptGroup.add_argument("--run",
+                                     metavar="SCRIPT",
+                                     type=str,
+                                     help="don't create a script; run the av-convert lines of "
+                                          "SCRIPT in this process (no FILE needed)"
+                                     )
+            scriptGroup.add_argument("-j",
+                                     metavar="N",
+                                     dest="jobs",
+                                     type=int,
+                                     help="with --run: run up to N script lines in parallel "
+                                          "(default: %s)" % config.Script().jobs
+                                     )
         #if
         if config.ConfigType.CLASSIFY in configTypes:
             scriptGroup = parser.add_argument_group()
@@ -294,6 +677,43 @@ class CommandLineParser:
                                      action="store_true",
                                      help="mute media player (ignored if AV_CLASS_PLAYER is set)"
                                      )
+            scriptGroup.add_argument("--thumbs",
+                                     action="store_true",
+                                     help="show a grid of frames of each video in the image viewer "
+                                          "instead of playing it; the grids of the next files are "
+                                          "created in the background and cached"
+                                     )
+            scriptGroup.add_argument("--frames",
+                                     metavar="N",
+                                     type=int,
+                                     help="number of frames per grid (default: %s)"
+                                          % config.Classify().frames
+                                     )
+            scriptGroup.add_argument("--ahead",
+                                     metavar="K",
+                                     type=int,
+                                     help="number of grids to create ahead of the current file "
+                                          "(default: %s)" % config.Classify().ahead
+                                     )
+            scriptGroup.add_argument("--clusters",
+                                     action="store_true",
+                                     help="present near-duplicate videos (see av-probe --dupes) "
+                                          "one after the other; needs NumPy"
+                                     )
+            scriptGroup.add_argument("--threshold",
+                                     metavar="BITS",
+                                     type=int,
+                                     help="with --clusters: number of differing perceptual hash "
+                                          "bits per frame (of 64) up to which videos count as "
+                                          "similar (default: %s)" % config.Classify().threshold
+                                     )
+            scriptGroup.add_argument("--undo",
+                                     metavar="JOURNAL",
+                                     nargs="?",
+                                     const="",
+                                     help="move the files of the last session (or of the session "
+                                          "recorded in JOURNAL) back where they came from"
+                                     )
         #if
         if config.ConfigType.RENAME in configTypes:
             renameGroup = parser.add_argument_group()
@@ -314,62 +734,106 @@ class CommandLineParser:
             renameGroup.add_argument("-target",
                                      metavar="DIRECTORY",
                                      type=str,
-                                     help="move files to this directory (default: %s)" %
-                                          config.Rename().target
+                                     help="move files to this directory (default: %s); "
+                                          "with -R, a relative DIRECTORY is created in every "
+                                          "directory, and an absolute one gets a copy of the "
+                                          "tree" % config.Rename().target
+                                     )
+            renameGroup.add_argument("-R",
+                                     dest="recursive",
+                                     action="store_true",
+                                     help="process all non-hidden subdirectories too"
+                                     )
+            renameGroup.add_argument("--dry-run",
+                                     dest="dryRun",
+                                     action="store_true",
+                                     help="only print what would be renamed"
+                                     )
+            renameGroup.add_argument("--undo",
+                                     metavar="JOURNAL",
+                                     nargs="?",
+                                     const="",
+                                     help="reverse the last run (or the run recorded in JOURNAL)"
+                                     )
+            renameGroup.add_argument("-noverify",
+                                     dest="verify",
+                                     action="store_false",
+                                     help="don't check that converted files are as long as the "
+                                          "originals before renaming (needed for files converted "
+                                          "with -t)"
+                                     )
+            renameGroup.add_argument("--decode-check",
+                                     dest="decodeCheck",
+                                     action="store_true",
+                                     help="also decode a few short segments of every converted "
+                                          "file, including its end, and skip files with errors"
+                                     )
+            renameGroup.add_argument("-j",
+                                     metavar="N",
+                                     dest="jobs",
+                                     type=int,
+                                     help="verify N pairs in parallel (default: %s)"
+                                          % config.Rename().jobs
                                      )
         #if
 
-        try:
-            container = parser.parse_args()
-        except Exception as e:
-            raise CommandLineError(e)
-        #except
-
-        if requireFiles:
-            self.args = container.FILE
-        #if
-        self._cropAndScale = 0
-        self._noOutput = 0
-
-        for t in configTypes:
-            if t == config.ConfigType.GENERAL:
-                self._getGeneralSettings(container)
-            elif t == config.ConfigType.VIDEO:
-                self._getVideoSettings(container)
-            elif t == config.ConfigType.AUDIO:
-                self._getAudioSettings(container)
-            elif t == config.ConfigType.CROPPING:
-                self._getCroppingSettings(container)
-            elif t == config.ConfigType.SCALING:
-                self._getScalingSettings(container)
-            elif t == config.ConfigType.CUTTING:
-                self._getCuttingSettings(container)
-            elif t == config.ConfigType.PROBING:
-                self._getProbingSettings(container)
-            elif t == config.ConfigType.SCRIPT:
-                self._getScriptSettings(container)
-            elif t == config.ConfigType.CLASSIFY:
-                self._getClassifySettings(container)
-            elif t == config.ConfigType.RENAME:
-                self._getRenameSettings(container)
-            else:
-                _logger.error("invalid config type", t)
-            #else
-        #for
-
-        if self._cropAndScale == 3:
-            raise CommandLineError("-c and -s cannot be used at the same time")
-        #if
-        if self._noOutput == 3:
-            raise CommandLineError("cowardly refusing to create media files with no video and no "
-                                   "audio")
-        #if
-    #__init__
+        return parser
+    #_buildParser
 
 
     def _getGeneralSettings(self, container):
         conf = config.General()
         conf.dry = container.dry
+        conf.incremental = container.incremental
+        if container.jobs is not None:
+            if container.jobs < 1:
+                raise CommandLineError("N must be greater than 0")
+            #if
+            conf.jobs = container.jobs
+        #if
+        if container.batch is not None:
+            if container.batch < 1:
+                raise CommandLineError("N must be greater than 0")
+            #if
+            conf.batch = container.batch
+        #if
+        conf.admission = container.admission
+        if container.diskreserve is not None:
+            conf.diskReserve = _parseSize(container.diskreserve)
+        #if
+        if container.memreserve is not None:
+            conf.memReserve = _parseSize(container.memreserve)
+        #if
+        conf.logDir = container.logdir
+        if container.stall is not None:
+            if container.stall < 0:
+                raise CommandLineError("SECONDS must not be negative")
+            #if
+            conf.stall = container.stall
+        #if
+        if container.retries is not None:
+            if container.retries < 0:
+                raise CommandLineError("N must not be negative")
+            #if
+            conf.retries = container.retries
+        #if
+        conf.summary = container.summary
+        conf.metrics = container.metrics
+        if container.order is not None:
+            conf.order = _ORDERS[container.order]
+        #if
+        conf.concat = container.concat
+        if conf.concat is not None:
+            if any(getattr(container, option, None) is not None
+                   for option in [ "croppingFormat", "scalingFactor", "timestampRange",
+                                   "loudnorm" ]):
+                raise CommandLineError("--concat cannot be used with -c, -s, -t or --loudnorm")
+            #if
+        #if
+        conf.skipDupes = container.skipDupes
+        conf.threshold = _threshold(container.threshold, conf.threshold)
+        conf.linkDupes = container.linkDupes
+        conf.dedupe = container.dedupe or conf.linkDupes
         self.config[config.ConfigType.GENERAL] = conf
     #_getGeneralSettings
 
@@ -457,6 +921,16 @@ class CommandLineParser:
             raise Exception("invalid conf.codec value")
         #else
 
+        if container.loudnorm is not None:
+            if conf.codec in [ "copy", "null" ]:
+                raise CommandLineError("--loudnorm needs audio to be transcoded")
+            elif container.loudnorm < -70 or container.loudnorm > -5:
+                raise CommandLineError("TARGET must be between -70 and -5 LUFS")
+            else:
+                conf.loudnorm = container.loudnorm
+            #else
+        #if
+
         self.config[config.ConfigType.AUDIO] = conf
     #_getAudioSettings
 
@@ -580,6 +1054,8 @@ class CommandLineParser:
         conf = config.Probing()
         conf.headers = container.headers
         conf.mode = container.probingMode
+        conf.dupes = container.dupes
+        conf.threshold = _threshold(container.threshold, conf.threshold)
         self.config[config.ConfigType.PROBING] = conf
     #_getProbingSettings
 
@@ -589,6 +1065,21 @@ class CommandLineParser:
         conf.dry = container.dry
         conf.cTemplate = container.cTemplate
         conf.tTemplate = container.tTemplate
+        conf.incremental = container.incremental
+        conf.dedupe = container.dedupe
+        conf.run = container.run
+
+        if conf.run is not None and len(self.args) > 0:
+            raise CommandLineError("--run takes its files from the script; don't give any FILE")
+        #if
+        if container.jobs is not None:
+            if container.jobs < 1:
+                raise CommandLineError("N must be greater than 0")
+            elif conf.run is None:
+                _warning("not running a script; ignoring -j")
+            #elif
+            conf.jobs = container.jobs
+        #if
 
         if container.wilma is not None:
             conf.wilma = container.wilma
@@ -613,6 +1104,25 @@ class CommandLineParser:
         if conf.images and conf.mute:
             _warning("using photo viewer; ignoring -m")
         #if
+        conf.thumbs = container.thumbs
+        if conf.thumbs and conf.images:
+            raise CommandLineError("-i and --thumbs cannot be used at the same time")
+        #if
+        if container.frames is not None:
+            if container.frames < 1:
+                raise CommandLineError("N must be greater than 0")
+            #if
+            conf.frames = container.frames
+        #if
+        if container.ahead is not None:
+            if container.ahead < 0:
+                raise CommandLineError("K must not be negative")
+            #if
+            conf.ahead = container.ahead
+        #if
+        conf.undo = container.undo
+        conf.clusters = container.clusters
+        conf.threshold = _threshold(container.threshold, conf.threshold)
         self.config[config.ConfigType.CLASSIFY] = conf
     #_getClassifySettings
 
@@ -623,9 +1133,106 @@ class CommandLineParser:
         if container.target is not None:
             conf.target = container.target
         #if
+        conf.recursive = container.recursive
+        conf.dryRun = container.dryRun
+        conf.undo = container.undo
+        conf.verify = container.verify
+        conf.decodeCheck = container.decodeCheck
+        if conf.decodeCheck and not conf.verify:
+            raise CommandLineError("--decode-check and -noverify cannot be used at the same time")
+        #if
+        if container.jobs is not None:
+            if container.jobs < 1:
+                raise CommandLineError("N must be greater than 0")
+            #if
+            conf.jobs = container.jobs
+        #if
         self.config[config.ConfigType.RENAME] = conf
     #_getRenameSettings
 
+
+    def _getQueueSettings(self, container):
+        conf = config.Queue()
+        conf.enqueue = container.enqueue
+        conf.worker = container.worker
+        if conf.enqueue is not None and conf.worker is not None:
+            raise CommandLineError("--enqueue and --worker cannot be used at the same time")
+        #if
+        if conf.worker is not None:
+            if len(self.args) > 0:
+                raise CommandLineError("--worker takes its files from the queue; "
+                                       "don't give any FILE")
+            #if
+            if getattr(container, "dry", False):
+                raise CommandLineError("-dry cannot be used with --worker")
+            #if
+        #if
+        if container.lease is not None:
+            if container.lease <= 0:
+                raise CommandLineError("lease must be greater than 0")
+            #if
+            conf.lease = container.lease
+        #if
+        self.config[config.ConfigType.QUEUE] = conf
+    #_getQueueSettings
+
+
+    def _getWatchSettings(self, container):
+        conf = config.Watch()
+        if container.watch is not None:
+            if len(self.args) > 0:
+                raise CommandLineError("--watch takes its files from the watched directory; "
+                                       "don't give any FILE")
+            #if
+            if getattr(container, "enqueue", None) is not None \
+                    or getattr(container, "worker", None) is not None:
+                raise CommandLineError("--watch cannot be used with --enqueue or --worker")
+            #if
+            conf.dir = container.watch
+            conf.outDir = os.path.join(conf.dir, "converted")
+        #if
+        if container.watchOut is not None:
+            conf.outDir = container.watchOut
+        #if
+        conf.doneDir = container.watchDone
+        if container.settle is not None:
+            if container.settle < 0:
+                raise CommandLineError("a negative settle time doesn't make sense")
+            #if
+            conf.settle = container.settle
+        #if
+        if conf.dir is None and (conf.outDir is not None or conf.doneDir is not None):
+            _warning("not in watch mode; ignoring --watch-out and --watch-done")
+        #if
+        self.config[config.ConfigType.WATCH] = conf
+    #_getWatchSettings
+
+
+    def _getPlaySettings(self, container):
+        conf = config.Play()
+        if container.grid is not None:
+            if container.grid < 1:
+                raise CommandLineError("N must be greater than 0")
+            #if
+            conf.grid = container.grid
+        #if
+        self.config[config.ConfigType.PLAY] = conf
+    #_getPlaySettings
+
+
+    def _getProxySettings(self, container):
+        conf = config.Proxy()
+        conf.use = container.useProxy
+        conf.make = container.proxies
+        if conf.make and not conf.use:
+            raise CommandLineError("--proxies and --no-proxy cannot be used at the same time")
+        #if
+        if container.proxyLimit is not None:
+            conf.limit = _parseSize(container.proxyLimit)
+        #if
+        self.config[config.ConfigType.PROXY] = conf
+    #_getProxySettings
+
 #CommandLineParser
 
 
@@ -0,0 +1,172 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""joining several input files into one output file (av-convert --concat)"""
+
+from . import config, records
+import os
+
+
+class ConcatError(Exception):
+    pass
+#ConcatError
+
+
+def _signature(record: records.ProbeRecord, video: bool, audio: bool) -> list:
+    """
+    The properties that must be equal in all inputs for the concat demuxer to
+    join them with stream copy.  Streams of a type the output leaves out
+    (-vnull, -anull) do not count.
+    """
+    ans = []
+    if video:
+        ans += [ ("video", s.codec, s.profile, s.width, s.height, s.pixelFormat,
+                  s.sampleAspectRatio, s.frameRate, s.timeBase) for s in record.video ]
+    #if
+    if audio:
+        ans += [ ("audio", s.codec, s.profile, s.sampleRate, s.channels, s.channelLayout)
+                 for s in record.audio ]
+    #if
+    return ans
+#_signature
+
+
+def incompatibility(files: list, probes: list, video: bool, audio: bool):
+    """
+    Returns None if the streams of all files can be joined with stream copy,
+    else the reason why not.
+
+    :param probes:  probing.probe() of every file
+    :param video:   False if the output has no video (-vnull)
+    :param audio:   False if the output has no audio (-anull)
+    """
+    first = _signature(probes[0], video, audio)
+    if len(first) == 0:
+        return "%s has no %s stream" % (files[0], " or ".join(
+            [ kind for kind, wanted in [ ("video", video), ("audio", audio) ] if wanted ]))
+    #if
+    for file, probe in zip(files[1:], probes[1:]):
+        if _signature(probe, video, audio) != first:
+            return "the streams of %s differ from those of %s" % (file, files[0])
+        #if
+    #for
+    return None
+#incompatibility
+
+
+def listEntry(file: str) -> str:
+    """
+    Returns the line of the concat demuxer's list file that names file.
+    """
+    # single quotes, with ' written as '\''
+    return "file '%s'\n" % os.path.abspath(file).replace("'", "'\\''")
+#listEntry
+
+
+def copyCommand(listFile: str, outputFile: str,
+                confVideo: config.Video, confAudio: config.Audio) -> list:
+    """
+    Returns the FFmpeg command that joins the files listed in listFile with
+    the concat demuxer and stream copy.  Data streams (e.g. camera timecode
+    tracks) are left out, and so are video and audio if confVideo or
+    confAudio asks for none.
+    """
+    cmd = [ 'ffmpeg', '-hide_banner', '-f', 'concat', '-safe', '0', '-i', listFile ]
+    if confVideo.codec != "null":
+        cmd += [ '-map', '0:v?' ]
+    #if
+    if confAudio.codec != "null":
+        cmd += [ '-map', '0:a?' ]
+    #if
+    return cmd + [ '-c', 'copy', outputFile ]
+#copyCommand
+
+
+def encodeCommand(files: list, probes: list, outputFile: str,
+                  confVideo: config.Video, confAudio: config.Audio,
+                  codecOptions: list) -> list:
+    """
+    Returns the FFmpeg command that joins files with the concat filter and
+    encodes the result once with the av-convert settings.  The video of every
+    file is scaled and padded to the resolution of the first one, and the
+    audio is resampled to its format, since the concat filter needs equal
+    formats.
+
+    :param probes:        probing.probe() of every file
+    :param codecOptions:  FFmpeg's video and audio codec options for
+                          confVideo and confAudio
+    :raises ConcatError:  if a file lacks a stream the output needs, or if
+                          -vcopy or -acopy asks for stream copy, which the
+                          concat filter rules out
+    """
+    for codec, option in [ (confVideo.codec, "-vcopy"), (confAudio.codec, "-acopy") ]:
+        if codec == "copy":
+            raise ConcatError("joining them needs a re-encode, which %s rules out" % option)
+        #if
+    #for
+    video = confVideo.codec != "null"
+    audio = confAudio.codec != "null"
+    for file, probe in zip(files, probes):
+        for kind, wanted, streams in [ ("video", video, probe.video),
+                                       ("audio", audio, probe.audio) ]:
+            if wanted and len(streams) == 0:
+                raise ConcatError("%s: no %s stream to join" % (file, kind))
+            #if
+        #for
+    #for
+    firstVideo = probes[0].firstVideo()
+    firstAudio = probes[0].firstAudio()
+
+    cmd = [ 'ffmpeg', '-hide_banner' ]
+    for file in files:
+        cmd += [ '-i', file ]
+    #for
+    filters = []
+    inputs = ""
+    for index in range(len(files)):
+        if video:
+            filters.append("[%d:v:0]scale=%s:%s:force_original_aspect_ratio=decrease,"
+                           "pad=%s:%s:(ow-iw)/2:(oh-ih)/2,setsar=1[v%d]" %
+                           (index, firstVideo.width, firstVideo.height,
+                            firstVideo.width, firstVideo.height, index))
+            inputs += "[v%d]" % index
+        #if
+        if audio:
+            filters.append("[%d:a:0]aformat=sample_rates=%s:channel_layouts=%s[a%d]" %
+                           (index, firstAudio.sampleRate or 48000,
+                            firstAudio.channelLayout or "stereo", index))
+            inputs += "[a%d]" % index
+        #if
+    #for
+    outputs = ("[v]" if video else "") + ("[a]" if audio else "")
+    filters.append("%sconcat=n=%d:v=%d:a=%d%s" % (inputs, len(files), video, audio, outputs))
+    cmd += [ '-filter_complex', ";".join(filters) ]
+    if video:
+        cmd += [ '-map', '[v]' ]
+    #if
+    if audio:
+        cmd += [ '-map', '[a]' ]
+    #if
+    cmd += codecOptions
+    cmd.append(outputFile)
+    return cmd
+#encodeCommand
+
+
+### aczutro ###################################################################
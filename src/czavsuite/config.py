@@ -27,14 +27,47 @@ class ConfigType:
     """
     GENERAL, VIDEO, AUDIO, \
         CROPPING, SCALING, CUTTING, \
-        PROBING, SCRIPT, CLASSIFY, RENAME = range(10)
+        PROBING, SCRIPT, CLASSIFY, RENAME, \
+        QUEUE, WATCH, PLAY, PROXY = range(14)
 #ConfigType
 
 
+# config types of av-convert; also used to parse av-convert lines of scripts
+CONVERT_CONFIG_TYPES = [ ConfigType.GENERAL,
+                         ConfigType.VIDEO,
+                         ConfigType.AUDIO,
+                         ConfigType.CROPPING,
+                         ConfigType.SCALING,
+                         ConfigType.CUTTING,
+                         ConfigType.QUEUE,
+                         ConfigType.WATCH ]
+
+
 @czcode.autoStr
 class General:
+    class Order:
+        GIVEN, SAVINGS, SHORTEST, LONGEST = range(4)
+    #Order
+
     def __init__(self):
         self.dry = False
+        self.jobs = 1 # number of conversion jobs to run in parallel
+        self.batch = 1 # number of files to convert with one FFmpeg process
+        self.incremental = False # if true, skip jobs whose output is up to date
+        self.admission = True # if true, wait for disk space and memory before each job
+        self.diskReserve = 1 << 30 # bytes to keep free on the output file system
+        self.memReserve = 512 << 20 # bytes of memory to keep free
+        self.logDir = None # directory for per-job FFmpeg logs, or None for the cache
+        self.stall = 300.0 # seconds without progress after which a job is killed, or 0
+        self.retries = 2 # number of times a failed job is tried again
+        self.summary = None # file to write a JSON summary of all jobs to, or None
+        self.metrics = None # Prometheus textfile to keep up to date, or None
+        self.order = self.Order.GIVEN # order in which files are converted
+        self.concat = None # file to join all input files into, or None
+        self.skipDupes = False # if true, convert only one file of each cluster of near duplicates
+        self.threshold = 10 # differing perceptual hash bits per frame that still count as similar
+        self.dedupe = False # if true, convert only one of several identical input files
+        self.linkDupes = False # if true, hard-link the outputs of identical input files
     #__init
 #General
 
@@ -55,6 +88,7 @@ class Audio:
         self.codec = "aac"
         self.bitrate = "256k"
         self.quality = "0"
+        self.loudnorm = None # target integrated loudness in LUFS, or None
     #__init
 #Audio
 
@@ -97,6 +131,8 @@ class Probing:
     def __init__(self):
         self.headers = False
         self.mode = Probing.FULL
+        self.dupes = False # if true, report clusters of near-duplicate files
+        self.threshold = 10 # differing perceptual hash bits per frame that still count as similar
     #__init
 #Probing
 
@@ -109,6 +145,10 @@ class Script:
         self.betty = ".betty"
         self.tTemplate = False
         self.cTemplate = False
+        self.incremental = False # if true, add -incremental to av-convert commands
+        self.run = None # if not None, run the av-convert lines of this script
+        self.jobs = 1 # number of script lines to run in parallel
+        self.dedupe = False # if true, comment out the lines of identical input files
     #__init
 #Script
 
@@ -124,6 +164,12 @@ class Classify:
         self.reverse = False
         self.images = False
         self.mute = False
+        self.thumbs = False # if true, show a grid of frames instead of playing videos
+        self.frames = 9 # number of frames per grid
+        self.ahead = 4 # number of grids to create in the background
+        self.undo = None # journal of the session to undo ("" for the last one), or None
+        self.clusters = False # if true, present near-duplicate files one after the other
+        self.threshold = 10 # differing perceptual hash bits per frame that still count as similar
     #__init
 #Classify
 
@@ -133,8 +179,55 @@ class Rename:
     def __init__(self):
         self.extension = "mp4"
         self.target = ".avrename"
+        self.recursive = False # if true, process the whole directory tree
+        self.dryRun = False # if true, only print the renames
+        self.undo = None # journal of the renames to undo ("" for the last one), or None
+        self.verify = True # if true, rename only pairs whose converted file is complete
+        self.decodeCheck = False # if true, also decode a few segments of every converted file
+        self.jobs = 4 # number of pairs verified in parallel
     #__init
 #Classify
 
 
+@czcode.autoStr
+class Queue:
+    def __init__(self):
+        self.enqueue = None # queue directory to add jobs to
+        self.worker = None # queue directory to take jobs from
+        self.lease = 600.0 # seconds after which a claim of a dead worker expires
+    #__init
+#Queue
+
+
+@czcode.autoStr
+class Watch:
+    def __init__(self):
+        self.dir = None # directory to watch for new media files
+        self.outDir = None # where converted files go (default: DIR/converted)
+        self.doneDir = None # where finished inputs go (default: hide them in DIR)
+        self.settle = 10.0 # seconds a file must stop growing before it is converted
+        self.poll = 5.0 # seconds between directory scans if inotify is unavailable
+    #__init
+#Watch
+
+
+@czcode.autoStr
+class Play:
+    def __init__(self):
+        self.grid = None # number of frames of a contact sheet to show instead of playing, or None
+    #__init
+#Play
+
+
+@czcode.autoStr
+class Proxy:
+    def __init__(self):
+        self.use = True # if true, play the proxy of a file if there is one
+        self.make = False # if true, create missing proxies in the background
+        self.limit = 20 << 30 # bytes the proxy cache may take up
+        self.jobs = 2 # number of proxies to create in parallel
+    #__init
+#Proxy
+
+
 ### aczutro ###################################################################
@@ -19,9 +19,18 @@
 
 """av-convert and av-play implementation"""
 
-from . import config, probing
+from . import config, profiling
 from czutils.utils import czlogging, czsystem
+import functools
 import os.path
+import threading
+import time
+
+
+# Modules that only some jobs need (admission, cache, incremental, loudness,
+# probing, runner) are imported where they are used: av-convert is started
+# once per file by scripts, and a dry run or a plain conversion should not pay
+# for them.
 
 
 _logger = czlogging.LoggingChannel("czavsuite.convert",
@@ -52,6 +61,11 @@ class ConvertError(Exception):
 #ConvertError
 
 
+def _stderr(err):
+    print("%s:" % czsystem.appName(), "error:", err, flush=True)
+#_stderr
+
+
 def _outputFilename(inputFile: str, videoCodec: str, audioCodec: str):
     """
     """
@@ -62,8 +76,9 @@ def _outputFilename(inputFile: str, videoCodec: str, audioCodec: str):
     elif audioCodec == "mp3":
         outputType = "mp3"
     elif audioCodec == "copy":
-        inputCodec = probing.ffprobe(inputFile, config.Probing.AUDIO)["codec_name"]
-        outputType = "mp3" if inputCodec == "mp3" else "m4a"
+        from . import probing
+        stream = probing.probe(inputFile).firstAudio()
+        outputType = "mp3" if stream is not None and stream.codec == "mp3" else "m4a"
     else:
         raise ValueError
     #else
@@ -87,14 +102,17 @@ def _outputFilename(inputFile: str, videoCodec: str, audioCodec: str):
 #_outputFilename
 
 
-def _checkExistence(filename: str):
+def _checkExistence(filename: str, interactive=True):
     """tests whether a file exists, and if it does,
      asks the user whether to overwrite;
      if user answer yes, removes the file;
-     if user answers no, raises an exception"""
+     if user answers no, raises an exception;
+     if not interactive, raises an exception without asking"""
     try:
         if os.path.exists(filename):
-            if input("file %s already exists -- overwrite? " % filename) \
+            if not interactive:
+                raise ConvertError("file %s already exists" % filename)
+            elif input("file %s already exists -- overwrite? " % filename) \
                     in [ 'y', 'Y', 'yes', 'YES' ]:
                 os.remove(filename)
             else:
@@ -107,6 +125,34 @@ def _checkExistence(filename: str):
 #_checkExistence
 
 
+def prepareOutput(file: str, confVideo: config.Video, confAudio: config.Audio,
+                  outputDir=None, interactive=True, incrementalMode=False) -> str:
+    """
+    Returns the output file name for file, after making sure that it may be
+    written (asks the user before overwriting an existing file).
+
+    :param outputDir:        if not None, put the output file into this
+                             directory instead of next to the input file
+    :param interactive:      if False, refuse to overwrite without asking
+    :param incrementalMode:  if True, an existing output file that has a
+                             fingerprint is not questioned: convertFile()
+                             decides whether it is up to date
+    """
+    outputFile = _outputFilename(file, confVideo.codec, confAudio.codec)
+    if outputDir is not None:
+        outputFile = os.path.join(outputDir, os.path.basename(outputFile))
+    #if
+    if incrementalMode:
+        from . import incremental
+        if os.path.exists(incremental.sidecar(outputFile)):
+            return outputFile
+        #if
+    #if
+    _checkExistence(outputFile, interactive)
+    return outputFile
+#prepareOutput
+
+
 def _toFFmpegVideo(conf: config.Video) -> list:
     if conf.codec == "h265":
         codec = "libx265"
@@ -127,25 +173,28 @@ def _toFFmpegVideo(conf: config.Video) -> list:
 #_toFFmpegVideo
 
 
-def _toFFmpegAudio(conf: config.Audio) -> list:
+def _toFFmpegAudio(conf: config.Audio, measured=None, sampleRate=None) -> list:
+    """
+    :param measured:    loudness measurement of the input (see loudness.py);
+                        required if conf.loudnorm is set
+    :param sampleRate:  sample rate of the input; the loudnorm filter outputs
+                        192 kHz, so with conf.loudnorm set, the output is
+                        resampled to this rate (default: 48 kHz)
+    """
     if conf.codec == "aac":
-        codec = [ "-c:a", "aac" ]
+        ans = [ "-c:a", "aac" ]
         if conf.bitrate is not None:
-            return codec + [ "-b:a", conf.bitrate ]
-        else:
-            return codec
+            ans += [ "-b:a", conf.bitrate ]
         #if
     elif conf.codec == "mp3":
-        codec = [ "-c:a", "libmp3lame" ]
+        ans = [ "-c:a", "libmp3lame" ]
         if conf.bitrate and conf.quality:
             raise ValueError
         elif conf.bitrate is not None:
-            return codec + [ "-b:a", conf.bitrate ]
+            ans += [ "-b:a", conf.bitrate ]
         elif conf.quality is not None:
-            return codec + [ "-q:a", conf.quality ]
-        else:
-            return codec
-        #if
+            ans += [ "-q:a", conf.quality ]
+        #elif
     elif conf.codec == "null":
         return [ "-an" ]
     elif conf.codec == "copy":
@@ -153,6 +202,15 @@ def _toFFmpegAudio(conf: config.Audio) -> list:
     else:
         raise ValueError
     #else
+    if conf.loudnorm is not None:
+        if measured is None:
+            raise ValueError
+        #if
+        from . import loudness
+        ans += [ "-af", loudness.normalisationFilter(conf.loudnorm, measured),
+                 "-ar", str(sampleRate or 48000) ]
+    #if
+    return ans
 #_toFFmpegAudio
 
 
@@ -168,11 +226,13 @@ def _toFFmpegCropping(conf: config.Cropping) -> list:
 
 def _toFFmpegScaling(file: str, conf: config.Scaling) -> list:
     if conf.valid:
-        probe = probing.ffprobe(file, config.Probing.VIDEO)
-        width = int(probe["width"])
-        height = int(probe["height"])
-        fWidth = width * conf.factor
-        fHeight = height * conf.factor
+        from . import probing
+        stream = probing.probe(file).firstVideo()
+        if stream is None or stream.width is None or stream.height is None:
+            raise ConvertError("%s: no video resolution to scale" % file)
+        #if
+        fWidth = stream.width * conf.factor
+        fHeight = stream.height * conf.factor
         width = int(fWidth) + int(fWidth) % 2
         height = int(fHeight) + int(fHeight) % 2
         return [ '-vf', 'scale=%d:%d' % (width, height) ]
@@ -204,6 +264,623 @@ def _toFFmpegCuttting(conf: config.Cutting) -> list:
 #_toFFmpegCuttting
 
 
+def _outputOptions(file: str,
+                   confVideo: config.Video,
+                   confAudio: config.Audio,
+                   confCropping: config.Cropping,
+                   confScaling: config.Scaling,
+                   confCutting: config.Cutting) -> list:
+    """
+    Returns the FFmpeg options that go between the input and the output file
+    name.
+    """
+    measured = None
+    sampleRate = None
+    if confAudio.loudnorm is not None:
+        from . import loudness, probing
+        try:
+            measured = loudness.measurement(file, confCutting)
+        except loudness.LoudnessError as e:
+            raise ConvertError(e)
+        #except
+        stream = probing.probe(file).firstAudio()
+        sampleRate = None if stream is None else stream.sampleRate
+    #if
+    return (_toFFmpegCropping(confCropping) + _toFFmpegScaling(file, confScaling) +
+            _toFFmpegVideo(confVideo) + _toFFmpegAudio(confAudio, measured, sampleRate) +
+            _toFFmpegCuttting(confCutting))
+#_outputOptions
+
+
+def _ffmpegCommand(file: str, outputFile: str,
+                   confVideo: config.Video,
+                   confAudio: config.Audio,
+                   confCropping: config.Cropping,
+                   confScaling: config.Scaling,
+                   confCutting: config.Cutting) -> list:
+    return ([ 'ffmpeg', '-hide_banner', '-i', file ] +
+            _outputOptions(file, confVideo, confAudio, confCropping, confScaling, confCutting) +
+            [ outputFile ])
+#_ffmpegCommand
+
+
+def _batchCommand(pairs: list,
+                  confVideo: config.Video,
+                  confAudio: config.Audio,
+                  confCropping: config.Cropping,
+                  confScaling: config.Scaling,
+                  confCutting: config.Cutting) -> list:
+    """
+    Returns one FFmpeg command line that converts several files: every
+    (input, output) pair gets its own -i, its own -map options and its own
+    output options.
+    """
+    ans = [ 'ffmpeg', '-hide_banner' ]
+    for file, outputFile in pairs:
+        ans += [ '-i', file ]
+    #for
+    for index, (file, outputFile) in enumerate(pairs):
+        if confVideo.codec != "null":
+            ans += [ '-map', '%d:v:0?' % index ]
+        #if
+        if confAudio.codec != "null":
+            ans += [ '-map', '%d:a:0?' % index ]
+        #if
+        ans += _outputOptions(file, confVideo, confAudio, confCropping, confScaling, confCutting)
+        ans.append(outputFile)
+    #for
+    return ans
+#_batchCommand
+
+
+# seconds to wait before the first retry of a failed job; doubled for every
+# further retry
+_RETRY_BACKOFF = 10.0
+
+
+class JobSummary:
+    """Collects the outcome of every job of a run, so that failed jobs can be
+    listed at the end, and passes it on to metrics (a metrics.Metrics, or
+    None).  Thread-safe.
+    """
+    def __init__(self, metrics=None):
+        self._lock = threading.Lock()
+        self.jobs = []
+        self.metrics = metrics
+    #__init__
+
+
+    def add(self, file: str, outputFile: str, status: str, **details) -> None:
+        """
+        :param status:   "ok", "failed", "dry", "up to date" or "duplicate"
+        :param details:  e.g. returnCode, attempts, stalled, seconds, log, error
+        """
+        job = { "input": file, "output": outputFile, "status": status }
+        job.update(details)
+        with self._lock:
+            self.jobs.append(job)
+        #with
+        if self.metrics is not None:
+            self.metrics.add(job)
+        #if
+    #add
+
+
+    def failed(self) -> list:
+        with self._lock:
+            return [ job for job in self.jobs if job["status"] == "failed" ]
+        #with
+    #failed
+
+
+    def report(self, summaryFile=None) -> None:
+        """
+        Prints the failed jobs, and writes all jobs to summaryFile (JSON) if
+        it is not None.
+        """
+        failed = self.failed()
+        if failed:
+            print("%d of %d jobs failed:" % (len(failed), len(self.jobs)))
+            for job in failed:
+                if "error" in job:
+                    reason = job["error"]
+                elif job.get("stalled"):
+                    reason = "stalled"
+                else:
+                    reason = "FFmpeg returned %s" % job.get("returnCode")
+                #else
+                print("    %s: %s" % (job["input"], reason))
+            #for
+        #if
+        if summaryFile is not None:
+            from . import cache
+            with self._lock:
+                cache.saveJSON(summaryFile, { "total": len(self.jobs),
+                                              "failed": len(failed),
+                                              "jobs": self.jobs })
+            #with
+        #if
+        if self.metrics is not None:
+            self.metrics.write()
+        #if
+    #report
+
+#JobSummary
+
+
+def _run(cmd: list, label: str, outputFiles: list, confGeneral: config.General, log,
+         retries=0, metrics=None) -> tuple:
+    """
+    Runs an FFmpeg command with its output going to a per-job log file, and
+    logs one line with the outcome (plus the last lines of FFmpeg's output if
+    it failed).  A failed or stalled command is run again up to retries times,
+    after removing whatever it wrote to outputFiles.
+
+    :param metrics:  a metrics.Metrics that follows the job, or None
+    :returns:        (runner.JobResult of the last attempt, number of attempts)
+    """
+    if metrics is None:
+        return _attempts(cmd, label, outputFiles, confGeneral, log, retries, None)
+    #if
+    start = time.monotonic()
+    metrics.started(label, len(outputFiles))
+    try:
+        return _attempts(cmd, label, outputFiles, confGeneral, log, retries,
+                         functools.partial(metrics.progress, label))
+    finally:
+        metrics.stopped(label, time.monotonic() - start)
+    #finally
+#_run
+
+
+def _attempts(cmd: list, label: str, outputFiles: list, confGeneral: config.General, log,
+              retries: int, onProgress) -> tuple:
+    from . import runner
+    stallTimeout = confGeneral.stall if confGeneral.stall > 0 else None
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with profiling.span("ffmpeg", "file", file=label, attempt=attempt):
+                result = runner.run(cmd, runner.logFileFor(label, confGeneral.logDir),
+                                    stallTimeout, onProgress)
+            #with
+        except OSError as e:
+            raise ConvertError(e)
+        #except
+        if result.returnCode == 0:
+            log("%s: ok (%.1f s)" % (label, result.seconds))
+            return result, attempt
+        #if
+        if result.stalled:
+            log("%s: no progress for %s s, killed; full log: %s" %
+                (label, confGeneral.stall, result.logFile))
+        else:
+            log("%s: FFmpeg returned %d after %.1f s; full log: %s" %
+                (label, result.returnCode, result.seconds, result.logFile))
+        #else
+        for line in result.tail:
+            log("    %s" % line)
+        #for
+        if attempt > retries:
+            return result, attempt
+        #if
+        delay = _RETRY_BACKOFF * 2 ** (attempt - 1)
+        log("%s: retrying in %d s (attempt %d of %d)" % (label, delay, attempt + 1, retries + 1))
+        for outputFile in outputFiles:
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+            #if
+        #for
+        time.sleep(delay)
+    #while
+#_attempts
+
+
+def convertFile(file: str,
+                outputFile: str,
+                confGeneral: config.General,
+                confVideo: config.Video,
+                confAudio: config.Audio,
+                confCropping: config.Cropping,
+                confScaling: config.Scaling,
+                confCutting: config.Cutting,
+                control=None,
+                log=print,
+                summary=None) -> int:
+    """
+    Converts one file (or only prints the FFmpeg command line if
+    confGeneral.dry is set).  Does not check whether outputFile exists.
+
+    If confGeneral.incremental is set, the job is skipped if outputFile was
+    built from the same input with the same command line, and an outdated
+    outputFile is rebuilt.
+
+    FFmpeg's output goes to a compressed log file in confGeneral.logDir.  A
+    job that fails or stalls (confGeneral.stall) is tried again up to
+    confGeneral.retries times.
+
+    :param control:  an admission.AdmissionControl, or None to start right away
+    :param log:      print-like function that receives one line per job (the
+                     command line if dry, and the end of FFmpeg's output if it
+                     fails)
+    :param summary:  a JobSummary that receives the outcome, or None
+    :returns:        FFmpeg's return code
+    """
+    with profiling.span("build command", file=file):
+        cmd = _ffmpegCommand(file, outputFile, confVideo, confAudio,
+                             confCropping, confScaling, confCutting)
+    #with
+    fingerprint = None
+    if confGeneral.incremental:
+        from . import incremental
+        fingerprint = incremental.fingerprint(file, cmd)
+        if incremental.isUpToDate(outputFile, fingerprint):
+            log("%s is up to date" % outputFile)
+            if summary is not None:
+                summary.add(file, outputFile, "up to date")
+            #if
+            return 0
+        #if
+    #if
+    if confGeneral.dry:
+        log(" ".join(cmd))
+        if summary is not None:
+            summary.add(file, outputFile, "dry")
+        #if
+        return 0
+    #if
+    _logger.info(" ".join(cmd))
+    if fingerprint is not None:
+        # the output is about to be overwritten: only a successful run may
+        # mark it as current again
+        incremental.forget(outputFile)
+        if os.path.exists(outputFile):
+            log("%s is out of date; rebuilding" % outputFile)
+            os.remove(outputFile)
+        #if
+    #if
+
+    estimate = None
+    if control is not None:
+        from . import admission
+        estimate = control.estimate(file, outputFile, confVideo, confAudio,
+                                    confCropping, confScaling, confCutting)
+        try:
+            with profiling.span("admission wait", file=file):
+                control.acquire(estimate)
+            #with
+        except admission.AdmissionError as e:
+            raise ConvertError(e)
+        #except
+    #if
+    returnCode = 1
+    try:
+        result, attempts = _run(cmd, outputFile, [ outputFile ], confGeneral, log,
+                                confGeneral.retries,
+                                summary.metrics if summary is not None else None)
+        returnCode = result.returnCode
+        if fingerprint is not None and returnCode == 0:
+            incremental.record(outputFile, fingerprint)
+        #if
+        if summary is not None:
+            summary.add(file, outputFile, "ok" if returnCode == 0 else "failed",
+                        returnCode=returnCode, attempts=attempts, stalled=result.stalled,
+                        seconds=round(result.seconds, 1), log=result.logFile)
+        #if
+    finally:
+        if estimate is not None:
+            control.release(estimate, returnCode == 0)
+        #if
+    #finally
+    return returnCode
+#convertFile
+
+
+def convertBatch(pairs: list,
+                 confGeneral: config.General,
+                 confVideo: config.Video,
+                 confAudio: config.Audio,
+                 confCropping: config.Cropping,
+                 confScaling: config.Scaling,
+                 confCutting: config.Cutting,
+                 control=None,
+                 log=print,
+                 summary=None) -> int:
+    """
+    Converts several files with a single FFmpeg process, which saves FFmpeg's
+    start-up time for every file but the first.  If FFmpeg fails, the files
+    are converted again one at a time, so that one bad input does not fail the
+    whole batch.
+
+    :param pairs:  list of (input file, output file)
+    :returns:      FFmpeg's return code(s), or-ed
+    """
+    fingerprints = {}
+    if confGeneral.incremental:
+        from . import incremental
+        remaining = []
+        for file, outputFile in pairs:
+            fingerprint = incremental.fingerprint(
+                file, _ffmpegCommand(file, outputFile, confVideo, confAudio,
+                                     confCropping, confScaling, confCutting))
+            if incremental.isUpToDate(outputFile, fingerprint):
+                log("%s is up to date" % outputFile)
+                if summary is not None:
+                    summary.add(file, outputFile, "up to date")
+                #if
+            else:
+                fingerprints[outputFile] = fingerprint
+                remaining.append((file, outputFile))
+            #else
+        #for
+        pairs = remaining
+    #if
+
+    if len(pairs) < 2:
+        ans = 0
+        for file, outputFile in pairs:
+            ans |= convertFile(file, outputFile, confGeneral, confVideo, confAudio,
+                               confCropping, confScaling, confCutting, control, log, summary)
+        #for
+        return ans
+    #if
+
+    cmd = _batchCommand(pairs, confVideo, confAudio, confCropping, confScaling, confCutting)
+    if confGeneral.dry:
+        log(" ".join(cmd))
+        if summary is not None:
+            for file, outputFile in pairs:
+                summary.add(file, outputFile, "dry")
+            #for
+        #if
+        return 0
+    #if
+    _logger.info(" ".join(cmd))
+    for file, outputFile in pairs:
+        if outputFile in fingerprints:
+            incremental.forget(outputFile) # see convertFile
+            if os.path.exists(outputFile):
+                log("%s is out of date; rebuilding" % outputFile)
+                os.remove(outputFile)
+            #if
+        #if
+    #for
+
+    estimate = None
+    if control is not None:
+        from . import admission
+        # FFmpeg opens all encoders at once, so the batch needs the sum of
+        # the individual estimates
+        estimates = [ control.estimate(file, outputFile, confVideo, confAudio,
+                                       confCropping, confScaling, confCutting)
+                      for file, outputFile in pairs ]
+        estimate = admission.Estimate(pairs[0][1],
+                                      sum(e.outputBytes for e in estimates),
+                                      sum(e.memoryBytes for e in estimates),
+                                      None, None, 0, 0.0)
+        try:
+            control.acquire(estimate)
+        except admission.AdmissionError as e:
+            raise ConvertError(e)
+        #except
+    #if
+    returnCode = 1
+    try:
+        # no retries: if the batch fails, its files are retried one at a time
+        result, attempts = _run(cmd, "%s+%d" % (pairs[0][1], len(pairs) - 1),
+                                [ outputFile for file, outputFile in pairs ], confGeneral, log,
+                                0, summary.metrics if summary is not None else None)
+        returnCode = result.returnCode
+    finally:
+        if estimate is not None:
+            control.release(estimate, returnCode == 0)
+        #if
+    #finally
+
+    if returnCode == 0:
+        for outputFile, fingerprint in fingerprints.items():
+            incremental.record(outputFile, fingerprint)
+        #for
+        if summary is not None:
+            for file, outputFile in pairs:
+                summary.add(file, outputFile, "ok", returnCode=0, attempts=1, stalled=False,
+                            seconds=round(result.seconds, 1), log=result.logFile)
+            #for
+        #if
+        return 0
+    #if
+
+    log("batch of %d files failed (return code %d); converting them one at a time" %
+        (len(pairs), returnCode))
+    from . import incremental
+    for file, outputFile in pairs:
+        incremental.forget(outputFile)
+        if os.path.exists(outputFile):
+            os.remove(outputFile) # written by the failed batch
+        #if
+    #for
+    ans = 0
+    for file, outputFile in pairs:
+        ans |= convertFile(file, outputFile, confGeneral, confVideo, confAudio,
+                           confCropping, confScaling, confCutting, control, log, summary)
+    #for
+    return ans
+#convertBatch
+
+
+def admissionControl(confGeneral: config.General):
+    """
+    Returns the admission.AdmissionControl that confGeneral asks for, or None.
+    """
+    if confGeneral.admission and not confGeneral.dry:
+        from . import admission
+        return admission.AdmissionControl(confGeneral.diskReserve, confGeneral.memReserve)
+    else:
+        return None
+    #else
+#admissionControl
+
+
+def _convertSafely(function, pairs: list, *args, summary: JobSummary) -> int:
+    """
+    Calls function (convertBatch) for pairs, but records an exception as a
+    failure of the jobs that have no outcome yet, so that the remaining jobs
+    still run.
+    """
+    # (_outputOptions turns a loudness.LoudnessError into a ConvertError)
+    try:
+        return function(pairs, *args, summary=summary)
+    except (ConvertError, OSError) as e:
+        _stderr(e)
+        done = { job["output"] for job in summary.jobs }
+        for file, outputFile in pairs:
+            if outputFile not in done:
+                summary.add(file, outputFile, "failed", error=str(e))
+            #if
+        #for
+        return 1
+    #except
+#_convertSafely
+
+
+def _skipIdentical(files: list) -> tuple:
+    """
+    Returns files without the files that are identical to an earlier one,
+    plus { skipped file: the file that is converted instead }.
+    """
+    from . import identical
+    files = list(dict.fromkeys(files)) # a file given twice is converted once
+    identicalTo = {}
+    for group in identical.duplicates(files):
+        for file in group[1:]:
+            print("skipping %s (identical to %s)" % (file, group[0]))
+            identicalTo[file] = group[0]
+        #for
+    #for
+    return [ file for file in files if file not in identicalTo ], identicalTo
+#_skipIdentical
+
+
+def _linkIdentical(identicalTo: dict, confVideo: config.Video, confAudio: config.Audio,
+                   summary: JobSummary) -> None:
+    """
+    Gives every skipped identical file the output of the file that was
+    converted instead, as a hard link.
+    """
+    outputs = { job["input"]: job["output"] for job in summary.jobs
+                if job["status"] in [ "ok", "up to date" ] }
+    for file, original in identicalTo.items():
+        linked = None
+        if original in outputs:
+            outputFile = _outputFilename(file, confVideo.codec, confAudio.codec)
+            try:
+                if os.path.exists(outputFile):
+                    os.remove(outputFile) # cleared by prepareOutput()
+                #if
+                os.link(outputs[original], outputFile)
+                print("%s -> %s" % (outputFile, outputs[original]))
+                linked = outputFile
+            except OSError as e:
+                _stderr(e)
+            #except
+        #if
+        summary.add(file, linked, "duplicate", of=original)
+    #for
+#_linkIdentical
+
+
+def _skipNearDuplicates(files: list, summary: JobSummary, threshold: int) -> list:
+    """
+    Returns files without all but the largest file of every cluster of near
+    duplicates (see dupes.clusters).  The skipped files are recorded in
+    summary.
+    """
+    from . import dupes
+    try:
+        clusterOf = dupes.clusterOf(files, threshold)
+    except dupes.DupesError as e:
+        raise ConvertError(e)
+    #except
+    ans = []
+    for file in files:
+        cluster = clusterOf.get(file)
+        keep = file if cluster is None else max(cluster, key=os.path.getsize)
+        if file == keep:
+            ans.append(file)
+        else:
+            print("skipping %s (near duplicate of %s)" % (file, keep))
+            summary.add(file, None, "duplicate", of=keep)
+        #else
+    #for
+    return ans
+#_skipNearDuplicates
+
+
+_ORDER_JOBS = 8 # files probed in parallel to order them
+
+
+def _order(files: list, confGeneral: config.General, confVideo: config.Video,
+           confAudio: config.Audio, confCropping: config.Cropping, confScaling: config.Scaling,
+           confCutting: config.Cutting) -> list:
+    """
+    Returns files in the order confGeneral.order asks for.  Files whose
+    duration is unknown go last, in the given order.
+
+    - SAVINGS:  by expected bytes saved per unit of encoder CPU time (see
+                admission.Estimate), largest first
+    - SHORTEST: by duration, shortest first (lowest average latency)
+    - LONGEST:  by duration, longest first (the long jobs do not end up
+                running alone at the end of a parallel run)
+    """
+    if confGeneral.order == config.General.Order.GIVEN or len(files) < 2:
+        return files
+    #if
+    import concurrent.futures
+    if confGeneral.order == config.General.Order.SAVINGS:
+        from . import admission
+        control = admission.AdmissionControl(0, 0) # only for its estimates
+
+        def key(file):
+            # a file that cannot be probed goes last; it fails when its turn comes
+            try:
+                estimate = control.estimate(file, None, confVideo, confAudio,
+                                            confCropping, confScaling, confCutting)
+                cost = estimate.cost()
+                return None if not cost else -estimate.savedBytes(file) / cost
+            except (OSError, czsystem.SystemCallError) as e:
+                _logger.warning(e)
+                return None
+            #except
+        #key
+
+    else:
+        from . import probing
+        sign = 1 if confGeneral.order == config.General.Order.SHORTEST else -1
+
+        def key(file):
+            try:
+                duration = probing.cachedDurationSeconds(file)
+            except (OSError, czsystem.SystemCallError) as e:
+                _logger.warning(e)
+                return None
+            #except
+            return None if duration is None else sign * duration
+        #key
+
+    #else
+    with profiling.span("order", files=len(files)):
+        with concurrent.futures.ThreadPoolExecutor(_ORDER_JOBS) as pool:
+            keys = list(pool.map(key, files))
+        #with
+    #with
+    known = sorted((k, i) for i, k in enumerate(keys) if k is not None)
+    ans = [ files[i] for k, i in known ] + [ file for file, k in zip(files, keys) if k is None ]
+    _logger.info("order:", ans)
+    return ans
+#_order
+
+
 def avConvert(files: list,
               confGeneral: config.General,
               confVideo: config.Video,
@@ -211,55 +888,247 @@ def avConvert(files: list,
               confCropping: config.Cropping,
               confScaling: config.Scaling,
               confCutting: config.Cutting):
-    S = czsystem.SystemCaller(True)
+    """
+    Converts files.  A job that fails (after confGeneral.retries retries) does
+    not stop the others; failed jobs are listed at the end, and all jobs are
+    written to confGeneral.summary if set.
+    """
+    control = admissionControl(confGeneral)
+    summary = JobSummary()
+    if confGeneral.metrics is not None:
+        from . import metrics
+        # the metrics were asked for, so say when they cannot be written
+        metrics.setLoggingOptions(czlogging.LoggingLevel.WARNING)
+        summary.metrics = metrics.Metrics(confGeneral.metrics)
+        summary.metrics.plan(len(files))
+    #if
     ans = 0
-    for file in files:
-        outputFile = _outputFilename(file, confVideo.codec, confAudio.codec)
-        _checkExistence(outputFile)
-        cmd = ([ 'ffmpeg', '-hide_banner', '-i', file ] + _toFFmpegCropping(confCropping) +
-               _toFFmpegScaling(file, confScaling) + _toFFmpegVideo(confVideo) +
-               _toFFmpegAudio(confAudio) + _toFFmpegCuttting(confCutting) + [ outputFile ])
-        print(" ".join(cmd))
-        if not confGeneral.dry:
-            try:
-                returnCode = S.call(cmd)
-                ans |= returnCode
-                _logger.info("return code:", returnCode)
-                _logger.info("stdout:", S.stdout())
-                _logger.info("stderr:", S.stderr())
-                print(S.stderr())
-                print("=======================")
-            except czsystem.SystemCallError as e:
-                raise ConvertError(e)
-            #except
+    identicalTo = {}
+    if confGeneral.dedupe:
+        with profiling.span("identical files", files=len(files)):
+            files, identicalTo = _skipIdentical(files)
+        #with
+        if confGeneral.linkDupes and not confGeneral.dry:
+            for file in identicalTo:
+                prepareOutput(file, confVideo, confAudio, incrementalMode=confGeneral.incremental)
+            #for
         #if
-    #for
+    #if
+    if confGeneral.skipDupes:
+        with profiling.span("near duplicates", files=len(files)):
+            files = _skipNearDuplicates(files, summary, confGeneral.threshold)
+        #with
+    #if
+    files = _order(files, confGeneral, confVideo, confAudio, confCropping, confScaling,
+                   confCutting)
+    if confAudio.loudnorm is not None:
+        from . import loudness
+        try:
+            with profiling.span("loudness measurements", files=len(files)):
+                loudness.measureAll(files, confCutting, confGeneral.jobs)
+            #with
+        except loudness.LoudnessError as e:
+            _stderr(e) # the job of that file will fail; the others can go ahead
+        #except
+    #if
+    if confGeneral.jobs == 1 and confGeneral.batch == 1:
+        for file in files:
+            outputFile = prepareOutput(file, confVideo, confAudio,
+                                       incrementalMode=confGeneral.incremental)
+            ans |= _convertSafely(convertBatch, [ (file, outputFile) ], confGeneral,
+                                  confVideo, confAudio, confCropping, confScaling, confCutting,
+                                  control, summary=summary)
+        #for
+    else:
+        import concurrent.futures # only needed here; keeps start-up of serial runs short
+        # ask all overwrite questions before anything runs in the background
+        pairs = [ (file, prepareOutput(file, confVideo, confAudio,
+                                       incrementalMode=confGeneral.incremental))
+                  for file in files ]
+        batches = [ pairs[i:i + confGeneral.batch]
+                    for i in range(0, len(pairs), confGeneral.batch) ]
+        with concurrent.futures.ThreadPoolExecutor(confGeneral.jobs) as pool:
+            futures = [ pool.submit(_convertSafely, convertBatch, batch,
+                                    confGeneral, confVideo, confAudio,
+                                    confCropping, confScaling, confCutting, control,
+                                    summary=summary)
+                        for batch in batches ]
+            for future in futures:
+                ans |= future.result()
+            #for
+        #with
+    #else
+    if confGeneral.linkDupes and not confGeneral.dry:
+        _linkIdentical(identicalTo, confVideo, confAudio, summary)
+    else:
+        for file, original in identicalTo.items():
+            summary.add(file, None, "duplicate", of=original)
+        #for
+    #else
+    summary.report(confGeneral.summary)
     return ans
 #avConvert
 
 
-def avPlay(files: list,
-           confCropping: config.Cropping,
-           confScaling: config.Scaling,
-           confCutting: config.Cutting):
-    S = czsystem.SystemCaller(True)
+def avConcat(files: list, outputFile: str, confGeneral: config.General,
+             confVideo: config.Video, confAudio: config.Audio) -> int:
+    """
+    Joins files, in the given order, into outputFile (see concat.py).  Files
+    whose streams are compatible are joined with stream copy (about as fast
+    as copying them); otherwise they are encoded once with the av-convert
+    settings.
+
+    :returns: FFmpeg's return code
+    """
+    from . import concat, probing
+    if len(files) < 2:
+        raise ConvertError("--concat needs at least two input files")
+    #if
+    video = confVideo.codec != "null"
+    audio = confAudio.codec != "null"
+    try:
+        probes = [ probing.probe(file) for file in files ]
+    except czsystem.SystemCallError as e:
+        raise ConvertError(e)
+    #except
+    reason = concat.incompatibility(files, probes, video, audio)
+    listFile = None
+    if reason is None:
+        head, tail = os.path.split(outputFile)
+        listFile = os.path.join(head, ".%s.concat.txt" % tail)
+        cmd = concat.copyCommand(listFile, outputFile, confVideo, confAudio)
+        print("joining %d files with stream copy" % len(files), flush=True)
+    else:
+        try:
+            cmd = concat.encodeCommand(files, probes, outputFile, confVideo, confAudio,
+                                       _toFFmpegVideo(confVideo) + _toFFmpegAudio(confAudio))
+        except concat.ConcatError as e:
+            raise ConvertError("%s: %s" % (reason, e))
+        #except
+        print("%s; joining %d files with one re-encode" % (reason, len(files)), flush=True)
+    #else
+
+    if confGeneral.dry:
+        if listFile is not None:
+            for file in files:
+                print("#", concat.listEntry(file), end="")
+            #for
+        #if
+        print(" ".join(cmd))
+        return 0
+    #if
+    _checkExistence(outputFile)
+    _logger.info(" ".join(cmd))
+    try:
+        if listFile is not None:
+            with open(listFile, "w") as buf:
+                buf.writelines(concat.listEntry(file) for file in files)
+            #with
+        #if
+        result, attempts = _run(cmd, outputFile, [ outputFile ], confGeneral, print,
+                                confGeneral.retries)
+        return result.returnCode
+    finally:
+        if listFile is not None and os.path.exists(listFile):
+            os.remove(listFile)
+        #if
+    #finally
+#avConcat
+
+
+def _showGrids(files: list,
+               confCropping: config.Cropping,
+               confScaling: config.Scaling,
+               confCutting: config.Cutting,
+               frames: int) -> int:
+    """
+    Shows a contact sheet of every file (see preview.grid) with the image
+    viewer in $AV_PLAY_VIEWER (default: feh).
+    """
+    from . import preview
+    viewer = os.environ.get('AV_PLAY_VIEWER', 'feh').split(sep=' ')
+    start, end = 0.0, None
+    if confCutting.valid:
+        start = confCutting.start or 0.0
+        end = confCutting.end
+    #if
+    S = czsystem.SystemCaller(False)
     ans = 0
     for file in files:
-        cmd = ([ 'ffplay', '-hide_banner', file ] + _toFFmpegCropping(confCropping) +
-               _toFFmpegScaling(file, confScaling) + _toFFmpegCuttting(confCutting))
-        print(" ".join(cmd))
+        # the option lists are [ '-vf', FILTER ] or empty
+        filters = _toFFmpegCropping(confCropping)[1:] + _toFFmpegScaling(file, confScaling)[1:]
         try:
-            returnCode = S.call(cmd)
-            ans |= returnCode
-            _logger.info("return code:", returnCode)
-            _logger.info("stdout:", S.stdout())
-            _logger.info("stderr:", S.stderr())
-            print(S.stderr())
+            sheet = preview.grid(file, frames, filters, start, end)
+        except preview.PreviewError as e:
+            _stderr(e)
+            ans = 1
+            continue
+        #except
+        print(" ".join(viewer + [ sheet ]))
+        try:
+            S.call(viewer + [ sheet ])
         except czsystem.SystemCallError as e:
             raise ConvertError(e)
         #except
     #for
     return ans
+#_showGrids
+
+
+def avPlay(files: list,
+           confCropping: config.Cropping,
+           confScaling: config.Scaling,
+           confCutting: config.Cutting,
+           confPlay=None,
+           confProxy=None):
+    """
+    Plays files with ffplay.  If confProxy allows it, a file is played from
+    its proxy (see proxy.py) if there is one, with the crop values (given in
+    pixels of the file) scaled to the proxy; -s scales to the size av-convert
+    would produce from the file.
+    """
+    if confPlay is not None and confPlay.grid is not None:
+        return _showGrids(files, confCropping, confScaling, confCutting, confPlay.grid)
+    #if
+    maker = None
+    if confProxy is not None and confProxy.use:
+        from . import proxy
+        if confProxy.make:
+            maker = proxy.Maker(files, confProxy.limit, confProxy.jobs)
+        #if
+    #if
+    S = czsystem.SystemCaller(True)
+    ans = 0
+    try:
+        for file in files:
+            source = file
+            cropping = confCropping
+            found = proxy.proxyFor(file) if confProxy is not None and confProxy.use else None
+            if found is not None:
+                source, factor = found
+                cropping = proxy.scaleCropping(confCropping, factor)
+                print("playing the proxy of %s (%d%% size)" % (file, round(factor * 100)))
+            #if
+            cmd = ([ 'ffplay', '-hide_banner', source ] + _toFFmpegCropping(cropping) +
+                   _toFFmpegScaling(file, confScaling) + _toFFmpegCuttting(confCutting))
+            print(" ".join(cmd))
+            try:
+                returnCode = S.call(cmd)
+                ans |= returnCode
+                _logger.info("return code:", returnCode)
+                _logger.info("stdout:", S.stdout())
+                _logger.info("stderr:", S.stderr())
+                print(S.stderr())
+            except czsystem.SystemCallError as e:
+                raise ConvertError(e)
+            #except
+        #for
+    finally:
+        if maker is not None:
+            maker.close()
+        #if
+    #finally
+    return ans
 #avPlay
 
 
@@ -0,0 +1,307 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""near-duplicate detection with perceptual hashes of a few frames per file
+
+Needs NumPy (optional dependency: pip install czavsuite[dupes]).
+"""
+
+from . import cache, probing, profiling
+from czutils.utils import czlogging
+import os
+import subprocess
+
+
+_logger = czlogging.LoggingChannel("czavsuite.dupes",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.dupes", level, colour=colour)
+#setLoggingOptions
+
+
+class DupesError(Exception):
+    pass
+#DupesError
+
+
+FRAMES = 4 # frames hashed per file
+THRESHOLD = 10 # default maximum number of differing hash bits per frame
+
+_SIZE = 32 # frames are scaled down to _SIZE x _SIZE greyscale
+_LOW = 8 # the hash is made of the _LOW x _LOW lowest frequencies
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        raise DupesError("near-duplicate detection needs NumPy "
+                         "(pip install numpy, or install czavsuite[dupes])")
+    #except
+#_numpy
+
+
+def _cacheFile() -> str:
+    return os.path.join(cache.cacheDir(), "phash.json")
+#_cacheFile
+
+
+def _frames(file: str, frames: int):
+    """
+    Returns frames greyscale frames of file, evenly spread over its
+    duration, as an array of shape (frames, _SIZE, _SIZE), or None if file
+    has no duration or no video.
+    """
+    np = _numpy()
+    duration = probing.durationSeconds(file)
+    if duration is None or duration <= 0:
+        return None
+    #if
+    cmd = [ "ffmpeg", "-hide_banner", "-nostdin", "-v", "error" ]
+    for i in range(frames):
+        cmd += [ "-ss", "%.3f" % ((i + 0.5) * duration / frames), "-i", file ]
+    #for
+    graph = ";".join("[%d:v]trim=end_frame=1,setpts=PTS-STARTPTS,scale=%d:%d,format=gray,"
+                     "setsar=1[f%d]" % (i, _SIZE, _SIZE, i) for i in range(frames))
+    graph += ";%sconcat=n=%d:v=1:a=0" % ("".join("[f%d]" % i for i in range(frames)), frames)
+    cmd += [ "-filter_complex", graph, "-f", "rawvideo", "-pix_fmt", "gray", "-" ]
+    _logger.info(" ".join(cmd))
+    proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, check=False)
+    if proc.returncode != 0 or len(proc.stdout) != frames * _SIZE * _SIZE:
+        _logger.warning(file, proc.stderr.decode(errors="replace").strip())
+        return None
+    #if
+    return np.frombuffer(proc.stdout, dtype=np.uint8).reshape(frames, _SIZE, _SIZE)
+#_frames
+
+
+_dctMatrix = None
+
+
+def _dct():
+    """
+    Returns the orthonormal DCT-II matrix of size _SIZE.
+    """
+    global _dctMatrix
+    if _dctMatrix is None:
+        np = _numpy()
+        k = np.arange(_SIZE).reshape(-1, 1)
+        n = np.arange(_SIZE).reshape(1, -1)
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * _SIZE)) * np.sqrt(2 / _SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dctMatrix = matrix
+    #if
+    return _dctMatrix
+#_dct
+
+
+def phash(frames) -> int:
+    """
+    Returns the perceptual hash of an array of frames of shape
+    (n, _SIZE, _SIZE): for every frame, the 64 lowest DCT frequencies
+    compared with their median, concatenated into one n * 64 bit integer.
+    All frames are transformed at once.
+    """
+    np = _numpy()
+    D = _dct()
+    coefficients = (D @ frames.astype(np.float64) @ D.T)[:, :_LOW, :_LOW]
+    coefficients = coefficients.reshape(len(frames), -1)
+    medians = np.median(coefficients[:, 1:], axis=1, keepdims=True) # without the DC term
+    bits = (coefficients > medians).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+#phash
+
+
+def hashFile(file: str, frames=FRAMES):
+    """
+    Returns the perceptual hash of file (see phash()), from the cache if
+    possible, or None if file has no video.
+    """
+    hashes = cache.jsonCache(_cacheFile())
+    key = "%s %d" % (cache.fileKey(file), frames)
+    if key in hashes:
+        cached = hashes.get(key)
+        return None if cached is None else int(cached, 16)
+    #if
+    with profiling.span("phash", "file", file=file):
+        data = _frames(file, frames)
+        ans = None if data is None else phash(data)
+    #with
+    hashes.put(key, None if ans is None else "%x" % ans)
+    return ans
+#hashFile
+
+
+def distance(a: int, b: int) -> int:
+    """
+    Hamming distance of two hashes.
+    """
+    return (a ^ b).bit_count()
+#distance
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes with the Hamming distance, which finds
+    all hashes within a radius without comparing against every hash.
+    """
+    def __init__(self):
+        self._root = None # [ hash, items, { distance: child } ]
+    #__init__
+
+
+    def add(self, h: int, item) -> None:
+        if self._root is None:
+            self._root = [ h, [ item ], {} ]
+            return
+        #if
+        node = self._root
+        while True:
+            d = distance(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            #if
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [ h, [ item ], {} ]
+                return
+            #if
+            node = child
+        #while
+    #add
+
+
+    def search(self, h: int, radius: int) -> list:
+        """
+        Returns the items of all hashes within radius of h.
+        """
+        ans = []
+        stack = [ self._root ] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = distance(h, node[0])
+            if d <= radius:
+                ans += node[1]
+            #if
+            for childDistance, child in node[2].items():
+                if d - radius <= childDistance <= d + radius:
+                    stack.append(child)
+                #if
+            #for
+        #while
+        return ans
+    #search
+
+#BKTree
+
+
+def clusters(files: list, threshold=THRESHOLD, frames=FRAMES, jobs=None) -> list:
+    """
+    Returns the clusters of near-duplicate files: lists of at least two
+    files, in the order of files, such that every file of a cluster is within
+    threshold differing bits per frame of another file of the same cluster.
+    Files without video are ignored.
+
+    :param jobs:  number of files hashed in parallel (default: number of CPUs)
+    """
+    _numpy() # fail early
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+        hashes = list(pool.map(lambda file: hashFile(file, frames), files))
+    #with
+    cache.jsonCache(_cacheFile()).flush()
+
+    parent = list(range(len(files)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        #while
+        return i
+    #find
+
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        if h is None:
+            continue
+        #if
+        for j in tree.search(h, threshold * frames):
+            parent[find(i)] = find(j)
+        #for
+        tree.add(h, i)
+    #for
+
+    groups = {}
+    for i, h in enumerate(hashes):
+        if h is not None:
+            groups.setdefault(find(i), []).append(i)
+        #if
+    #for
+    # groups are in the order of their first file
+    return [ [ files[i] for i in group ] for group in groups.values() if len(group) > 1 ]
+#clusters
+
+
+def clusterOf(files: list, threshold=THRESHOLD) -> dict:
+    """
+    Returns { file: its cluster } (see clusters()) for every file that has
+    near duplicates among files.  Says what it is doing, since hashing takes
+    a while.
+
+    :raises DupesError: if NumPy is missing
+    """
+    print("looking for near duplicates", flush=True)
+    return { file: cluster for cluster in clusters(files, threshold) for file in cluster }
+#clusterOf
+
+
+def avDupes(files: list, threshold=THRESHOLD) -> None:
+    """
+    Prints the clusters of near-duplicate files, one file per line, with an
+    empty line between clusters.
+    """
+    found = clusters(files, threshold)
+    for i, cluster in enumerate(found):
+        if i > 0:
+            print()
+        #if
+        print("\n".join(cluster))
+    #for
+#avDupes
+
+
+### aczutro ###################################################################
@@ -0,0 +1,206 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""detection of byte-for-byte identical input files"""
+
+from czutils.utils import czlogging
+import hashlib
+import os
+
+
+_logger = czlogging.LoggingChannel("czavsuite.identical",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.identical", level, colour=colour)
+#setLoggingOptions
+
+
+_CHUNK = 64 << 10 # bytes hashed at the head and at the tail of a file
+_BLOCK = 1 << 20 # read size for full hashes
+_JOBS = 8 # files read in parallel
+
+
+def _partialHash(file: str, size: int) -> bytes:
+    """
+    Hashes the first and the last _CHUNK bytes of file.  For files of up to
+    2 * _CHUNK bytes, this is the hash of the whole file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(file, "rb") as buf:
+        h.update(buf.read(_CHUNK))
+        if size > _CHUNK:
+            buf.seek(max(_CHUNK, size - _CHUNK))
+            h.update(buf.read(_CHUNK))
+        #if
+    #with
+    return h.digest()
+#_partialHash
+
+
+def _fullHash(file: str) -> bytes:
+    h = hashlib.blake2b(digest_size=32)
+    with open(file, "rb") as buf:
+        while True:
+            block = buf.read(_BLOCK)
+            if not block:
+                break
+            #if
+            h.update(block)
+        #while
+    #with
+    return h.digest()
+#_fullHash
+
+
+def _refine(groups: list, key, pool) -> list:
+    """
+    Splits every group of files by key(file), computed in parallel, and
+    returns the parts that still have more than one file.  Files that cannot
+    be read (e.g. deleted since they were listed) are left out.
+    """
+    def chunkKeys(chunk: list) -> list:
+        ans = []
+        for file in chunk:
+            try:
+                ans.append(key(file))
+            except OSError as e:
+                _logger.warning(e)
+                ans.append(None)
+            #except
+        #for
+        return ans
+    #chunkKeys
+
+    files = [ file for group in groups for file in group ]
+    # one task per thread rather than per file: most reads are short
+    chunks = [ files[i::_JOBS] for i in range(_JOBS) ]
+    keys = {}
+    for chunk, results in zip(chunks, pool.map(chunkKeys, chunks)):
+        keys.update(zip(chunk, results))
+    #for
+    ans = []
+    for group in groups:
+        parts = {}
+        for file in group:
+            if keys[file] is not None:
+                parts.setdefault(keys[file], []).append(file)
+            #if
+        #for
+        ans += [ part for part in parts.values() if len(part) > 1 ]
+    #for
+    return ans
+#_refine
+
+
+def duplicates(files: list) -> list:
+    """
+    Returns the groups of identical files among files (lists of at least two
+    files, in the order of files).  Only files of equal size are compared, by
+    a hash of their head and tail first, and by a hash of their whole
+    contents only if that is not enough.  Names of the same file (repeated,
+    or hard links) are identical without reading anything.
+    """
+    bySize = {}
+    for file in files:
+        try:
+            st = os.stat(file)
+        except OSError as e:
+            _logger.warning(e)
+            continue
+        #except
+        bySize.setdefault(st.st_size, []).append((file, (st.st_dev, st.st_ino)))
+    #for
+
+    groups = []
+    candidates = []
+    for size, entries in bySize.items():
+        if len(entries) < 2:
+            continue
+        #if
+        byInode = {}
+        for file, inode in entries:
+            byInode.setdefault(inode, []).append(file)
+        #for
+        # one representative per inode has to be compared with the others
+        representatives = [ names[0] for names in byInode.values() ]
+        if len(representatives) > 1:
+            candidates.append((size, representatives))
+        #if
+        groups += [ names for names in byInode.values() if len(names) > 1 ]
+    #for
+    _logger.info("%d files in %d size buckets to compare" %
+                 (sum(len(files) for size, files in candidates), len(candidates)))
+
+    if candidates:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(_JOBS) as pool:
+            sizes = { file: size for size, group in candidates for file in group }
+            same = _refine([ group for size, group in candidates ],
+                           lambda file: _partialHash(file, sizes[file]), pool)
+            small = [ group for group in same if sizes[group[0]] <= 2 * _CHUNK ]
+            large = [ group for group in same if sizes[group[0]] > 2 * _CHUNK ]
+            same = small + _refine(large, _fullHash, pool)
+        #with
+        groups = _merge(groups, same)
+    #if
+
+    position = { file: i for i, file in reversed(list(enumerate(files))) }
+    groups = [ sorted(group, key=position.get) for group in groups ]
+    groups.sort(key=lambda group: position[group[0]])
+    return groups
+#duplicates
+
+
+def _merge(inodeGroups: list, contentGroups: list) -> list:
+    """
+    Merges groups of names of the same inode into the groups of inodes with
+    identical contents (which contain one name per inode).
+    """
+    names = { group[0]: group for group in inodeGroups }
+    merged = set()
+    ans = []
+    for group in contentGroups:
+        members = []
+        for file in group:
+            members += names.get(file, [ file ])
+            merged.add(file)
+        #for
+        ans.append(members)
+    #for
+    return ans + [ group for group in inodeGroups if group[0] not in merged ]
+#_merge
+
+
+### aczutro ###################################################################
@@ -0,0 +1,90 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""fingerprints for incremental conversion"""
+
+import hashlib
+import json
+import os
+
+
+def fingerprint(file: str, cmd: list) -> str:
+    """
+    Returns a fingerprint of a conversion job: the identity of the input file
+    (absolute path, size and modification time) plus the full FFmpeg command
+    line.  If any of these change, so does the fingerprint.
+    """
+    st = os.stat(file)
+    data = { "input": [ os.path.abspath(file), st.st_size, st.st_mtime_ns ],
+             "argv": cmd }
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+#fingerprint
+
+
+def sidecar(outputFile: str) -> str:
+    """
+    Returns the name of the file that stores the fingerprint of outputFile.
+    It is hidden, so that av-rename and av-classify ignore it.
+    """
+    head, tail = os.path.split(outputFile)
+    return os.path.join(head, ".%s.avfp" % tail)
+#sidecar
+
+
+def isUpToDate(outputFile: str, fp: str) -> bool:
+    """
+    Returns True if outputFile exists and was built by a job with fingerprint
+    fp.
+    """
+    if not os.path.exists(outputFile):
+        return False
+    #if
+    try:
+        with open(sidecar(outputFile), "r") as buf:
+            return buf.read().strip() == fp
+        #with
+    except OSError:
+        return False
+    #except
+#isUpToDate
+
+
+def record(outputFile: str, fp: str) -> None:
+    """
+    Stores the fingerprint of the job that has just built outputFile.
+    """
+    with open(sidecar(outputFile), "w") as buf:
+        buf.write(fp + "\n")
+    #with
+#record
+
+
+def forget(outputFile: str) -> None:
+    """
+    Removes the stored fingerprint of outputFile, if any.
+    """
+    try:
+        os.remove(sidecar(outputFile))
+    except FileNotFoundError:
+        pass
+    #except
+#forget
+
+
+### aczutro ###################################################################
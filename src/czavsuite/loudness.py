@@ -0,0 +1,176 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""two-pass loudness normalisation with cached measurements"""
+
+from . import cache, config, profiling
+from czutils.utils import czlogging, czsystem
+import json
+import os
+
+
+_logger = czlogging.LoggingChannel("czavsuite.loudness",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.loudness", level, colour=colour)
+#setLoggingOptions
+
+
+class LoudnessError(Exception):
+    pass
+#LoudnessError
+
+
+TRUE_PEAK = -1.5 # dBTP
+LOUDNESS_RANGE = 11.0 # LU
+
+# the input_* values of ffmpeg's loudnorm filter describe the input only, so
+# they can be reused for any target
+_MEASURED_KEYS = [ "input_i", "input_tp", "input_lra", "input_thresh" ]
+
+def _cacheFile() -> str:
+    return os.path.join(cache.cacheDir(), "loudnorm.json")
+#_cacheFile
+
+
+def _cutArgs(confCutting: config.Cutting) -> list:
+    # same semantics as convert._toFFmpegCuttting, so that the measured part
+    # of the input is the part that is converted
+    if not confCutting.valid:
+        return []
+    elif confCutting.end is None:
+        return [ "-ss", str(confCutting.start) ]
+    elif confCutting.start is None:
+        return [ "-t", str(confCutting.end) ]
+    else:
+        return [ "-ss", str(confCutting.start), "-t", str(confCutting.end - confCutting.start) ]
+    #else
+#_cutArgs
+
+
+def _key(file: str, confCutting: config.Cutting) -> str:
+    return "%s %s" % (cache.fileKey(file), " ".join(_cutArgs(confCutting)))
+#_key
+
+
+def _measure(file: str, confCutting: config.Cutting) -> dict:
+    """
+    Runs the measurement pass of the loudnorm filter.
+    """
+    S = czsystem.SystemCaller(True)
+    cmd = ([ "ffmpeg", "-hide_banner", "-nostats", "-i", file ] + _cutArgs(confCutting) +
+           [ "-vn", "-sn", "-dn",
+             "-af", "loudnorm=I=-24:TP=%s:LRA=%s:print_format=json" % (TRUE_PEAK, LOUDNESS_RANGE),
+             "-f", "null", "-" ])
+    _logger.info(" ".join(cmd))
+    try:
+        with profiling.span("loudness", "file", file=file):
+            returnCode = S.call(cmd)
+        #with
+    except czsystem.SystemCallError as e:
+        raise LoudnessError("%s: %s" % (file, e))
+    #except
+    stderr = S.stderr()
+    start = stderr.rfind("{")
+    end = stderr.rfind("}")
+    if returnCode != 0 or start < 0 or end < start:
+        raise LoudnessError("%s: loudness measurement failed (FFmpeg returned %d)" %
+                            (file, returnCode))
+    #if
+    try:
+        values = json.loads(stderr[start:end + 1])
+        return { key: values[key] for key in _MEASURED_KEYS }
+    except (ValueError, KeyError) as e:
+        raise LoudnessError("%s: cannot parse loudness measurement: %s" % (file, e))
+    #except
+#_measure
+
+
+def measurement(file: str, confCutting: config.Cutting) -> dict:
+    """
+    Returns the loudness measurement of file (or of the part selected by
+    confCutting), from the cache if possible.  The cache is keyed by the
+    identity of the file, so a modified file is measured again.
+    """
+    measurements = cache.jsonCache(_cacheFile())
+    key = _key(file, confCutting)
+    ans = measurements.get(key)
+    if ans is not None:
+        return ans
+    #if
+
+    ans = _measure(file, confCutting)
+    measurements.put(key, ans)
+    _logger.info("measured", file, ans)
+    return ans
+#measurement
+
+
+def measureAll(files: list, confCutting: config.Cutting, jobs: int) -> None:
+    """
+    Makes sure that measurements of all files are cached, running up to jobs
+    measurement passes in parallel.
+    """
+    measurements = cache.jsonCache(_cacheFile())
+    missing = [ file for file in files if _key(file, confCutting) not in measurements ]
+    if len(missing) == 0:
+        return
+    #if
+
+    print("measuring loudness of %d files" % len(missing), flush=True)
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        for future in [ pool.submit(measurement, file, confCutting) for file in missing ]:
+            future.result()
+        #for
+    #with
+    measurements.flush()
+#measureAll
+
+
+def normalisationFilter(target: float, measured: dict) -> str:
+    """
+    Returns the second-pass loudnorm filter that brings an input with the
+    given measurement to the target integrated loudness (LUFS).
+    """
+    return ("loudnorm=I=%s:TP=%s:LRA=%s:"
+            "measured_I=%s:measured_TP=%s:measured_LRA=%s:measured_thresh=%s:linear=true" %
+            (target, TRUE_PEAK, LOUDNESS_RANGE,
+             measured["input_i"], measured["input_tp"], measured["input_lra"],
+             measured["input_thresh"]))
+#normalisationFilter
+
+
+### aczutro ###################################################################
@@ -0,0 +1,245 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""Prometheus metrics of a conversion run, written in the text format read by
+node-exporter's textfile collector"""
+
+from czutils.utils import czlogging
+import os
+import re
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.metrics",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.metrics", level, colour=colour)
+#setLoggingOptions
+
+
+# upper bounds of the job time histogram, in seconds
+_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 7200)
+
+# progress lines are written at most this often (every state change is
+# written right away)
+_PROGRESS_INTERVAL = 5.0
+
+_FPS = re.compile(r"fps=\s*([0-9.]+)")
+_FRAME = re.compile(r"frame=\s*([0-9]+)")
+
+# JobSummary status -> job state
+_STATES = { "ok": "done", "failed": "failed" }
+
+
+class Metrics:
+    """Counts the jobs (input files) of a run by state, the bytes they read
+    and wrote, and the time and frame rate of the FFmpeg processes that
+    converted them.  Every update rewrites the metrics file atomically, so
+    the collector never reads a partial file.  Thread-safe.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._planned = 0
+        self._states = { "done": 0, "failed": 0, "skipped": 0 }
+        self._running = {} # label -> number of files
+        self._fps = {} # label -> current frame rate
+        self._frames = {} # label -> frames so far
+        self._framesTotal = 0
+        self._bytesRead = 0
+        self._bytesWritten = 0
+        self._buckets = [ 0 ] * len(_BUCKETS)
+        self._seconds = 0.0
+        self._count = 0
+        self._lastWrite = 0.0
+        self._failing = False # if true, the last write failed
+    #__init__
+
+
+    def plan(self, files: int) -> None:
+        """
+        Adds files to the queue.
+        """
+        with self._lock:
+            self._planned += files
+        #with
+        self.write()
+    #plan
+
+
+    def started(self, label: str, files: int) -> None:
+        """
+        Called when an FFmpeg job converting files files starts.
+        """
+        with self._lock:
+            self._running[label] = files
+        #with
+        self.write()
+    #started
+
+
+    def progress(self, label: str, line: str) -> None:
+        """
+        Called with every progress line of a running FFmpeg job.
+        """
+        fps = _FPS.search(line)
+        frame = _FRAME.search(line)
+        with self._lock:
+            if fps is not None:
+                self._fps[label] = float(fps.group(1))
+            #if
+            if frame is not None:
+                self._frames[label] = int(frame.group(1))
+            #if
+            due = time.monotonic() - self._lastWrite >= _PROGRESS_INTERVAL
+        #with
+        if due:
+            self.write()
+        #if
+    #progress
+
+
+    def stopped(self, label: str, seconds: float) -> None:
+        """
+        Called when an FFmpeg job has ended (after all its attempts).  The
+        outcome of its files follows with add(), which writes the file.
+        """
+        with self._lock:
+            self._running.pop(label, None)
+            self._fps.pop(label, None)
+            self._framesTotal += self._frames.pop(label, 0)
+            for i, bound in enumerate(_BUCKETS):
+                if seconds <= bound:
+                    self._buckets[i] += 1
+                #if
+            #for
+            self._seconds += seconds
+            self._count += 1
+        #with
+    #stopped
+
+
+    def add(self, job: dict) -> None:
+        """
+        Records the outcome of a job (see convert.JobSummary.add).
+        """
+        state = _STATES.get(job["status"], "skipped")
+        read = written = 0
+        if state == "done":
+            try:
+                read = os.path.getsize(job["input"])
+                written = os.path.getsize(job["output"])
+            except OSError:
+                read = written = 0
+            #except
+        #if
+        with self._lock:
+            self._states[state] += 1
+            self._bytesRead += read
+            self._bytesWritten += written
+        #with
+        self.write()
+    #add
+
+
+    def _text(self) -> str:
+        running = sum(self._running.values())
+        finished = sum(self._states.values())
+        lines = [ "# HELP czavsuite_jobs Conversion jobs (input files) by state.",
+                  "# TYPE czavsuite_jobs gauge",
+                  'czavsuite_jobs{state="queued"} %d' % max(0, self._planned - finished - running),
+                  'czavsuite_jobs{state="running"} %d' % running ]
+        lines += [ 'czavsuite_jobs{state="%s"} %d' % item for item in self._states.items() ]
+        lines += [ "# HELP czavsuite_encode_fps Frames per second of all running FFmpeg jobs.",
+                   "# TYPE czavsuite_encode_fps gauge",
+                   "czavsuite_encode_fps %g" % sum(self._fps.values()),
+                   "# HELP czavsuite_encoded_frames_total Frames encoded by finished FFmpeg jobs.",
+                   "# TYPE czavsuite_encoded_frames_total counter",
+                   "czavsuite_encoded_frames_total %d" % self._framesTotal,
+                   "# HELP czavsuite_read_bytes_total Size of the input files of done jobs.",
+                   "# TYPE czavsuite_read_bytes_total counter",
+                   "czavsuite_read_bytes_total %d" % self._bytesRead,
+                   "# HELP czavsuite_written_bytes_total Size of the output files of done jobs.",
+                   "# TYPE czavsuite_written_bytes_total counter",
+                   "czavsuite_written_bytes_total %d" % self._bytesWritten,
+                   "# HELP czavsuite_compression_ratio Bytes read per byte written by done jobs.",
+                   "# TYPE czavsuite_compression_ratio gauge",
+                   "czavsuite_compression_ratio %g" %
+                   (self._bytesRead / self._bytesWritten if self._bytesWritten else 0),
+                   "# HELP czavsuite_job_seconds Run time of FFmpeg jobs, retries included.",
+                   "# TYPE czavsuite_job_seconds histogram" ]
+        lines += [ 'czavsuite_job_seconds_bucket{le="%d"} %d' % item
+                   for item in zip(_BUCKETS, self._buckets) ]
+        lines += [ 'czavsuite_job_seconds_bucket{le="+Inf"} %d' % self._count,
+                   "czavsuite_job_seconds_sum %g" % self._seconds,
+                   "czavsuite_job_seconds_count %d" % self._count,
+                   "# HELP czavsuite_last_update_seconds Time of the last update of this file.",
+                   "# TYPE czavsuite_last_update_seconds gauge",
+                   "czavsuite_last_update_seconds %d" % time.time() ]
+        return "\n".join(lines) + "\n"
+    #_text
+
+
+    def write(self) -> None:
+        """
+        Writes the metrics file (to a temporary file in the same directory,
+        which is then renamed, as the textfile collector expects).  A failed
+        write (e.g. a full disk) is logged, not raised: it must not fail the
+        job that is being converted.
+        """
+        with self._lock:
+            self._lastWrite = time.monotonic()
+            text = self._text()
+            tmp = "%s.%d.tmp" % (self.path, os.getpid())
+            try:
+                with open(tmp, "w") as buf:
+                    buf.write(text)
+                #with
+                os.replace(tmp, self.path)
+                self._failing = False
+            except OSError as e:
+                if not self._failing:
+                    _logger.warning("cannot write metrics:", e)
+                #if
+                self._failing = True
+            #except
+        #with
+    #write
+
+#Metrics
+
+
+### aczutro ###################################################################
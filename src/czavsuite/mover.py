@@ -0,0 +1,257 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""background file moves with an undo journal"""
+
+from . import cache, profiling
+from czutils.utils import czlogging, czsystem
+import concurrent.futures
+import errno
+import json
+import os
+import shutil
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.mover",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.mover", level, colour=colour)
+#setLoggingOptions
+
+
+class MoveError(Exception):
+    pass
+#MoveError
+
+
+_COPY_CHUNK = 64 << 20
+
+
+def _copy(src: str, dst: str) -> None:
+    """
+    Copies the contents of src to dst with copy_file_range(), which lets the
+    kernel (or the file system) do the copy without passing the data through
+    user space.  Falls back to an ordinary copy where copy_file_range() is
+    not available.
+    """
+    with open(src, "rb") as inBuf, open(dst, "wb") as outBuf:
+        size = os.fstat(inBuf.fileno()).st_size
+        copied = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    n = os.copy_file_range(inBuf.fileno(), outBuf.fileno(),
+                                           min(_COPY_CHUNK, size - copied))
+                    if n == 0:
+                        break
+                    #if
+                    copied += n
+                #while
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise e
+                #if
+            #except
+        #if
+        if copied < size:
+            inBuf.seek(copied)
+            outBuf.seek(copied)
+            shutil.copyfileobj(inBuf, outBuf, _COPY_CHUNK)
+        #if
+        os.fsync(outBuf.fileno())
+    #with
+    shutil.copystat(src, dst)
+#_copy
+
+
+def move(src: str, dst: str) -> None:
+    """
+    Moves file src to the path dst, which must not exist.  On the same file
+    system this is a rename; across file systems, src is copied to a hidden
+    temporary file next to dst, which is renamed to dst once complete, and
+    then src is removed.
+
+    :raises MoveError: if dst exists or the move fails
+    """
+    if os.path.lexists(dst):
+        raise MoveError("%s already exists" % dst)
+    #if
+    with profiling.span("move", "file", file=src):
+        try:
+            os.rename(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise MoveError("cannot move %s to %s: %s" % (src, dst, e))
+            #if
+        #except
+
+        head, tail = os.path.split(dst)
+        tmp = os.path.join(head, ".%s.part" % tail)
+        try:
+            _copy(src, tmp)
+            os.rename(tmp, dst)
+            os.remove(src)
+        except OSError as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            #if
+            raise MoveError("cannot move %s to %s: %s" % (src, dst, e))
+        #except
+    #with
+#move
+
+
+def journalDir(kind: str) -> str:
+    """
+    :param kind:  "classify" or "rename"
+    """
+    return cache.cacheDir("journal", kind)
+#journalDir
+
+
+def newJournal(kind: str) -> str:
+    """
+    Returns the name for the journal of a new session.
+    """
+    return os.path.join(journalDir(kind), "%s-%d.jsonl" % (time.strftime("%Y%m%d-%H%M%S"),
+                                                           os.getpid()))
+#newJournal
+
+
+def lastJournal(kind: str):
+    """
+    Returns the most recent journal that has not been undone, or None.
+    """
+    journals = sorted(name for name in os.listdir(journalDir(kind)) if name.endswith(".jsonl"))
+    return os.path.join(journalDir(kind), journals[-1]) if journals else None
+#lastJournal
+
+
+class Mover:
+    """Moves files in the background.  Every completed move is appended to a
+    journal (one JSON object per line), so that undo() can reverse the
+    session.
+    """
+    def __init__(self, jobs=4):
+        self._pool = concurrent.futures.ThreadPoolExecutor(jobs)
+        self._futures = []
+        self._lock = threading.Lock()
+        self.journal = newJournal("classify")
+    #__init__
+
+
+    def _move(self, src: str, dst: str) -> None:
+        move(src, dst)
+        _logger.info(src, "->", dst)
+        with self._lock:
+            with open(self.journal, "a") as buf:
+                buf.write(json.dumps({ "src": src, "dst": dst, "time": time.time() }) + "\n")
+            #with
+        #with
+    #_move
+
+
+    def submit(self, file: str, targetDir: str) -> None:
+        """
+        Creates targetDir right away and moves file into it in the
+        background.
+        """
+        czsystem.mkdir(targetDir, p=True)
+        src = os.path.abspath(file)
+        dst = os.path.join(os.path.abspath(targetDir), os.path.basename(file))
+        self._futures = [ future for future in self._futures if not future.done()
+                          or future.exception() is not None ]
+        self._futures.append(self._pool.submit(self._move, src, dst))
+    #submit
+
+
+    def close(self) -> list:
+        """
+        Waits for all moves to finish.
+
+        :returns: list of error messages of failed moves
+        """
+        pending = sum(1 for future in self._futures if not future.done())
+        if pending:
+            print("waiting for %d moves to finish" % pending, flush=True)
+        #if
+        self._pool.shutdown(wait=True)
+        return [ str(future.exception()) for future in self._futures
+                 if future.exception() is not None ]
+    #close
+
+#Mover
+
+
+def undo(journal: str) -> int:
+    """
+    Moves the files listed in journal back where they came from, newest
+    first, and marks the journal as undone if all of them could be.  Moves
+    that were planned but never made, or that are already undone, are
+    skipped.
+
+    :returns: number of files that could not be moved back
+    """
+    with open(journal, "r") as buf:
+        moves = [ json.loads(line) for line in buf if line.strip() ]
+    #with
+    failures = 0
+    for entry in reversed(moves):
+        if os.path.lexists(entry["src"]) and not os.path.lexists(entry["dst"]):
+            continue
+        #if
+        try:
+            move(entry["dst"], entry["src"])
+            print("%s -> %s" % (entry["dst"], entry["src"]), flush=True)
+        except MoveError as e:
+            print("%s: error: %s" % (czsystem.appName(), e), flush=True)
+            failures += 1
+        #except
+    #for
+    if failures == 0:
+        os.rename(journal, "%s.undone" % journal)
+    else:
+        # moves already undone are skipped, so running undo again retries the rest
+        print("%s: %d moves could not be undone; %s is kept for another try" %
+              (czsystem.appName(), failures, journal), flush=True)
+    #else
+    return failures
+#undo
+
+
+### aczutro ###################################################################
@@ -0,0 +1,303 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""thumbnail strips (frame grids) of video files, with a cache"""
+
+from . import cache, probing, profiling
+from czutils.utils import czlogging, czsystem
+import concurrent.futures
+import hashlib
+import math
+import os
+
+
+_logger = czlogging.LoggingChannel("czavsuite.preview",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.preview", level, colour=colour)
+#setLoggingOptions
+
+
+class PreviewError(Exception):
+    pass
+#PreviewError
+
+
+TILE_WIDTH = 480
+TILE_HEIGHT = 270
+
+
+def gridSize(frames: int) -> tuple:
+    """
+    Returns (columns, rows) of a roughly square grid with room for frames.
+    """
+    columns = math.ceil(math.sqrt(frames))
+    return columns, math.ceil(frames / columns)
+#gridSize
+
+
+def stripFile(file: str, frames: int) -> str:
+    """
+    Returns the name of the cached strip of file.  The name depends on the
+    identity of file (see cache.fileKey), so a modified file gets a new strip.
+
+    :raises PreviewError: if file cannot be read (e.g. it has been deleted) or
+                          the cache directory cannot be created
+    """
+    try:
+        key = hashlib.sha1(("%s %s %d" % (os.path.abspath(file), cache.fileKey(file), frames))
+                           .encode()).hexdigest()
+        return os.path.join(cache.cacheDir("thumbs"), "%s.jpg" % key)
+    except OSError as e:
+        raise PreviewError("%s: %s" % (file, e))
+    #except
+#stripFile
+
+
+def _tileFilter(index: int) -> str:
+    return ("[%d:v]trim=end_frame=1,setpts=PTS-STARTPTS,"
+            "scale=%d:%d:force_original_aspect_ratio=decrease,"
+            "pad=%d:%d:(ow-iw)/2:(oh-ih)/2,setsar=1[t%d]" %
+            (index, TILE_WIDTH, TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT, index))
+#_tileFilter
+
+
+def stripCommand(file: str, frames: int, outputFile: str) -> list:
+    """
+    Returns the FFmpeg command that writes a grid of frames frames, evenly
+    spread over file, to the image outputFile.  Every frame is read with its
+    own input seek, so only a few packets around each position are decoded.
+    """
+    columns, rows = gridSize(frames)
+    duration = probing.durationSeconds(file)
+    cmd = [ "ffmpeg", "-hide_banner", "-nostdin", "-v", "error", "-y" ]
+    if duration is None or duration <= 0:
+        # no duration to spread the seeks over: take every 10th second
+        return cmd + [ "-i", file, "-vf",
+                       "fps=1/10,scale=%d:%d:force_original_aspect_ratio=decrease,"
+                       "pad=%d:%d:(ow-iw)/2:(oh-ih)/2,setsar=1,tile=%dx%d" %
+                       (TILE_WIDTH, TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT, columns, rows),
+                       "-frames:v", "1", outputFile ]
+    #if
+    for i in range(frames):
+        cmd += [ "-ss", "%.3f" % ((i + 0.5) * duration / frames), "-i", file ]
+    #for
+    graph = ";".join(_tileFilter(i) for i in range(frames))
+    graph += ";%sconcat=n=%d:v=1:a=0,tile=%dx%d" % ("".join("[t%d]" % i for i in range(frames)),
+                                                     frames, columns, rows)
+    return cmd + [ "-filter_complex", graph, "-frames:v", "1", outputFile ]
+#stripCommand
+
+
+def strip(file: str, frames: int) -> str:
+    """
+    Returns the name of an image with a grid of frames frames of file, which
+    is created unless it is already cached.
+
+    :raises PreviewError: if FFmpeg fails or the strip cannot be stored
+    """
+    outputFile = stripFile(file, frames)
+    if os.path.exists(outputFile):
+        return outputFile
+    #if
+    tmp = "%s.%d.tmp.jpg" % (outputFile[:-len(".jpg")], os.getpid())
+    cmd = stripCommand(file, frames, tmp)
+    _logger.info(" ".join(cmd))
+    S = czsystem.SystemCaller(True)
+    try:
+        with profiling.span("thumbnails", "file", file=file):
+            returnCode = S.call(cmd)
+        #with
+    except czsystem.SystemCallError as e:
+        raise PreviewError("%s: %s" % (file, e))
+    #except
+    if returnCode != 0 or not os.path.exists(tmp):
+        raise PreviewError("%s: cannot create thumbnails: %s" % (file, S.stderr().strip()))
+    #if
+    try:
+        os.replace(tmp, outputFile)
+    except OSError as e:
+        raise PreviewError("%s: %s" % (file, e))
+    #except
+    return outputFile
+#strip
+
+
+class Prefetcher:
+    """Creates the strips of the next files in the background while the user
+    looks at the current one.  The work is done by FFmpeg processes, so
+    threads are enough to run several at a time.
+    """
+    def __init__(self, files: list, frames: int, ahead: int, jobs=2):
+        self._files = files
+        self._frames = frames
+        self._ahead = ahead
+        self._pool = concurrent.futures.ThreadPoolExecutor(jobs)
+        self._futures = {} # index in files -> future
+    #__init__
+
+
+    def _submit(self, index: int) -> None:
+        if index < len(self._files) and index not in self._futures:
+            self._futures[index] = self._pool.submit(strip, self._files[index], self._frames)
+        #if
+    #_submit
+
+
+    def get(self, index: int) -> str:
+        """
+        Returns the strip of files[index] (waiting for it if necessary) and
+        starts the strips of the next ahead files.
+
+        :raises PreviewError: if the strip cannot be created
+        """
+        for i in range(index, index + self._ahead + 1):
+            self._submit(i)
+        #for
+        for i in [ i for i in self._futures if i < index ]:
+            self._futures.pop(i).cancel()
+        #for
+        return self._futures.pop(index).result()
+    #get
+
+
+    def close(self) -> None:
+        for future in self._futures.values():
+            future.cancel()
+        #for
+        self._pool.shutdown(wait=False)
+    #close
+
+#Prefetcher
+
+
+GRID_TILE_WIDTH = 640 # tiles of av-play --grid are larger, to judge crop values
+
+
+def _frame(file: str, seconds: float, filters: str, outputFile: str) -> bool:
+    """
+    Writes the frame of file at seconds, through filters, to the image
+    outputFile.  The seek is an input seek, so only the packets around
+    seconds are decoded.
+
+    :returns: False if there is no frame (e.g. seconds is past the end)
+    """
+    cmd = [ "ffmpeg", "-hide_banner", "-nostdin", "-v", "error", "-y",
+            "-ss", "%.3f" % seconds, "-i", file, "-vf", filters, "-frames:v", "1", outputFile ]
+    _logger.info(" ".join(cmd))
+    S = czsystem.SystemCaller(True)
+    try:
+        with profiling.span("frame", "file", file=file, seconds=seconds):
+            returnCode = S.call(cmd)
+        #with
+    except czsystem.SystemCallError as e:
+        raise PreviewError("%s: %s" % (file, e))
+    #except
+    return returnCode == 0 and os.path.exists(outputFile)
+#_frame
+
+
+def gridFile(file: str, frames: int, filters: str, start: float, end) -> str:
+    """
+    Returns the name of the contact sheet of file for the given settings in
+    the cache, so that trying the same values again costs nothing.
+    """
+    key = hashlib.sha1(("%s %s %d %s %s %s" % (os.path.abspath(file), cache.fileKey(file),
+                                                frames, filters, start, end)).encode())
+    return os.path.join(cache.cacheDir("grids"), "%s.jpg" % key.hexdigest())
+#gridFile
+
+
+def grid(file: str, frames: int, filters: list, start=0.0, end=None) -> str:
+    """
+    Returns the name of a contact sheet of frames frames, evenly spread over
+    file (or over start...end), after filters (e.g. the crop or scale filter
+    of av-play).  The frames are extracted by parallel FFmpeg processes with
+    one input seek each, and then tiled.
+
+    :param filters:       FFmpeg video filters, applied in order
+    :raises PreviewError: if no frame can be extracted
+    """
+    graph = ",".join(filters + [ "scale=%d:-2" % GRID_TILE_WIDTH, "setsar=1" ])
+    outputFile = gridFile(file, frames, graph, start, end)
+    if os.path.exists(outputFile):
+        return outputFile
+    #if
+    duration = probing.cachedDurationSeconds(file)
+    if end is None or duration is not None and end > duration:
+        end = duration
+    #if
+    if end is None or end <= start:
+        raise PreviewError("%s: unknown duration; cannot spread frames over it" % file)
+    #if
+    times = [ start + (i + 0.5) * (end - start) / frames for i in range(frames) ]
+
+    import tempfile
+    with tempfile.TemporaryDirectory(dir=cache.cacheDir("grids")) as tmpDir:
+        names = [ os.path.join(tmpDir, "f%04d.png" % i) for i in range(frames) ]
+        with concurrent.futures.ThreadPoolExecutor(min(frames, os.cpu_count() or 1)) as pool:
+            found = list(pool.map(lambda args: _frame(file, args[0], graph, args[1]),
+                                  zip(times, names)))
+        #with
+        names = [ name for name, ok in zip(names, found) if ok ]
+        if len(names) == 0:
+            raise PreviewError("%s: no frames could be extracted" % file)
+        #if
+        # number the frames without gaps for the image sequence demuxer
+        for i, name in enumerate(names):
+            os.rename(name, os.path.join(tmpDir, "g%04d.png" % i))
+        #for
+        columns, rows = gridSize(len(names))
+        tmp = os.path.join(tmpDir, "grid.jpg")
+        cmd = [ "ffmpeg", "-hide_banner", "-nostdin", "-v", "error", "-y",
+                "-i", os.path.join(tmpDir, "g%04d.png"),
+                "-vf", "tile=%dx%d" % (columns, rows), "-frames:v", "1", tmp ]
+        _logger.info(" ".join(cmd))
+        S = czsystem.SystemCaller(True)
+        try:
+            returnCode = S.call(cmd)
+        except czsystem.SystemCallError as e:
+            raise PreviewError("%s: %s" % (file, e))
+        #except
+        if returnCode != 0 or not os.path.exists(tmp):
+            raise PreviewError("%s: cannot create contact sheet: %s" % (file, S.stderr().strip()))
+        #if
+        os.replace(tmp, outputFile)
+    #with
+    return outputFile
+#grid
+
+
+### aczutro ###################################################################
@@ -19,9 +19,10 @@
 
 """av-probe implementation"""
 
-from . import config
+from . import cache, config, profiling, records
 from czutils.utils import cztext, czlogging, czsystem, czstrutils
 from builtins import ValueError
+import os
 
 
 _logger = czlogging.LoggingChannel("czavsuite.probing",
@@ -59,40 +60,201 @@ def _ffprobeDict(lines: list):
 #_ffprobeDict
 
 
-def ffprobe(file: str, mode: int):
+# probe windows (probesize in bytes, analyzeduration in microseconds), from
+# the smallest up; the middle one is FFmpeg's default
+PROBE_TIERS = [ (512 << 10, 500000), (5000000, 5000000), (100 << 20, 30000000) ]
+
+# stream properties that a probe must find before it counts as complete
+_REQUIRED = { config.Probing.VIDEO: [ "codec_name", "width", "height", "avg_frame_rate" ],
+              config.Probing.AUDIO: [ "codec_name", "sample_rate", "channel_layout" ] }
+
+
+def _tierFile() -> str:
+    return os.path.join(cache.cacheDir(), "probe-tiers.json")
+#_tierFile
+
+
+def _complete(probe: dict, mode: int) -> bool:
+    required = _REQUIRED[mode]
+    if probe.get("DISPOSITION:attached_pic") == "1":
+        # cover art is a single picture and has no frame rate
+        required = [ key for key in required if key != "avg_frame_rate" ]
+    #if
+    return all(probe.get(key) not in [ None, "", "N/A", "0/0", "unknown" ]
+               for key in required)
+#_complete
+
+
+def _probeAdaptive(S, file: str, kind: str, args: list, parse, complete, signature):
     """
+    Runs ffprobe with args on file with the smallest probe window whose
+    result, parse(stdout), is complete().  If not even the deepest window
+    completes it, the missing properties are not in the file, and the
+    smallest window with the same result (same signature()) is enough.  The
+    window a file needed is remembered per kind of probe, and later probes of
+    that kind use only that window.
     """
-    S = czsystem.SystemCaller(True)
-
-    if mode == config.Probing.FULL:
-        returnCode = S.call(['ffprobe', '-hide_banner', file])
-        _logger.info("return code:", returnCode)
-        _logger.info("stdout:", S.stdout())
-        _logger.info("stderr:", S.stderr())
-        return czstrutils.grep("Video|Audio",
-                               czstrutils.grep("Stream", S.stderr()),
-                               colour=True)
-    elif mode == config.Probing.VIDEO or mode == config.Probing.AUDIO:
+    tiers = cache.jsonCache(_tierFile())
+    try:
+        key = "%s %s" % (kind, cache.fileKey(file))
+        known = tiers.get(key)
+    except OSError:
+        key = known = None
+    #except
+
+    incomplete = [] # (tier, signature) of every incomplete result
+    for tier in range(0 if known is None else known, len(PROBE_TIERS)):
+        probeSize, analyzeDuration = PROBE_TIERS[tier]
         returnCode = S.call(['ffprobe', '-hide_banner',
-                             '-show_streams', '-select_streams',
-                             'v' if mode == config.Probing.VIDEO else 'a',
-                             file])
-        _logger.info("return code:", returnCode)
-        _logger.info("stdout:", S.stdout())
-        _logger.info("stderr:", S.stderr())
-        return _ffprobeDict(S.stdout().split(sep='\n'))
-    elif mode == config.Probing.DURATION:
-        returnCode = S.call(['ffprobe', '-hide_banner', file])
+                             '-probesize', str(probeSize),
+                             '-analyzeduration', str(analyzeDuration)]
+                            + args + [file])
         _logger.info("return code:", returnCode)
         _logger.info("stdout:", S.stdout())
         _logger.info("stderr:", S.stderr())
-        return czstrutils.grep("Duration", S.stderr())[0].split(sep=',')[0].split(sep=' ')[3]
+        ans = parse(S.stdout())
+        if known is not None or complete(ans):
+            break
+        #if
+        incomplete.append((tier, signature(ans)))
+        _logger.info("%s: incomplete probe with tier %d" % (file, tier))
     else:
-        raise ValueError
-    #else
+        final = signature(ans)
+        tier = min(t for t, s in incomplete if s == final)
+    #for
+
+    if key is not None and len(incomplete) > 0:
+        tiers.put(key, tier)
+    #if
+    return ans
+#_probeAdaptive
+
+
+def _ffprobeStreams(output: str) -> list:
+    """
+    Splits the output of 'ffprobe -show_streams' into one dict per stream.
+    """
+    return [ _ffprobeDict(section.split(sep='\n'))
+             for section in output.split(sep='[/STREAM]')[:-1] ]
+#_ffprobeStreams
+
+
+def _probeStream(S, file: str, mode: int) -> dict:
+    """
+    Probes the first video or audio stream of file until all _REQUIRED
+    properties are found.  All streams are probed, so that a file without a
+    stream of that type is recognised as such right away.
+    """
+    codecType = "video" if mode == config.Probing.VIDEO else "audio"
+
+    def first(streams: list):
+        return next((stream for stream in streams if stream.get("codec_type") == codecType),
+                    None)
+    #first
+
+    def complete(streams: list) -> bool:
+        stream = first(streams)
+        if stream is None:
+            # other streams, but none of this type: there is nothing to wait for
+            return len(streams) > 0
+        #if
+        return _complete(stream, mode)
+    #complete
+
+    def signature(streams: list) -> tuple:
+        stream = first(streams) or {}
+        return (len(streams),) + tuple(stream.get(key) for key in _REQUIRED[mode])
+    #signature
+
+    return first(_probeAdaptive(S, file, codecType, ['-show_streams'], _ffprobeStreams,
+                                complete, signature)) or {}
+#_probeStream
+
+
+def _recordSignature(record: records.ProbeRecord) -> tuple:
+    video = record.firstVideo()
+    audio = record.firstAudio()
+    return (video and (video.codec, video.width, video.height, video.fps),
+            audio and (audio.codec, audio.sampleRate, audio.channelLayout))
+#_recordSignature
+
+
+def probe(file: str) -> records.ProbeRecord:
+    """
+    Returns the duration and all video and audio streams of file, with their
+    values parsed, from a single ffprobe call (with an adaptive window, like
+    the VIDEO and AUDIO modes of ffprobe()).
+    """
+    S = czsystem.SystemCaller(True)
+    with profiling.span("ffprobe", "file", file=file, mode="record"):
+        return _probeAdaptive(S, file, "record", ['-show_streams', '-show_format'],
+                              records.parse,
+                              lambda record: len(record.video + record.audio) > 0
+                                             and record.complete(),
+                              _recordSignature)
+    #with
+#probe
+
+
+def ffprobe(file: str, mode: int):
+    """
+    """
+    S = czsystem.SystemCaller(True)
+
+    with profiling.span("ffprobe", "file", file=file, mode=mode):
+        if mode == config.Probing.FULL:
+            returnCode = S.call(['ffprobe', '-hide_banner', file])
+            _logger.info("return code:", returnCode)
+            _logger.info("stdout:", S.stdout())
+            _logger.info("stderr:", S.stderr())
+            return czstrutils.grep("Video|Audio",
+                                   czstrutils.grep("Stream", S.stderr()),
+                                   colour=True)
+        elif mode == config.Probing.VIDEO or mode == config.Probing.AUDIO:
+            return _probeStream(S, file, mode)
+        elif mode == config.Probing.DURATION:
+            returnCode = S.call(['ffprobe', '-hide_banner', file])
+            _logger.info("return code:", returnCode)
+            _logger.info("stdout:", S.stdout())
+            _logger.info("stderr:", S.stderr())
+            return czstrutils.grep("Duration", S.stderr())[0].split(sep=',')[0].split(sep=' ')[3]
+        else:
+            raise ValueError
+        #else
+    #with
 #ffprobe
 
 
+def durationSeconds(file: str):
+    """
+    Returns the duration of a media file in seconds, or None if ffprobe does
+    not report a duration (e.g. for images and some streams).
+    """
+    try:
+        hours, minutes, seconds = ffprobe(file, config.Probing.DURATION).split(sep=':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (ValueError, IndexError):
+        return None
+    #except
+#durationSeconds
+
+
+def cachedDurationSeconds(file: str):
+    """
+    Like durationSeconds(), but the result is cached per file identity (see
+    cache.fileKey), so a file is probed again only when it changes.
+    """
+    durations = cache.jsonCache(os.path.join(cache.cacheDir(), "durations.json"))
+    key = cache.fileKey(file)
+    if key in durations:
+        return durations.get(key)
+    #if
+    ans = durationSeconds(file)
+    durations.put(key, ans)
+    return ans
+#cachedDurationSeconds
+
+
 def _table2String(table):
     if len(table) == 0:
         raise ValueError
@@ -102,18 +264,18 @@ def _table2String(table):
         raise ValueError
     #if
 
-    maxWidth = [ 0 ] * len(table[0])
-    for row in table:
-        maxWidth = [ max(maxWidth[i], len(row[i])) for i in range(len(row)) ]
-    #for
-    ans = []
-    for row in table:
-        ans.append([ row[i].ljust(maxWidth[i]) for i in range(len(row)) ])
-    #for
-    return "\n".join([ "  ".join(row) for row in ans])
+    # one pass per column rather than a new list of widths per row
+    maxWidth = [ max(map(len, column)) for column in zip(*table) ]
+    return "\n".join([ "  ".join([ cell.ljust(width) for cell, width in zip(row, maxWidth) ])
+                       for row in table ])
 #_table2String
 
 
+def _na(value, toString=str) -> str:
+    return "N/A" if value is None else toString(value)
+#_na
+
+
 class TableMaker:
     """
     """
@@ -142,52 +304,36 @@ class TableMaker:
         #else
     #addHeader
 
-    def addVideo(self, file: str, probe: dict):
-        try:
-            try:
-                bitRate = "%d kb/s" % (float(probe["bit_rate"]) / 1000)
-            except ValueError:
-                bitRate = probe["bit_rate"]
-            #except
-            try:
-                framerateTokens = probe["avg_frame_rate"].split(sep='/')
-                num = float(framerateTokens[0])
-                den = float(framerateTokens[1])
-                framerate = str(round(num / den, 2))
-            except IndexError:
-                framerate = probe["avg_frame_rate"]
-            except ValueError:
-                framerate = probe["avg_frame_rate"]
-            except ZeroDivisionError:
-                framerate = probe["avg_frame_rate"]
-            #except
-            self._table.append([ probe["codec_name"],
-                                 "%sx%s" % (probe["width"], probe["height"]),
-                                 probe["display_aspect_ratio"],
-                                 framerate,
-                                 bitRate,
-                                 file ])
-        except KeyError:
+    def addVideo(self, file: str, stream):
+        """
+        :param stream: a records.VideoStream, or None if file has no video
+        """
+        if stream is None:
             self._table.append([ 'null', '--', '--', '--', '--', file ])
-        #except
+            return
+        #if
+        self._table.append([ _na(stream.codec),
+                             "%sx%s" % (_na(stream.width), _na(stream.height)),
+                             _na(stream.aspectRatio),
+                             _na(None if stream.fps is None else round(stream.fps, 2)),
+                             _na(stream.bitRate, lambda bitRate: "%d kb/s" % (bitRate / 1000)),
+                             file ])
     #addVideo
 
 
-    def addAudio(self, file: str, probe: dict):
-        try:
-            try:
-                bitRate = "%d kb/s" % (float(probe["bit_rate"]) / 1000)
-            except ValueError:
-                bitRate = probe["bit_rate"]
-            #except
-            self._table.append([ probe["codec_name"],
-                                 "%s Hz" % probe["sample_rate"],
-                                 probe["channel_layout"],
-                                 bitRate,
-                                 file ])
-        except KeyError:
+    def addAudio(self, file: str, stream):
+        """
+        :param stream: a records.AudioStream, or None if file has no audio
+        """
+        if stream is None:
             self._table.append([ 'null', '--', '--', '--', file ])
-        #except
+            return
+        #if
+        self._table.append([ _na(stream.codec),
+                             "%s Hz" % _na(stream.sampleRate),
+                             _na(stream.channelLayout),
+                             _na(stream.bitRate, lambda bitRate: "%d kb/s" % (bitRate / 1000)),
+                             file ])
     #addAudio
 
 
@@ -220,12 +366,18 @@ def avProbe(files: list, mode: int, headers: bool):
         if headers:
             tm.addHeader(mode)
         #if
+        # av-probe is run on whole archives: keep the results in columns
+        # rather than one record per file
+        columns = records.ProbeColumns()
         for file in files:
-            probe = ffprobe(file, mode)
+            columns.append(file, probe(file))
+        #for
+        for i, file in enumerate(columns.files):
+            record = columns.record(i)
             if mode == config.Probing.VIDEO:
-                tm.addVideo(file, probe)
+                tm.addVideo(file, record.firstVideo())
             elif mode == config.Probing.AUDIO:
-                tm.addAudio(file, probe)
+                tm.addAudio(file, record.firstAudio())
             else:
                 raise ValueError
             #else
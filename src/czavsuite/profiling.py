@@ -0,0 +1,173 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""timed spans written as a Chrome trace (viewable in Perfetto or
+chrome://tracing)
+
+Spans cost next to nothing unless profiling has been started with start().
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+_events = None # list of trace events while profiling, else None
+_threads = {} # thread id -> thread name
+_buf = None # the trace file, opened by start()
+_lock = threading.Lock()
+
+
+def now() -> int:
+    """
+    Returns the current time in microseconds, as used in trace events.
+    """
+    return time.perf_counter_ns() // 1000
+#now
+
+
+def start(path: str) -> None:
+    """
+    Starts recording spans; finish() writes them to path.  The file is
+    opened right away, so that a path that cannot be written is reported
+    before the work starts, not after it.
+
+    :raises OSError: if path cannot be opened for writing
+    """
+    global _events, _buf
+    _buf = open(path, "w")
+    _events = []
+#start
+
+
+def enabled() -> bool:
+    return _events is not None
+#enabled
+
+
+def record(name: str, begin: int, end: int, category="phase", **args) -> None:
+    """
+    Records a span that has already ended (times from now()).
+    """
+    if _events is None:
+        return
+    #if
+    thread = threading.current_thread()
+    event = { "name": name, "cat": category, "ph": "X", "ts": begin, "dur": end - begin,
+              "pid": os.getpid(), "tid": thread.ident }
+    if args:
+        event["args"] = args
+    #if
+    with _lock:
+        _events.append(event)
+        _threads[thread.ident] = thread.name
+    #with
+#record
+
+
+class _Span:
+    __slots__ = [ "name", "category", "args", "begin" ]
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.begin = None
+    #__init__
+
+
+    def __enter__(self):
+        self.begin = now()
+        return self
+    #__enter__
+
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is not None:
+            self.args["error"] = excType.__name__
+        #if
+        record(self.name, self.begin, now(), self.category, **self.args)
+        return False
+    #__exit__
+
+#_Span
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+    #__enter__
+
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+    #__exit__
+
+#_NullSpan
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, category="phase", **args):
+    """
+    Returns a context manager that records a span of the code it wraps, e.g.
+
+        with profiling.span("ffprobe", file=file):
+            ...
+
+    :param category:  e.g. "phase" or "file"; Perfetto can filter by it
+    :param args:      shown with the span
+    """
+    if _events is None:
+        return _NULL_SPAN
+    #if
+    return _Span(name, category, args)
+#span
+
+
+def finish() -> None:
+    """
+    Writes the recorded spans to the file given to start(), if any, and stops
+    recording.  A write error is reported, not raised: the work is done.
+    """
+    global _events, _buf
+    if _events is None:
+        return
+    #if
+    import json
+    with _lock:
+        events = _events
+        _events = None
+        metadata = [ { "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                       "args": { "name": name } } for tid, name in _threads.items() ]
+    #with
+    try:
+        with _buf:
+            json.dump({ "traceEvents": metadata + events, "displayTimeUnit": "ms" }, _buf)
+        #with
+    except OSError as e:
+        print("%s:" % os.path.basename(sys.argv[0]), "error:", "cannot write trace: %s" % e)
+    #except
+    _buf = None
+#finish
+
+
+### aczutro ###################################################################
@@ -0,0 +1,266 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""low-resolution proxies of large videos for av-play and av-classify, in a
+size-limited cache"""
+
+from . import cache, config, probing, profiling
+from czutils.utils import czlogging
+import concurrent.futures
+import hashlib
+import os
+import subprocess
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.proxy",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.proxy", level, colour=colour)
+#setLoggingOptions
+
+
+class ProxyError(Exception):
+    pass
+#ProxyError
+
+
+HEIGHT = 540 # proxies are this high; smaller videos get no proxy
+
+_indexLock = threading.Lock()
+
+_running = set() # FFmpeg processes creating proxies
+_runningLock = threading.Lock()
+
+
+def _indexFile() -> str:
+    return os.path.join(cache.cacheDir("proxies"), "index.json")
+#_indexFile
+
+
+def _key(file: str) -> str:
+    # the identity of the file, not its name: a moved file keeps its proxy
+    return hashlib.sha1(cache.fileKey(file).encode()).hexdigest()
+#_key
+
+
+def proxyFor(file: str):
+    """
+    Returns (proxy file, factor) if there is a proxy of file, else None.
+    factor is the proxy's height divided by the height of file.
+    """
+    try:
+        key = _key(file)
+    except OSError:
+        return None
+    #except
+    with _indexLock:
+        index = cache.loadJSON(_indexFile(), {})
+        entry = index.get(key)
+        if entry is None:
+            return None
+        #if
+        path = os.path.join(cache.cacheDir("proxies"), entry["file"])
+        if not os.path.exists(path):
+            return None
+        #if
+        entry["used"] = time.time() # for the eviction order
+        cache.saveJSON(_indexFile(), index)
+    #with
+    return path, entry["factor"]
+#proxyFor
+
+
+def make(file: str, limit: int, stop=None):
+    """
+    Creates the proxy of file unless it exists, and then evicts the least
+    recently used proxies until the cache is no larger than limit bytes.
+
+    :param stop:        a threading.Event; FFmpeg is terminated if it is set
+                        (see Maker.close)
+
+    :returns:           the proxy file, or None if file is not larger than a
+                        proxy (or has no video)
+    :raises ProxyError: if FFmpeg fails
+    """
+    existing = proxyFor(file)
+    if existing is not None:
+        return existing[0]
+    #if
+    stream = probing.probe(file).firstVideo()
+    if stream is None or stream.height is None:
+        return None
+    #if
+    height = stream.height
+    if height <= HEIGHT:
+        return None
+    #if
+
+    key = _key(file)
+    name = "%s.mp4" % key
+    outputFile = os.path.join(cache.cacheDir("proxies"), name)
+    tmp = "%s.%d.tmp.mp4" % (outputFile[:-len(".mp4")], os.getpid())
+    cmd = [ "ffmpeg", "-hide_banner", "-nostdin", "-v", "error", "-y", "-i", file,
+            "-vf", "scale=-2:%d" % HEIGHT,
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28",
+            "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart", tmp ]
+    _logger.info(" ".join(cmd))
+    try:
+        # not a SystemCaller: stop() must be able to terminate the process
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, errors="replace")
+    except OSError as e:
+        raise ProxyError("%s: %s" % (file, e))
+    #except
+    with _runningLock:
+        _running.add(proc)
+        if stop is not None and stop.is_set():
+            proc.terminate() # Maker.close() has already looked at _running
+        #if
+    #with
+    try:
+        with profiling.span("proxy", "file", file=file):
+            stdout, stderr = proc.communicate()
+        #with
+    finally:
+        with _runningLock:
+            _running.discard(proc)
+        #with
+    #finally
+    if proc.returncode != 0 or not os.path.exists(tmp):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        #if
+        raise ProxyError("%s: cannot create proxy: %s" % (file, stderr.strip()))
+    #if
+    os.replace(tmp, outputFile)
+    with _indexLock:
+        index = cache.loadJSON(_indexFile(), {})
+        index[key] = { "file": name, "factor": HEIGHT / height, "used": time.time(),
+                       "size": os.path.getsize(outputFile) }
+        _evict(index, limit)
+        cache.saveJSON(_indexFile(), index)
+    #with
+    return outputFile
+#make
+
+
+def _evict(index: dict, limit: int) -> None:
+    """
+    Removes the least recently used proxies from the cache (and from index)
+    until their total size is at most limit.  Called with _indexLock held.
+    """
+    total = sum(entry["size"] for entry in index.values())
+    for key, entry in sorted(index.items(), key=lambda item: item[1]["used"]):
+        if total <= limit:
+            break
+        #if
+        try:
+            os.remove(os.path.join(cache.cacheDir("proxies"), entry["file"]))
+        except FileNotFoundError:
+            pass
+        #except
+        total -= entry["size"]
+        del index[key]
+        _logger.info("evicted proxy", entry["file"])
+    #for
+#_evict
+
+
+def scaleCropping(conf: config.Cropping, factor: float) -> config.Cropping:
+    """
+    Returns conf (in pixels of the source) in pixels of a proxy that is
+    factor times its size.
+    """
+    ans = config.Cropping()
+    ans.valid = conf.valid
+    ans.left = round(conf.left * factor)
+    ans.right = round(conf.right * factor)
+    ans.up = round(conf.up * factor)
+    ans.down = round(conf.down * factor)
+    return ans
+#scaleCropping
+
+
+class Maker:
+    """Creates the missing proxies of files in the background, in the order
+    of files.  The work is done by FFmpeg processes, so threads are enough to
+    run several at a time.
+    """
+    def __init__(self, files: list, limit: int, jobs=2):
+        self._stop = threading.Event()
+        self._pool = concurrent.futures.ThreadPoolExecutor(jobs)
+        self._futures = [ self._pool.submit(self._make, file, limit) for file in files ]
+    #__init__
+
+
+    def _make(self, file: str, limit: int) -> None:
+        try:
+            make(file, limit, self._stop)
+        except (ProxyError, OSError) as e:
+            if not self._stop.is_set():
+                _logger.warning(e)
+            #if
+        #except
+    #_make
+
+
+    def close(self) -> None:
+        """
+        Cancels the proxies that have not been started and stops the ones
+        being created (their partial files are removed), so that the program
+        can exit right away.
+        """
+        self._stop.set()
+        for future in self._futures:
+            future.cancel()
+        #for
+        with _runningLock:
+            running = list(_running)
+        #with
+        if running:
+            print("stopping %d proxy encodes" % len(running), flush=True)
+        #if
+        for proc in running:
+            proc.terminate()
+        #for
+        self._pool.shutdown(wait=True)
+    #close
+
+#Maker
+
+
+### aczutro ###################################################################
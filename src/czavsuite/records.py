@@ -0,0 +1,343 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""typed probe results: one record per file with parsed values, and a column
+store for many files"""
+
+import array
+import math
+import sys
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+    #except
+#_int
+
+
+def _float(value):
+    try:
+        ans = float(value)
+        return None if math.isnan(ans) else ans
+    except (TypeError, ValueError):
+        return None
+    #except
+#_float
+
+
+def _rate(value):
+    """
+    Turns a frame rate such as '30000/1001' into a float, or None (for '0/0',
+    'N/A', ...).
+    """
+    try:
+        num, den = value.split(sep='/')
+        return float(num) / float(den)
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return _float(value)
+    #except
+#_rate
+
+
+def _str(value):
+    # codec names, layouts etc. repeat across files; interning stores each once
+    if value in [ None, "", "N/A", "unknown" ]:
+        return None
+    #if
+    return sys.intern(value)
+#_str
+
+
+class VideoStream:
+    """Parsed properties of a video stream; None where ffprobe reports none.
+    """
+    __slots__ = [ "codec", "width", "height", "aspectRatio", "fps", "bitRate", "picture",
+                  "profile", "pixelFormat", "sampleAspectRatio", "frameRate", "timeBase" ]
+
+    def __init__(self, codec, width, height, aspectRatio, fps, bitRate, picture=False,
+                 profile=None, pixelFormat=None, sampleAspectRatio=None, frameRate=None,
+                 timeBase=None):
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.aspectRatio = aspectRatio # e.g. '16:9'
+        self.fps = fps
+        self.bitRate = bitRate # bits per second
+        self.picture = picture # cover art (a single picture, without fps)
+        # as ffprobe prints them; streams can only be joined with stream copy
+        # (see concat.py) if these are equal
+        self.profile = profile
+        self.pixelFormat = pixelFormat # e.g. 'yuv420p'
+        self.sampleAspectRatio = sampleAspectRatio # e.g. '1:1'
+        self.frameRate = frameRate # e.g. '30000/1001' (r_frame_rate)
+        self.timeBase = timeBase # e.g. '1/30000'
+    #__init__
+
+
+    @classmethod
+    def fromProbe(cls, probe: dict):
+        """
+        :param probe:  the properties of one stream, as reported by
+                       'ffprobe -show_streams'
+        """
+        return cls(_str(probe.get("codec_name")), _int(probe.get("width")),
+                   _int(probe.get("height")), _str(probe.get("display_aspect_ratio")),
+                   _rate(probe.get("avg_frame_rate")), _int(probe.get("bit_rate")),
+                   probe.get("DISPOSITION:attached_pic") == "1",
+                   _str(probe.get("profile")), _str(probe.get("pix_fmt")),
+                   _str(probe.get("sample_aspect_ratio")), _str(probe.get("r_frame_rate")),
+                   _str(probe.get("time_base")))
+    #fromProbe
+
+
+    def complete(self) -> bool:
+        return None not in [ self.codec, self.width, self.height ] \
+            and (self.fps is not None or self.picture)
+    #complete
+
+#VideoStream
+
+
+class AudioStream:
+    """Parsed properties of an audio stream; None where ffprobe reports none.
+    """
+    __slots__ = [ "codec", "sampleRate", "channels", "channelLayout", "bitRate", "profile" ]
+
+    def __init__(self, codec, sampleRate, channels, channelLayout, bitRate, profile=None):
+        self.codec = codec
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.channelLayout = channelLayout # e.g. 'stereo'
+        self.bitRate = bitRate # bits per second
+        self.profile = profile # e.g. 'LC'
+    #__init__
+
+
+    @classmethod
+    def fromProbe(cls, probe: dict):
+        return cls(_str(probe.get("codec_name")), _int(probe.get("sample_rate")),
+                   _int(probe.get("channels")), _str(probe.get("channel_layout")),
+                   _int(probe.get("bit_rate")), _str(probe.get("profile")))
+    #fromProbe
+
+
+    def complete(self) -> bool:
+        return None not in [ self.codec, self.sampleRate, self.channelLayout ]
+    #complete
+
+#AudioStream
+
+
+class ProbeRecord:
+    """Duration and all video and audio streams of a file.
+    """
+    __slots__ = [ "duration", "video", "audio" ]
+
+    def __init__(self, duration, video: tuple, audio: tuple):
+        self.duration = duration # seconds, or None
+        self.video = video # VideoStreams, in the order of the file
+        self.audio = audio # AudioStreams, in the order of the file
+    #__init__
+
+
+    def firstVideo(self):
+        return self.video[0] if self.video else None
+    #firstVideo
+
+
+    def firstAudio(self):
+        return self.audio[0] if self.audio else None
+    #firstAudio
+
+
+    def complete(self) -> bool:
+        """
+        True if the first video and the first audio stream (the ones that
+        are used) are complete.
+        """
+        return all(stream.complete() for stream in [ self.firstVideo(), self.firstAudio() ]
+                   if stream is not None)
+    #complete
+
+#ProbeRecord
+
+
+def parse(output: str) -> ProbeRecord:
+    """
+    Parses the output of 'ffprobe -show_streams -show_format'.  Streams other
+    than video and audio (subtitles, data) are left out.
+    """
+    video = []
+    audio = []
+    duration = None
+    section = {}
+    for line in output.split(sep='\n'):
+        line = line.strip()
+        if line in [ "[/STREAM]", "[/FORMAT]" ]:
+            if line == "[/FORMAT]":
+                duration = _float(section.get("duration"))
+            elif section.get("codec_type") == "video":
+                video.append(VideoStream.fromProbe(section))
+            elif section.get("codec_type") == "audio":
+                audio.append(AudioStream.fromProbe(section))
+            #elif
+            section = {}
+        else:
+            tokens = line.split(sep='=')
+            if len(tokens) == 2:
+                section[tokens[0]] = tokens[1]
+            #if
+        #else
+    #for
+    return ProbeRecord(duration, tuple(video), tuple(audio))
+#parse
+
+
+class _Strings:
+    """A string table: every distinct string is stored once, and columns hold
+    its index (0 stands for None).
+    """
+    def __init__(self):
+        self.strings = [ None ]
+        self._index = { None: 0 }
+    #__init__
+
+
+    def index(self, value) -> int:
+        ans = self._index.get(value)
+        if ans is None:
+            ans = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        #if
+        return ans
+    #index
+
+#_Strings
+
+
+class ProbeColumns:
+    """Column store for the probe records of many files: every property of
+    the first video and the first audio stream is one array (typecode 'd' for
+    floats, 'q' for integers, 'I' for indexes into a shared string table), so
+    a file costs a few dozen bytes instead of a few objects.  Missing values
+    are NaN in float columns and -1 in integer columns; the flags column says
+    which streams there are.
+    """
+    _VIDEO, _AUDIO, _PICTURE = 1, 2, 4 # flags
+    _FLOATS = [ "duration", "fps" ]
+    _INTS = [ "flags", "width", "height", "videoBitRate", "sampleRate", "channels",
+              "audioBitRate" ]
+    _STRINGS = [ "videoCodec", "aspectRatio", "audioCodec", "channelLayout" ]
+
+    def __init__(self):
+        self.files = []
+        self._strings = _Strings()
+        self._columns = {}
+        for name in self._FLOATS:
+            self._columns[name] = array.array('d')
+        #for
+        for name in self._INTS:
+            self._columns[name] = array.array('q')
+        #for
+        for name in self._STRINGS:
+            self._columns[name] = array.array('I')
+        #for
+    #__init__
+
+
+    def __len__(self) -> int:
+        return len(self.files)
+    #__len__
+
+
+    def append(self, file: str, record: ProbeRecord) -> None:
+        v = record.firstVideo() or VideoStream(None, None, None, None, None, None)
+        a = record.firstAudio() or AudioStream(None, None, None, None, None)
+        flags = ((self._VIDEO if record.video else 0) | (self._AUDIO if record.audio else 0)
+                 | (self._PICTURE if v.picture else 0))
+        values = { "duration": record.duration, "fps": v.fps, "flags": flags,
+                   "width": v.width, "height": v.height, "videoBitRate": v.bitRate,
+                   "sampleRate": a.sampleRate, "channels": a.channels, "audioBitRate": a.bitRate,
+                   "videoCodec": v.codec, "aspectRatio": v.aspectRatio,
+                   "audioCodec": a.codec, "channelLayout": a.channelLayout }
+        self.files.append(file)
+        for name in self._FLOATS:
+            self._columns[name].append(math.nan if values[name] is None else values[name])
+        #for
+        for name in self._INTS:
+            self._columns[name].append(-1 if values[name] is None else values[name])
+        #for
+        for name in self._STRINGS:
+            self._columns[name].append(self._strings.index(values[name]))
+        #for
+    #append
+
+
+    def column(self, name: str) -> array.array:
+        """
+        Returns a column, e.g. column("width"); string columns hold indexes
+        (see string()).
+        """
+        return self._columns[name]
+    #column
+
+
+    def string(self, index: int):
+        return self._strings.strings[index]
+    #string
+
+
+    def record(self, i: int) -> ProbeRecord:
+        """
+        Returns the record of the i-th file (with its first streams only, and
+        without the properties that only concat.py compares).
+        """
+        def get(name):
+            value = self._columns[name][i]
+            if name in self._STRINGS:
+                return self._strings.strings[value]
+            elif name in self._FLOATS:
+                return None if math.isnan(value) else value
+            else:
+                return None if value < 0 else value
+            #else
+        #get
+
+        flags = get("flags")
+        video = ()
+        if flags & self._VIDEO:
+            video = (VideoStream(get("videoCodec"), get("width"), get("height"),
+                                 get("aspectRatio"), get("fps"), get("videoBitRate"),
+                                 bool(flags & self._PICTURE)),)
+        #if
+        audio = ()
+        if flags & self._AUDIO:
+            audio = (AudioStream(get("audioCodec"), get("sampleRate"), get("channels"),
+                                 get("channelLayout"), get("audioBitRate")),)
+        #if
+        return ProbeRecord(get("duration"), video, audio)
+    #record
+
+#ProbeColumns
+
+
+### aczutro ###################################################################
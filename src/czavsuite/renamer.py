@@ -0,0 +1,251 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""av-rename planning (one directory or a whole tree) and journalled renames"""
+
+from . import mover
+from czutils.utils import czlogging, czsystem
+import json
+import os
+
+
+_logger = czlogging.LoggingChannel("czavsuite.renamer",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.renamer", level, colour=colour)
+#setLoggingOptions
+
+
+class Pair:
+    """A 'before' file and its converted 'after' file, in directory.
+    """
+    def __init__(self, directory: str, before: str, after: str, promoted: str):
+        self.directory = directory
+        self.before = before # name of the original file
+        self.after = after # name of the converted file
+        self.promoted = promoted # name the converted file gets in the target directory
+    #__init__
+
+#Pair
+
+
+def paths(pair: Pair) -> tuple:
+    """
+    Returns the paths (original, converted) of a pair.
+    """
+    return (os.path.normpath(os.path.join(pair.directory, pair.before)),
+            os.path.normpath(os.path.join(pair.directory, pair.after)))
+#paths
+
+
+def _pairs(directory: str, names: set, extension: str) -> list:
+    """
+    Finds the pairs among the (non-hidden) file names of a directory, by
+    lookups in names only.
+    """
+    ans = []
+    for name in sorted(names):
+        head, tail = czsystem.filenameSplit(name)
+        if tail == extension:
+            new = "%s-new.%s" % (head, tail)
+            if new in names:
+                ans.append(Pair(directory, name, new, name))
+            #if
+        else:
+            new = ".".join([ head, extension ])
+            if new in names:
+                ans.append(Pair(directory, name, new, new))
+            #if
+        #else
+    #for
+    return ans
+#_pairs
+
+
+def _targetDir(root: str, directory: str, target: str) -> str:
+    # a relative target is relative to every directory; an absolute one
+    # mirrors the tree
+    if os.path.isabs(target):
+        return os.path.normpath(os.path.join(target, os.path.relpath(directory, root)))
+    else:
+        return os.path.join(directory, target)
+    #else
+#_targetDir
+
+
+def findPairs(root: str, target: str, extension: str, recursive: bool) -> list:
+    """
+    Returns (pair, target directory) for all pairs in root (and, if recursive,
+    in all its non-hidden subdirectories except target directories).  Every
+    directory is read once with os.scandir, which yields the entry types
+    without a stat call per file.
+    """
+    ans = []
+    stack = [ root ]
+    while stack:
+        directory = stack.pop()
+        targetDir = _targetDir(root, directory, target)
+        # absolute, since targetDir is absolute if target is and entry.path is
+        # relative if root is
+        skipDir = os.path.abspath(targetDir)
+        names = set()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name[0] == '.':
+                        continue
+                    elif entry.is_file():
+                        names.add(entry.name)
+                    elif recursive and entry.is_dir(follow_symlinks=False) \
+                            and os.path.abspath(entry.path) != skipDir:
+                        stack.append(entry.path)
+                    #elif
+                #for
+            #with
+        except OSError as e:
+            _logger.warning(e)
+            continue
+        #except
+        ans += [ (pair, targetDir) for pair in _pairs(directory, names, extension) ]
+    #while
+    return ans
+#findPairs
+
+
+def plan(pairs: list) -> tuple:
+    """
+    Returns the renames (src, dst) for pairs: the original file is hidden and
+    the converted file takes its place, both in the target directory.
+
+    A pair is left out if one of its files is already part of an earlier pair
+    (e.g. X.mkv, X.avi and X.mp4, or X.mkv, X.mp4 and X-new.mp4 in one
+    directory) or if a destination exists (e.g. a hidden original left by an
+    earlier run), so that one such directory does not make apply() roll back
+    everything.
+
+    :returns: (renames, [ (pair, reason it is left out) ])
+    """
+    renames = []
+    skipped = []
+    used = set()
+    for pair, targetDir in pairs:
+        original, converted = paths(pair)
+        pairRenames = [ (original,
+                         os.path.normpath(os.path.join(targetDir, ".%s" % pair.before))),
+                        (converted, os.path.normpath(os.path.join(targetDir, pair.promoted))) ]
+        reason = None
+        for src, dst in pairRenames:
+            if src in used:
+                reason = "%s is part of another pair" % src
+            elif dst in used:
+                reason = "%s is the destination of another pair" % dst
+            elif os.path.lexists(dst):
+                reason = "%s already exists" % dst
+            #elif
+            if reason is not None:
+                break
+            #if
+        #for
+        if reason is None:
+            renames += pairRenames
+            used.update(path for rename in pairRenames for path in rename)
+        else:
+            skipped.append((pair, reason))
+        #else
+    #for
+    return renames, skipped
+#plan
+
+
+def apply(renames: list) -> str:
+    """
+    Writes renames to a new journal (see mover.undo) and then makes them.  If
+    one fails, the ones already made are reversed.
+
+    :returns:          the journal
+    :raises MoveError: if a rename fails (after the rollback)
+    """
+    journal = mover.newJournal("rename")
+    with open(journal, "w") as buf:
+        for src, dst in renames:
+            buf.write(json.dumps({ "src": os.path.abspath(src), "dst": os.path.abspath(dst) })
+                      + "\n")
+        #for
+        buf.flush()
+        os.fsync(buf.fileno())
+    #with
+
+    done = []
+    directories = set()
+    try:
+        for src, dst in renames:
+            directory = os.path.dirname(dst)
+            if directory not in directories:
+                czsystem.mkdir(directory, p=True)
+                directories.add(directory)
+            #if
+            mover.move(src, dst)
+            print("%s -> %s" % (src, dst))
+            done.append((src, dst))
+        #for
+    except (mover.MoveError, OSError) as e:
+        print("%s: error: %s; rolling back" % (czsystem.appName(), e), flush=True)
+        left = []
+        for src, dst in reversed(done):
+            try:
+                mover.move(dst, src)
+                print("%s -> %s" % (dst, src))
+            except mover.MoveError as rollbackError:
+                print("%s: error: %s" % (czsystem.appName(), rollbackError), flush=True)
+                left.append((src, dst))
+            #except
+        #for
+        if len(left) == 0:
+            os.rename(journal, "%s.rolledback" % journal)
+        else:
+            # the journal still lists them, so 'av-rename --undo' can finish
+            print("%d renames could not be rolled back:" % len(left))
+            for src, dst in left:
+                print("    %s -> %s" % (src, dst))
+            #for
+            print("retry with 'av-rename --undo %s'" % journal, flush=True)
+        #else
+        raise mover.MoveError(e)
+    #except
+    return journal
+#apply
+
+
+### aczutro ###################################################################
@@ -0,0 +1,243 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""runs FFmpeg jobs with their output streamed to compressed log files"""
+
+from . import cache
+from czutils.utils import czlogging
+import collections
+import gzip
+import itertools
+import os
+import re
+import subprocess
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.runner",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.runner", level, colour=colour)
+#setLoggingOptions
+
+
+# number of output lines kept in memory per job, to show when a job fails
+TAIL_LINES = 20
+
+# FFmpeg separates its progress lines with \r, everything else with \n
+_LINE_SEPARATOR = re.compile(rb"[\r\n]")
+
+_counter = itertools.count()
+
+
+def logFileFor(outputFile: str, logDir=None) -> str:
+    """
+    Returns a new log file name for a job that writes outputFile.
+
+    :param logDir:  directory for log files (default: the 'logs' directory in
+                    the cache directory)
+    """
+    if logDir is None:
+        logDir = cache.cacheDir("logs")
+    else:
+        os.makedirs(logDir, exist_ok=True)
+    #else
+    return os.path.join(logDir, "%s.%s-%d-%d.log.gz" % (os.path.basename(outputFile),
+                                                       time.strftime("%Y%m%d-%H%M%S"),
+                                                       os.getpid(), next(_counter)))
+#logFileFor
+
+
+def _isProgress(line: str) -> bool:
+    return line.startswith("frame=") or line.startswith("size=")
+#_isProgress
+
+
+class JobResult:
+    """Outcome of a job run by run().
+    """
+    def __init__(self, returnCode: int, logFile: str, tail: list, seconds: float,
+                 stalled: bool):
+        self.returnCode = returnCode
+        self.logFile = logFile
+        self.tail = tail # last lines of output
+        self.seconds = seconds
+        self.stalled = stalled # True if the job was killed by the watchdog
+    #__init__
+
+#JobResult
+
+
+class _Watchdog(threading.Thread):
+    """Kills a process that has not shown any progress for a while.
+    """
+    def __init__(self, proc: subprocess.Popen, timeout: float):
+        super().__init__(daemon=True)
+        self._proc = proc
+        self._timeout = timeout
+        self._done = threading.Event()
+        self.lastProgress = time.monotonic()
+        self.stalled = False
+    #__init__
+
+
+    def touch(self) -> None:
+        self.lastProgress = time.monotonic()
+    #touch
+
+
+    def run(self) -> None:
+        while not self._done.wait(min(1.0, self._timeout)):
+            if time.monotonic() - self.lastProgress > self._timeout:
+                _logger.warning("no progress for %s s; killing process %d" %
+                                (self._timeout, self._proc.pid))
+                self.stalled = True
+                self._proc.kill()
+                return
+            #if
+        #while
+    #run
+
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+    #stop
+
+#_Watchdog
+
+
+def run(cmd: list, logFile: str, stallTimeout=None, onProgress=None) -> JobResult:
+    """
+    Runs cmd.  Its stdout and stderr are written to the gzip-compressed
+    logFile as they arrive; only the last TAIL_LINES lines (and the last
+    progress line) are kept in memory.
+
+    :param stallTimeout:  if not None, kill cmd when its output has not changed
+                          for this many seconds (a repeated progress line does
+                          not count as a change)
+    :param onProgress:    if not None, called with every new progress line
+    :raises OSError:      if cmd cannot be started or logFile cannot be written
+    """
+    tail = collections.deque(maxlen=TAIL_LINES)
+    lastProgress = None
+    start = time.monotonic()
+
+    with gzip.open(logFile, "wb") as log:
+        log.write(("%s\n\n" % " ".join(cmd)).encode())
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        watchdog = None
+        if stallTimeout is not None:
+            watchdog = _Watchdog(proc, stallTimeout)
+            watchdog.start()
+        #if
+        try:
+            pending = b""
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    break
+                #if
+                log.write(chunk)
+                pending += chunk
+                lines = _LINE_SEPARATOR.split(pending)
+                pending = lines.pop()
+                for line in lines:
+                    text = line.decode(errors="replace").strip()
+                    if len(text) == 0 or text == lastProgress:
+                        continue
+                    elif _isProgress(text):
+                        lastProgress = text
+                        if onProgress is not None:
+                            onProgress(text)
+                        #if
+                    else:
+                        tail.append(text)
+                    #else
+                    if watchdog is not None:
+                        watchdog.touch()
+                    #if
+                #for
+                if len(pending) > 65536:
+                    pending = pending[-65536:] # no separator for a long time; keep memory bounded
+                #if
+            #while
+            if pending.strip():
+                tail.append(pending.decode(errors="replace").strip())
+            #if
+            returnCode = proc.wait()
+        finally:
+            # if writing the log failed, FFmpeg must not be left running
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            #if
+            proc.stdout.close()
+            if watchdog is not None:
+                watchdog.stop()
+            #if
+        #finally
+        stalled = watchdog is not None and watchdog.stalled
+        if stalled:
+            log.write(("\nkilled after %s s without progress\n" % stallTimeout).encode())
+        #if
+        log.write(("\nreturn code: %d\n" % returnCode).encode())
+    #with
+
+    if lastProgress is not None:
+        tail.append(lastProgress)
+    #if
+    _logger.info("return code:", returnCode)
+    return JobResult(returnCode, logFile, list(tail), time.monotonic() - start, stalled)
+#run
+
+
+def readTail(logFile: str, lines=TAIL_LINES) -> list:
+    """
+    Returns the last lines of a log file written by run().
+    """
+    try:
+        with gzip.open(logFile, "rt", errors="replace") as buf:
+            return [ line.rstrip("\n") for line in collections.deque(buf, maxlen=lines) ]
+        #with
+    except OSError:
+        return []
+    #except
+#readTail
+
+
+### aczutro ###################################################################
@@ -19,10 +19,15 @@
 
 """av-script implementation"""
 
-from . import config
+from . import config, profiling
 from czutils.utils import czsystem
 import os
-import shutil
+import threading
+
+
+# av-script, av-classify and av-rename share this module, but need different
+# parts of the suite: those (clp, convert, mover, ...) are imported by the
+# functions that use them, so that no application pays for the others.
 
 
 def avScript(files: list, conf: config.Script):
@@ -30,8 +35,20 @@ def avScript(files: list, conf: config.Script):
     """
     redirection = " >> %s" % conf.betty if conf.dry else " "
     dry = " -dry" if conf.dry else ""
+    dry += " -incremental" if conf.incremental else ""
     tTemplate = "-t :" if conf.tTemplate else ""
     cTemplate = "-c :::" if conf.cTemplate else ""
+    duplicateOf = {}
+    if conf.dedupe:
+        from . import identical
+        # a file given twice gets one line, like in av-convert --dedupe
+        files = list(dict.fromkeys(files))
+        for group in identical.duplicates(files):
+            for file in group[1:]:
+                duplicateOf[file] = group[0]
+            #for
+        #for
+    #if
 
     with open(conf.wilma, "w") as buf:
         buf.write("# -*- mode: shell-script -*-\n\n")
@@ -39,6 +56,9 @@ def avScript(files: list, conf: config.Script):
             buf.write("rm -f %s\n\n" % conf.betty)
         #if
         for file in files:
+            if file in duplicateOf:
+                buf.write('# identical to "%s":\n# ' % duplicateOf[file])
+            #if
             buf.write('av-convert{_dry} {_t}\t{_c}\t"{_file}"{_redirection}\n'.format(
                 _dry=dry,
                 _file=file,
@@ -51,6 +71,245 @@ def avScript(files: list, conf: config.Script):
 #avScript
 
 
+class _ScriptLine:
+    """An av-convert line of a script.
+    """
+    def __init__(self, number: int, text: str, argv: list, redirection):
+        self.number = number
+        self.text = text
+        self.argv = argv
+        self.redirection = redirection # file that stdout is appended to, or None
+        self.CLP = None # set by _parseLine()
+        self.error = None # command line error, if any
+    #__init__
+
+#_ScriptLine
+
+
+def _readScript(path: str):
+    """
+    Splits a script into files to remove ('rm -f' lines) and av-convert lines.
+    Other lines are reported and skipped.
+
+    :returns: (files to remove, list of _ScriptLine)
+    """
+    import shlex
+    remove = []
+    lines = []
+    with open(path, "r") as buf:
+        for number, text in enumerate(buf, start=1):
+            try:
+                tokens = shlex.split(text, comments=True)
+            except ValueError as e:
+                print("line %d: %s; skipped" % (number, e))
+                continue
+            #except
+            if len(tokens) == 0:
+                continue
+            elif tokens[0] == "rm":
+                remove += [ token for token in tokens[1:] if not token.startswith('-') ]
+            elif tokens[0] == "av-convert":
+                redirection = None
+                if ">>" in tokens:
+                    index = tokens.index(">>")
+                    redirection = tokens[index + 1] if index + 1 < len(tokens) else None
+                    tokens = tokens[:index]
+                #if
+                lines.append(_ScriptLine(number, text.strip(), tokens[1:], redirection))
+            else:
+                print("line %d: not an av-convert command; skipped" % number)
+            #else
+        #for
+    #with
+    return remove, lines
+#_readScript
+
+
+def _parseLine(line: _ScriptLine) -> None:
+    from . import clp
+    try:
+        line.CLP = clp.CommandLineParser("av-convert", config.CONVERT_CONFIG_TYPES, True,
+                                         argv=line.argv)
+    except clp.CommandLineError as e:
+        line.error = e
+    #except
+#_parseLine
+
+
+def _admissionControl(lines: list):
+    """
+    Returns the admission control shared by all lines: it keeps free the
+    largest disk and memory reserves that any line asks for.  None if no line
+    asks for admission control.
+    """
+    confs = [ line.CLP.config[config.ConfigType.GENERAL] for line in lines
+              if line.CLP is not None ]
+    confs = [ conf for conf in confs if conf.admission and not conf.dry ]
+    if len(confs) == 0:
+        return None
+    #if
+    confGeneral = config.General()
+    confGeneral.diskReserve = max(conf.diskReserve for conf in confs)
+    confGeneral.memReserve = max(conf.memReserve for conf in confs)
+    from . import convert
+    return convert.admissionControl(confGeneral)
+#_admissionControl
+
+
+# options of av-convert that act on its whole list of files (or replace the
+# conversion altogether), which a script line, converted file by file, cannot
+# honour: (option, config type, attribute)
+_UNSUPPORTED = [ ("--enqueue", config.ConfigType.QUEUE, "enqueue"),
+                 ("--worker", config.ConfigType.QUEUE, "worker"),
+                 ("--watch", config.ConfigType.WATCH, "dir"),
+                 ("--concat", config.ConfigType.GENERAL, "concat"),
+                 ("--dedupe", config.ConfigType.GENERAL, "dedupe"),
+                 ("--link-dupes", config.ConfigType.GENERAL, "linkDupes"),
+                 ("--skip-dupes", config.ConfigType.GENERAL, "skipDupes"),
+                 ("--order", config.ConfigType.GENERAL, "order"),
+                 ("--batch", config.ConfigType.GENERAL, "batch"),
+                 ("-j", config.ConfigType.GENERAL, "jobs"),
+                 ("--summary", config.ConfigType.GENERAL, "summary"),
+                 ("--metrics", config.ConfigType.GENERAL, "metrics") ]
+
+
+def _unsupportedOptions(confs: dict) -> list:
+    """
+    Returns the _UNSUPPORTED options that confs (a parsed av-convert command
+    line) sets to other than their defaults.
+    """
+    defaults = { config.ConfigType.GENERAL: config.General(),
+                 config.ConfigType.QUEUE: config.Queue(),
+                 config.ConfigType.WATCH: config.Watch() }
+    return [ option for option, configType, attribute in _UNSUPPORTED
+             if getattr(confs[configType], attribute) != getattr(defaults[configType], attribute) ]
+#_unsupportedOptions
+
+
+def _runLine(line: _ScriptLine, logFile: str, redirectionLock: threading.Lock, control) -> int:
+    """
+    Runs one av-convert line of a script, writing everything it prints to
+    logFile (and stdout also to the line's redirection target, if any).
+
+    :returns: the line's exit status, like av-convert's
+    """
+    from . import convert
+    with open(logFile, "w") as logBuf:
+        def _log(*args):
+            text = " ".join(str(arg) for arg in args)
+            print(text, file=logBuf, flush=True)
+            if line.redirection is not None:
+                with redirectionLock:
+                    with open(line.redirection, "a") as redirectionBuf:
+                        print(text, file=redirectionBuf)
+                    #with
+                #with
+            #if
+        #_log
+
+        print(line.text, file=logBuf, flush=True)
+        if line.error is not None:
+            print("error:", line.error, file=logBuf)
+            return 2
+        #if
+        CLP = line.CLP
+
+        confs = CLP.config
+        unsupported = _unsupportedOptions(confs)
+        if unsupported:
+            print("error: %s cannot be run from a script" % ", ".join(unsupported), file=logBuf)
+            return 2
+        #if
+
+        ans = 0
+        try:
+            for file in CLP.args:
+                outputFile = convert.prepareOutput(file,
+                                                   confs[config.ConfigType.VIDEO],
+                                                   confs[config.ConfigType.AUDIO],
+                                                   interactive=False,
+                                                   incrementalMode=confs[config.ConfigType.GENERAL]
+                                                   .incremental)
+                ans |= convert.convertFile(file, outputFile,
+                                           confs[config.ConfigType.GENERAL],
+                                           confs[config.ConfigType.VIDEO],
+                                           confs[config.ConfigType.AUDIO],
+                                           confs[config.ConfigType.CROPPING],
+                                           confs[config.ConfigType.SCALING],
+                                           confs[config.ConfigType.CUTTING],
+                                           control if confs[config.ConfigType.GENERAL].admission
+                                           else None,
+                                           log=_log)
+            #for
+        except Exception as e: # whatever goes wrong, it only fails this line
+            print("error:", e, file=logBuf)
+            ans = ans or 1
+        #except
+        return ans
+    #with
+#_runLine
+
+
+def avRun(conf: config.Script) -> int:
+    """
+    Runs the av-convert lines of script conf.run inside this process, up to
+    conf.jobs lines at a time.  'rm' lines are executed before anything else;
+    all other lines are skipped.  Every av-convert line writes its own log to
+    the directory <script>.logs and gets its own exit status.  Existing output
+    files are never overwritten.  The lines that use admission control share
+    one, which keeps free the largest reserves any of them asks for.
+
+    :returns: 0 if all lines succeeded, 1 otherwise
+    """
+    import concurrent.futures
+    remove, lines = _readScript(conf.run)
+    for file in remove:
+        if os.path.isfile(file):
+            os.remove(file)
+        #if
+    #for
+
+    logDir = "%s.logs" % conf.run
+    czsystem.mkdir(logDir, p=True)
+    for line in lines:
+        _parseLine(line)
+    #for
+    control = _admissionControl(lines)
+    redirectionLock = threading.Lock()
+    failed = []
+
+    with concurrent.futures.ThreadPoolExecutor(conf.jobs) as pool:
+        futures = {}
+        for line in lines:
+            logFile = os.path.join(logDir, "line-%05d.log" % line.number)
+            futures[pool.submit(_runLine, line, logFile, redirectionLock, control)] = \
+                (line, logFile)
+        #for
+        for future in concurrent.futures.as_completed(futures):
+            line, logFile = futures[future]
+            try:
+                status = future.result()
+            except Exception as e: # e.g. the log file cannot be written
+                print("line %d: error: %s" % (line.number, e), flush=True)
+                status = 1
+            #except
+            if status == 0:
+                print("line %d: ok" % line.number, flush=True)
+            else:
+                failed.append(line.number)
+                print("line %d: exit status %d (see %s)" % (line.number, status, logFile),
+                      flush=True)
+            #else
+        #for
+    #with
+
+    print("%d lines run, %d failed%s" %
+          (len(lines), len(failed),
+           "" if len(failed) == 0 else ": %s" % " ".join(str(n) for n in sorted(failed))))
+    return 0 if len(failed) == 0 else 1
+#avRun
+
+
 def _sort(files: list, sorting: int, reverse: bool) -> list:
     if sorting == config.Classify.Sorting.NONE:
         if reverse:
@@ -69,15 +328,52 @@ def _sort(files: list, sorting: int, reverse: bool) -> list:
 #_sort
 
 
-def avClassify(files: list, conf: config.Classify):
+def _clusterOrder(files: list, threshold: int) -> tuple:
+    """
+    Reorders files such that the files of each cluster of near duplicates
+    (see dupes.clusters) follow each other, at the position of the cluster's
+    first file.
+
+    :returns: (reordered files, { file: label to show before the file name })
+    """
+    from . import dupes
+    try:
+        clusterOf = dupes.clusterOf(files, threshold)
+    except dupes.DupesError as e:
+        print("%s: error: %s; keeping the usual order" % (czsystem.appName(), e), flush=True)
+        return files, {}
+    #except
+    ordered = []
+    labels = {}
+    for file in files:
+        cluster = clusterOf.get(file)
+        if cluster is None:
+            ordered.append(file)
+        elif file == cluster[0]:
+            for i, member in enumerate(cluster):
+                ordered.append(member)
+                labels[member] = "[similar %d/%d] " % (i + 1, len(cluster))
+            #for
+        #elif
+    #for
+    return ordered, labels
+#_clusterOrder
+
+
+def avClassify(files: list, conf: config.Classify, confProxy=None):
     """
+    Plays (or shows) every file and moves it into the directory the user
+    types.  If confProxy allows it, videos are played from their proxies (see
+    proxy.py) where there are some.
     """
+    from . import mover
     S = czsystem.SystemCaller(False)
+    viewer = [ 'feh', '-g', '+1280+0' ]
+    if os.environ.get('AV_CLASS_VIEWER') is not None:
+        viewer = os.environ.get('AV_CLASS_VIEWER').split(sep=' ')
+    #if
     if conf.images:
-        cmd = [ 'feh', '-g', '+1280+0' ]
-        if os.environ.get('AV_CLASS_VIEWER') is not None:
-            cmd = os.environ.get('AV_CLASS_VIEWER').split(sep=' ')
-        #if
+        cmd = viewer
     else:
         cmd = [ 'mplayer', '-geometry', '+1280+0' ]
         if conf.mute:
@@ -88,56 +384,145 @@ def avClassify(files: list, conf: config.Classify):
         #if
     #else
 
-    for file in _sort(files, conf.sorting, conf.reverse):
-        print(f"{file}: ", end="", flush=True)
-        S.call(cmd + [file])
-        try:
-            target = ".%s" % input()
-        except EOFError:
-            print()
-            break
-        except KeyboardInterrupt:
-            print()
-            break
-        #except
-        if target == ".":
-            continue
+    files = _sort(files, conf.sorting, conf.reverse)
+    labels = {}
+    if conf.clusters:
+        files, labels = _clusterOrder(files, conf.threshold)
+    #if
+    # moves happen in the background, so the next file can be shown right away
+    M = mover.Mover()
+    prefetcher = None
+    if conf.thumbs:
+        from . import preview
+        prefetcher = preview.Prefetcher(files, conf.frames, conf.ahead)
+    #if
+    useProxies = confProxy is not None and confProxy.use and not conf.images
+    maker = None
+    if useProxies:
+        from . import proxy
+        if confProxy.make:
+            maker = proxy.Maker(files, confProxy.limit, confProxy.jobs)
         #if
+    #if
 
-        czsystem.mkdir(target, p=True)
-        shutil.move(file, target)
+    def play(file):
+        found = proxy.proxyFor(file) if useProxies else None
+        S.call(cmd + [ file if found is None else found[0] ])
+    #play
+
+    try:
+        for index, file in enumerate(files):
+            print(f"{labels.get(file, '')}{file}: ", end="", flush=True)
+            if prefetcher is None:
+                play(file)
+            else:
+                try:
+                    S.call(viewer + [ prefetcher.get(index) ])
+                except preview.PreviewError as e:
+                    print("(%s; playing instead) " % e, end="", flush=True)
+                    play(file)
+                #except
+            #else
+            try:
+                target = ".%s" % input()
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                break
+            #except
+            if target == ".":
+                continue
+            #if
+
+            M.submit(file, target)
+        #for
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        #if
+        if maker is not None:
+            maker.close()
+        #if
+        errors = M.close()
+    #finally
+    for error in errors:
+        print("%s: error: %s" % (czsystem.appName(), error))
     #for
+    if os.path.exists(M.journal):
+        print("journal: %s (undo with 'av-classify --undo')" % M.journal)
+    #if
+    return 1 if errors else 0
 #avClassify
 
 
-def avRename(conf: config.Rename):
+def avUndoClassify(conf: config.Classify) -> int:
     """
+    Reverses the moves of an av-classify session.
     """
-    def _mv(fro: str, to: str):
-        toFull = os.path.join(conf.target, to)
-        print("%s -> %s" % (fro, toFull))
-        os.rename(fro, toFull)
-    #_mv
+    from . import mover
+    journal = conf.undo if conf.undo else mover.lastJournal("classify")
+    if journal is None:
+        print("%s: error: no session to undo" % czsystem.appName())
+        return 1
+    #if
+    return 1 if mover.undo(journal) else 0
+#avUndoClassify
 
-    czsystem.mkdir(conf.target, p=True)
 
-    for file in [ _entry.name for _entry in os.scandir(os.curdir)
-                  if _entry.is_file() and not _entry.name[0] == '.']:
-        head, tail = czsystem.filenameSplit(file)
-        if tail == conf.extension:
-            new = "%s-new.%s" % (head, tail)
-            if os.path.exists(new):
-                _mv(file, ".%s" % file)
-                _mv(new, file)
-            #if
-        else:
-            new = ".".join([ head, conf.extension ])
-            if os.path.exists(new):
-                _mv(file, ".%s" % file)
-                _mv(new, new)
-            #if
-        #else
+def avRename(conf: config.Rename) -> int:
+    """
+    """
+    from . import mover, renamer
+    if conf.undo is not None:
+        journal = conf.undo if conf.undo else mover.lastJournal("rename")
+        if journal is None:
+            print("%s: error: no renames to undo" % czsystem.appName())
+            return 1
+        #if
+        return 1 if mover.undo(journal) else 0
+    #if
+
+    with profiling.span("find pairs"):
+        pairs = renamer.findPairs(os.curdir, conf.target, conf.extension, conf.recursive)
+    #with
+    ans = 0
+    if conf.verify and pairs:
+        from . import verify
+        with profiling.span("verify all", files=len(pairs)):
+            failed = verify.verifyAll([ renamer.paths(pair) for pair, targetDir in pairs ],
+                                      conf.decodeCheck, conf.jobs)
+        #with
+        for reason in failed.values():
+            print("%s: error: %s; not renaming" % (czsystem.appName(), reason))
+        #for
+        pairs = [ (pair, targetDir) for pair, targetDir in pairs
+                  if renamer.paths(pair) not in failed ]
+        ans = 1 if failed else 0
+    #if
+
+    renames, skipped = renamer.plan(pairs)
+    for pair, reason in skipped:
+        original, converted = renamer.paths(pair)
+        print("%s: skipping %s and %s: %s" % (czsystem.appName(), original, converted, reason))
     #for
+    if conf.dryRun:
+        for src, dst in renames:
+            print("%s -> %s" % (src, dst))
+        #for
+        return ans
+    #if
+    if len(renames) == 0:
+        return ans
+    #if
+    try:
+        journal = renamer.apply(renames)
+    except mover.MoveError:
+        return 1
+    #except
+    print("journal: %s (undo with 'av-rename --undo')" % journal)
+    return ans
 #avRename
 
 
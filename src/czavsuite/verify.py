@@ -0,0 +1,140 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""verification of converted files before av-rename hides the originals"""
+
+from . import probing, profiling
+from czutils.utils import czlogging
+import concurrent.futures
+import subprocess
+
+
+_logger = czlogging.LoggingChannel("czavsuite.verify",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.verify", level, colour=colour)
+#setLoggingOptions
+
+
+# the output may be shorter than the original by this much (whichever is
+# larger) before it counts as truncated
+_TOLERANCE_SECONDS = 1.0
+_TOLERANCE_RATIO = 0.01
+
+SEGMENTS = 3 # segments decoded by the decode check, the last one at the very end
+_SEGMENT_SECONDS = 2.0
+
+
+def _checkDuration(original: str, converted: str):
+    """
+    Returns None if converted is about as long as original, else the reason.
+    """
+    expected = probing.cachedDurationSeconds(original)
+    actual = probing.cachedDurationSeconds(converted)
+    if actual is None:
+        return "%s has no duration (incomplete?)" % converted
+    #if
+    if expected is None:
+        return None # nothing to compare with, e.g. an image
+    #if
+    if expected - actual > max(_TOLERANCE_SECONDS, _TOLERANCE_RATIO * expected):
+        return "%s is %.1f s shorter than %s (truncated, or converted with -t?)" % \
+            (converted, expected - actual, original)
+    #if
+    return None
+#_checkDuration
+
+
+def _checkDecode(converted: str, segments: int):
+    """
+    Decodes a few short segments of converted, the last one at the very end
+    (where truncation shows), and returns None if FFmpeg reports no errors,
+    else the reason.
+    """
+    duration = probing.cachedDurationSeconds(converted) or 0.0
+    starts = [ max(0.0, duration - _SEGMENT_SECONDS) ]
+    starts += [ duration * i / segments for i in range(segments - 1) ]
+    for start in sorted(set(starts)):
+        cmd = [ "ffmpeg", "-nostdin", "-v", "error", "-ss", "%.3f" % start,
+                "-t", str(_SEGMENT_SECONDS), "-i", converted, "-f", "null", "-" ]
+        _logger.info(" ".join(cmd))
+        proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                              check=False)
+        errors = proc.stderr.strip()
+        if proc.returncode != 0 or errors:
+            return "%s: decoding at %.1f s failed: %s" % \
+                (converted, start, errors.splitlines()[0] if errors else proc.returncode)
+        #if
+    #for
+    return None
+#_checkDecode
+
+
+def check(original: str, converted: str, decode=False):
+    """
+    Returns None if converted looks like a complete conversion of original,
+    else the reason why not.
+
+    :param decode:  if True, also decode a few segments of converted
+    """
+    try:
+        with profiling.span("verify", "file", file=converted):
+            reason = _checkDuration(original, converted)
+            if reason is None and decode:
+                reason = _checkDecode(converted, SEGMENTS)
+            #if
+        #with
+        return reason
+    except OSError as e:
+        return str(e)
+    #except
+#check
+
+
+def verifyAll(pairs: list, decode=False, jobs=4) -> dict:
+    """
+    Checks pairs (original, converted) on a pool of jobs threads (the work is
+    done by ffprobe and ffmpeg).
+
+    :returns: { (original, converted): reason } for all pairs that failed
+    """
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        reasons = pool.map(lambda pair: check(pair[0], pair[1], decode), pairs)
+        return { pair: reason for pair, reason in zip(pairs, reasons) if reason is not None }
+    #with
+#verifyAll
+
+
+### aczutro ###################################################################
@@ -0,0 +1,320 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""watch-folder mode of av-convert"""
+
+from . import config, convert
+from czutils.utils import czlogging, czsystem
+import concurrent.futures
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.watch",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.watch", level, colour=colour)
+#setLoggingOptions
+
+
+def _stderr(err: str):
+    print("%s:" % czsystem.appName(), "error:", err, flush=True)
+#_stderr
+
+
+MEDIA_EXTENSIONS = { "3gp", "aac", "avi", "flac", "flv", "m2ts", "m4a", "m4v", "mkv", "mov",
+                     "mp3", "mp4", "mpeg", "mpg", "mts", "ogg", "opus", "ts", "wav", "webm",
+                     "wma", "wmv" }
+
+
+def _isMedia(name: str) -> bool:
+    return czsystem.filenameSplit(name)[1].lower() in MEDIA_EXTENSIONS
+#_isMedia
+
+
+class _Inotify:
+    """Minimal inotify binding (Linux only).  Only used to wake up the watch
+    loop; what actually changed is found out by scanning the directory.
+    """
+    _IN_MODIFY = 0x00000002
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_CLOEXEC = 0o2000000
+    _IN_NONBLOCK = 0o4000
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        #if
+        mask = self._IN_MODIFY | self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch failed", path)
+        #if
+    #__init__
+
+
+    def wait(self, timeout: float) -> None:
+        """
+        Returns after timeout seconds, or earlier if something happened in
+        the watched directory.
+        """
+        ready, _, _ = select.select([ self._fd ], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+                #while
+            except BlockingIOError:
+                pass
+            #except
+        #if
+    #wait
+
+
+    def close(self) -> None:
+        os.close(self._fd)
+    #close
+
+#_Inotify
+
+
+class _Poller:
+    """Fallback for systems without inotify.
+    """
+    def __init__(self, interval: float):
+        self._interval = interval
+    #__init__
+
+
+    def wait(self, timeout: float) -> None:
+        time.sleep(min(timeout, self._interval))
+    #wait
+
+
+    def close(self) -> None:
+        pass
+    #close
+
+#_Poller
+
+
+class _Watcher:
+    def __init__(self,
+                 confWatch: config.Watch,
+                 confGeneral: config.General,
+                 confVideo: config.Video,
+                 confAudio: config.Audio,
+                 confCropping: config.Cropping,
+                 confScaling: config.Scaling,
+                 confCutting: config.Cutting):
+        self.confWatch = confWatch
+        self.confGeneral = confGeneral
+        self.conversion = (confVideo, confAudio, confCropping, confScaling, confCutting)
+        self.control = convert.admissionControl(confGeneral)
+        self.candidates = {} # name -> ((size, mtime), first time seen with this signature)
+        self.handled = {} # name -> (size, mtime) of files that failed or were only dry-run
+        self.produced = set() # names of output files, in case they land in the watched dir
+        self.running = {} # name -> future
+    #__init__
+
+
+    def _retire(self, file: str) -> None:
+        """
+        Gets a converted input file out of the way: moves it to doneDir, or
+        hides it by prefixing a dot (like av-rename does).
+        """
+        if self.confWatch.doneDir is None:
+            target = os.path.join(os.path.dirname(file), ".%s" % os.path.basename(file))
+            print("%s -> %s" % (file, target), flush=True)
+            os.rename(file, target)
+        else:
+            print("%s -> %s" % (file, self.confWatch.doneDir), flush=True)
+            shutil.move(file, self.confWatch.doneDir)
+        #else
+    #_retire
+
+
+    def _job(self, file: str) -> bool:
+        """
+        Converts one file.  Never raises: the daemon must survive any failure.
+        """
+        try:
+            outputFile = convert.prepareOutput(file, self.conversion[0], self.conversion[1],
+                                               self.confWatch.outDir, interactive=False)
+            self.produced.add(os.path.basename(outputFile))
+            returnCode = convert.convertFile(file, outputFile,
+                                             self.confGeneral, *self.conversion,
+                                             control=self.control)
+            if returnCode != 0:
+                return False
+            #if
+            if not self.confGeneral.dry:
+                self._retire(file)
+            #if
+            return not self.confGeneral.dry
+        except Exception as e:
+            _stderr("%s: %s" % (file, e))
+            return False
+        #except
+    #_job
+
+
+    def _reap(self) -> None:
+        for name, future in list(self.running.items()):
+            if future.done():
+                del self.running[name]
+                path = os.path.join(self.confWatch.dir, name)
+                if not future.result():
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        # gone or unreadable: it is looked at again if it reappears
+                        continue
+                    #except
+                    self.handled[name] = (st.st_size, st.st_mtime_ns)
+                #if
+            #if
+        #for
+    #_reap
+
+
+    def _scan(self, pool) -> None:
+        now = time.monotonic()
+        seen = set()
+        for entry in os.scandir(self.confWatch.dir):
+            name = entry.name
+            if name[0] == '.' or name in self.running or name in self.produced \
+                    or not _isMedia(name) or not entry.is_file():
+                continue
+            #if
+            try:
+                st = entry.stat()
+            except OSError as e:
+                # deleted or renamed since scandir() listed it
+                _logger.info("%s: %s" % (name, e))
+                continue
+            #except
+            seen.add(name)
+            signature = (st.st_size, st.st_mtime_ns)
+            if self.handled.get(name) == signature:
+                continue
+            #if
+            previous = self.candidates.get(name)
+            if previous is None or previous[0] != signature:
+                _logger.info("%s: %d bytes" % (name, st.st_size))
+                self.candidates[name] = (signature, now)
+            elif now - previous[1] >= self.confWatch.settle \
+                    and len(self.running) < self.confGeneral.jobs:
+                del self.candidates[name]
+                self.running[name] = pool.submit(self._job,
+                                                 os.path.join(self.confWatch.dir, name))
+            #elif
+        #for
+        for name in list(self.candidates):
+            if name not in seen:
+                del self.candidates[name]
+            #if
+        #for
+    #_scan
+
+
+    def run(self) -> None:
+        czsystem.mkdir(self.confWatch.outDir, p=True)
+        if self.confWatch.doneDir is not None:
+            czsystem.mkdir(self.confWatch.doneDir, p=True)
+        #if
+        try:
+            notifier = _Inotify(self.confWatch.dir)
+        except (OSError, AttributeError, TypeError) as e:
+            _logger.warning("inotify unavailable (%s); polling" % e)
+            notifier = _Poller(self.confWatch.poll)
+        #except
+
+        print("watching %s (Ctrl-C to stop)" % self.confWatch.dir, flush=True)
+        pool = concurrent.futures.ThreadPoolExecutor(self.confGeneral.jobs)
+        try:
+            while True:
+                self._reap()
+                self._scan(pool)
+                if self.candidates or self.running:
+                    timeout = max(0.5, min(self.confWatch.settle / 2, self.confWatch.poll))
+                else:
+                    timeout = 60.0
+                #else
+                notifier.wait(timeout)
+            #while
+        except KeyboardInterrupt:
+            print()
+            print("waiting for %d running jobs to finish" % len(self.running), flush=True)
+        finally:
+            pool.shutdown(wait=True)
+            notifier.close()
+        #finally
+    #run
+
+#_Watcher
+
+
+def avWatch(confWatch: config.Watch,
+            confGeneral: config.General,
+            confVideo: config.Video,
+            confAudio: config.Audio,
+            confCropping: config.Cropping,
+            confScaling: config.Scaling,
+            confCutting: config.Cutting):
+    """
+    Watches directory confWatch.dir and converts every media file that appears
+    in it, once the file has stopped growing for confWatch.settle seconds.  Up
+    to confGeneral.jobs files are converted at the same time.  Failed files are
+    reported and tried again only if they change.  Runs until interrupted.
+    """
+    if not os.path.isdir(confWatch.dir):
+        raise convert.ConvertError("%s: not a directory" % confWatch.dir)
+    #if
+    _Watcher(confWatch, confGeneral, confVideo, confAudio,
+             confCropping, confScaling, confCutting).run()
+#avWatch
+
+
+### aczutro ###################################################################
@@ -0,0 +1,407 @@
+# czavsuite - a suite of useful scripts to serialise FFmpeg jobs
+#
+# Copyright 2023 - present Alexander Czutro, github@czutro.ch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################### aczutro ###
+
+"""directory-backed work queue for av-convert jobs"""
+
+from . import config, convert
+from czutils.utils import czlogging, czsystem
+import collections
+import json
+import os
+import socket
+import threading
+import time
+
+
+_logger = czlogging.LoggingChannel("czavsuite.workqueue",
+                                   czlogging.LoggingLevel.SILENT,
+                                   colour=True)
+
+
+def setLoggingOptions(level: int, colour=True) -> None:
+    """
+    Sets this module's logging level.  If not called, the logging level is
+    SILENT.
+
+    :param level: One of the following:
+                  - czlogging.LoggingLevel.INFO
+                  - czlogging.LoggingLevel.WARNING
+                  - czlogging.LoggingLevel.ERROR
+                  - czlogging.LoggingLevel.SILENT
+
+    :param colour: If true, use colour in log headers.
+    """
+    global _logger
+    _logger = czlogging.LoggingChannel("czavsuite.workqueue", level, colour=colour)
+#setLoggingOptions
+
+
+# a job that has been claimed this many times without producing a result
+# (i.e. its workers keep dying) is moved to the failed directory
+_MAX_ATTEMPTS = 3
+
+# number of console lines (which include the end of FFmpeg's output if it
+# fails) kept in the result of a job
+_OUTPUT_TAIL = 50
+
+
+class WorkQueue:
+    """A job queue that lives in a directory, so that several worker processes,
+    possibly on several hosts that mount the same storage, can drain it.
+
+    Every job is a JSON file that moves through the subdirectories
+    pending -> claimed -> done | failed.  All state changes are atomic renames
+    within the queue directory, so no locking and no network service are
+    needed.  A worker claims a job by renaming it into 'claimed' and keeps the
+    claim alive by touching the file; a claim that has not been touched for
+    longer than the lease is considered abandoned and is moved back to
+    'pending'.
+
+    Constructor params:
+
+    :param path:   queue directory (created if it does not exist)
+    :param lease:  seconds after which an untouched claim expires
+    """
+    PENDING, CLAIMED, DONE, FAILED, TMP = "pending", "claimed", "done", "failed", "tmp"
+
+    def __init__(self, path: str, lease=600.0):
+        self.path = path
+        self.lease = lease
+        for sub in [ self.PENDING, self.CLAIMED, self.DONE, self.FAILED, self.TMP ]:
+            czsystem.mkdir(os.path.join(path, sub), p=True)
+        #for
+        self._worker = "%s-%d" % (socket.gethostname(), os.getpid())
+        self._counter = 0
+    #__init__
+
+
+    def _path(self, state: str, name: str) -> str:
+        return os.path.join(self.path, state, name)
+    #_path
+
+
+    def _publish(self, state: str, name: str, job: dict) -> None:
+        """
+        Writes a job file into the tmp directory and renames it into state, so
+        that no one ever sees a partially written job.
+        """
+        tmp = self._path(self.TMP, "%s.%s" % (self._worker, name))
+        with open(tmp, "w") as buf:
+            json.dump(job, buf, indent=1)
+        #with
+        os.replace(tmp, self._path(state, name))
+    #_publish
+
+
+    def _read(self, state: str, name: str) -> dict:
+        with open(self._path(state, name), "r") as buf:
+            return json.load(buf)
+        #with
+    #_read
+
+
+    def names(self, state: str) -> list:
+        """
+        Returns the job names in state, oldest first.
+        """
+        return sorted(name for name in os.listdir(os.path.join(self.path, state))
+                      if name.endswith(".json"))
+    #names
+
+
+    def enqueue(self, job: dict) -> str:
+        """
+        Adds a job to the queue.  Returns its name.
+        """
+        self._counter += 1
+        name = "%d-%s-%04d.json" % (time.time_ns(), self._worker, self._counter)
+        job = dict(job, attempts=0, enqueued=time.time())
+        self._publish(self.PENDING, name, job)
+        _logger.info("enqueued", name)
+        return name
+    #enqueue
+
+
+    def claim(self):
+        """
+        Claims the oldest pending job.
+
+        :returns: (name, job), or None if there are no pending jobs
+        """
+        for name in self.names(self.PENDING):
+            try:
+                # touch first: rename keeps the mtime, which is the lease clock
+                os.utime(self._path(self.PENDING, name))
+                os.rename(self._path(self.PENDING, name), self._path(self.CLAIMED, name))
+            except FileNotFoundError:
+                continue # another worker was faster
+            #except
+            job = self._read(self.CLAIMED, name)
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["worker"] = self._worker
+            self._publish(self.CLAIMED, name, job)
+            _logger.info("claimed", name)
+            return name, job
+        #for
+        return None
+    #claim
+
+
+    def renew(self, name: str) -> bool:
+        """
+        Extends the lease of a claimed job.  Returns False if the claim has been
+        lost (i.e. the lease expired and the job was moved back to pending).
+        """
+        try:
+            os.utime(self._path(self.CLAIMED, name))
+            return True
+        except FileNotFoundError:
+            return False
+        #except
+    #renew
+
+
+    def complete(self, name: str, job: dict, success: bool) -> bool:
+        """
+        Drops the claim and writes the result of a job to 'done' or 'failed'.
+        If the claim has been lost (its lease expired and the job was moved
+        back to pending, and possibly claimed by another worker), nothing is
+        written, so that a job never gets two results.
+
+        :returns: False if the claim was lost
+        """
+        # move the claim out of the way first: once it is in tmp, no one else
+        # can reclaim it
+        held = self._path(self.TMP, "%s.%s.claim" % (self._worker, name))
+        try:
+            os.rename(self._path(self.CLAIMED, name), held)
+        except FileNotFoundError:
+            _logger.warning("claim on %s was lost before the job finished" % name)
+            return False
+        #except
+        try:
+            claim = self._read(self.TMP, os.path.basename(held))
+        except ValueError:
+            claim = {}
+        #except
+        if claim.get("worker") != self._worker or claim.get("attempts") != job.get("attempts"):
+            # reclaimed and claimed again by someone else: give it back
+            os.rename(held, self._path(self.CLAIMED, name))
+            _logger.warning("claim on %s was taken over by %s" % (name, claim.get("worker")))
+            return False
+        #if
+        self._publish(self.DONE if success else self.FAILED, name, job)
+        os.remove(held)
+        return True
+    #complete
+
+
+    def _now(self) -> float:
+        """
+        Returns the current time of the storage the queue lives on, i.e. the
+        mtime of a file that has just been touched.  Claim mtimes are set by
+        the storage too, so hosts with skewed clocks agree on the age of a
+        claim.
+        """
+        path = self._path(self.TMP, "%s.clock" % self._worker)
+        with open(path, "a"):
+            pass
+        #with
+        os.utime(path)
+        return os.stat(path).st_mtime
+    #_now
+
+
+    def reclaimExpired(self) -> int:
+        """
+        Moves claims whose lease has expired back to 'pending', or to 'failed'
+        if the job has been tried too often.  Returns the number of jobs moved.
+        """
+        ans = 0
+        now = self._now()
+        for name in self.names(self.CLAIMED):
+            path = self._path(self.CLAIMED, name)
+            try:
+                if now - os.stat(path).st_mtime <= self.lease:
+                    continue
+                #if
+                job = self._read(self.CLAIMED, name)
+                if job.get("attempts", 0) >= _MAX_ATTEMPTS:
+                    # move out of the way first, so only one worker gets here
+                    os.rename(path, self._path(self.TMP, name))
+                    job["error"] = "abandoned by %d workers" % job["attempts"]
+                    self._publish(self.FAILED, name, job)
+                    os.remove(self._path(self.TMP, name))
+                else:
+                    os.rename(path, self._path(self.PENDING, name))
+                #else
+            except (FileNotFoundError, ValueError):
+                continue # claim renewed, completed or reclaimed by someone else
+            #except
+            _logger.info("reclaimed", name)
+            ans += 1
+        #for
+        return ans
+    #reclaimExpired
+
+#WorkQueue
+
+
+def _settings(confVideo: config.Video,
+              confAudio: config.Audio,
+              confCropping: config.Cropping,
+              confScaling: config.Scaling,
+              confCutting: config.Cutting) -> dict:
+    return { "video": vars(confVideo),
+             "audio": vars(confAudio),
+             "cropping": vars(confCropping),
+             "scaling": vars(confScaling),
+             "cutting": vars(confCutting) }
+#_settings
+
+
+def _fromDict(cls, values: dict):
+    ans = cls()
+    ans.__dict__.update(values)
+    return ans
+#_fromDict
+
+
+def avEnqueue(files: list,
+              queuePath: str,
+              confGeneral: config.General,
+              confVideo: config.Video,
+              confAudio: config.Audio,
+              confCropping: config.Cropping,
+              confScaling: config.Scaling,
+              confCutting: config.Cutting,
+              lease=600.0):
+    """
+    Adds one av-convert job per file to the queue in queuePath.  File names
+    are stored as absolute paths, so all workers must see the files under the
+    same path.
+    """
+    Q = WorkQueue(queuePath, lease)
+    settings = _settings(confVideo, confAudio, confCropping, confScaling, confCutting)
+    for file in files:
+        outputFile = convert.prepareOutput(file, confVideo, confAudio)
+        job = { "file": os.path.abspath(file),
+                "output": os.path.abspath(outputFile),
+                "settings": settings }
+        if confGeneral.dry:
+            print("would enqueue %s -> %s" % (file, outputFile))
+        else:
+            print("%s: %s" % (Q.enqueue(job), file))
+        #else
+    #for
+#avEnqueue
+
+
+def _heartbeat(Q: WorkQueue, name: str, stop: threading.Event) -> None:
+    while not stop.wait(Q.lease / 4):
+        if not Q.renew(name):
+            _logger.warning("lost claim on", name)
+            return
+        #if
+    #while
+#_heartbeat
+
+
+def _runJob(Q: WorkQueue, name: str, job: dict, confGeneral: config.General, control) -> bool:
+    settings = job["settings"]
+    outputFile = job["output"]
+    output = collections.deque(maxlen=_OUTPUT_TAIL)
+    result = { "worker": job["worker"], "started": time.time() }
+
+    def log(line: str) -> None:
+        print(line, flush=True)
+        output.append(line)
+    #log
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(Q, name, stop), daemon=True)
+    heartbeat.start()
+    try:
+        if os.path.exists(outputFile):
+            if job["attempts"] > 1:
+                os.remove(outputFile) # left behind by a worker that died
+            else:
+                raise convert.ConvertError("file %s already exists" % outputFile)
+            #else
+        #if
+        returnCode = convert.convertFile(job["file"], outputFile, confGeneral,
+                                         _fromDict(config.Video, settings["video"]),
+                                         _fromDict(config.Audio, settings["audio"]),
+                                         _fromDict(config.Cropping, settings["cropping"]),
+                                         _fromDict(config.Scaling, settings["scaling"]),
+                                         _fromDict(config.Cutting, settings["cutting"]),
+                                         control, log)
+        result["returnCode"] = returnCode
+        result["output"] = list(output)
+    except (convert.ConvertError, OSError) as e:
+        result["returnCode"] = None
+        result["error"] = str(e)
+    finally:
+        stop.set()
+        heartbeat.join()
+    #finally
+
+    result["finished"] = time.time()
+    job["result"] = result
+    success = result["returnCode"] == 0
+    if not Q.complete(name, job, success):
+        print("%s: claim lost, result discarded" % name, flush=True)
+    #if
+    return success
+#_runJob
+
+
+def avWorker(queuePath: str, confGeneral: config.General, lease=600.0) -> int:
+    """
+    Claims and runs jobs from the queue in queuePath until no jobs are pending
+    or claimed.  While other workers still hold claims, keeps polling, so that
+    their jobs are taken over if they die.
+
+    :returns: 0 if all jobs run by this worker succeeded, 1 otherwise
+    """
+    Q = WorkQueue(queuePath, lease)
+    control = convert.admissionControl(confGeneral)
+    pollInterval = min(10.0, lease / 4)
+    ans = 0
+    while True:
+        Q.reclaimExpired()
+        claimed = Q.claim()
+        if claimed is None:
+            if len(Q.names(Q.PENDING)) + len(Q.names(Q.CLAIMED)) == 0:
+                break
+            #if
+            time.sleep(pollInterval)
+            continue
+        #if
+        name, job = claimed
+        print("%s: %s (attempt %d)" % (name, job["file"], job["attempts"]), flush=True)
+        if not _runJob(Q, name, job, confGeneral, control):
+            ans = 1
+        #if
+    #while
+    return ans
+#avWorker
+
+
+### aczutro ###################################################################